@@ -0,0 +1,266 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Alert dispatching. Matches are queued as Alert records from any thread and a
+single dispatcher thread groups them into batches, by count or by time, and
+posts each batch to every enabled chat platform over a long-lived session.
+Messages longer than a platform accepts are split, failed posts are retried
+with exponential backoff, and whatever is queued is sent on shutdown.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import requests
+
+
+logger = logging.getLogger("certpipe.alerts")
+
+Alert = namedtuple('Alert', ['keyword', 'fuzzer', 'domain', 'scan_results_url'])
+
+MATTERMOST_ICON_URL = "https://www.mattermost.org/wp-content/uploads/2016/04/icon.png"
+
+
+def format_alert(alert):
+    text = "Keyword: " + alert.keyword + "\nDomain: " + alert.domain
+
+    if alert.fuzzer:
+        text = text + "\nFuzzer: " + alert.fuzzer
+
+    if alert.scan_results_url:
+        text = text + "\nScan: " + alert.scan_results_url
+
+    return text + "\n\n"
+
+
+# Packs formatted alerts into as few messages as possible without going over limit characters.
+# Alerts are never split across messages unless a single alert is over the limit by itself.
+def split_messages(texts, limit):
+    messages = []
+    current = ""
+    for text in texts:
+        while len(text) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(text[:limit])
+            text = text[limit:]
+        if len(current) + len(text) > limit:
+            messages.append(current)
+            current = ""
+        current += text
+    if current:
+        messages.append(current)
+    return messages
+
+
+# Raised by a sender when a post fails and is worth retrying. retry_after is the wait the platform asked for, if any.
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.retry_after = retry_after
+
+
+def _retry_after(resp):
+    try:
+        return float(resp.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+# Posts to a Slack channel with the chat.postMessage Web API method
+class SlackSender():
+    name = "Slack"
+    api_url = "https://slack.com/api/chat.postMessage"
+
+    def __init__(self, token, channel, limit=4000, timeout=30):
+        self.channel = channel
+        self.limit = limit
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': 'Bearer ' + token})
+
+    def send(self, text):
+        try:
+            resp = self.session.post(self.api_url, json={'channel': self.channel, 'text': text}, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise RetryableError(str(e))
+
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise RetryableError("HTTP {}".format(resp.status_code), _retry_after(resp))
+
+        try:
+            body = resp.json() if resp.content else {}
+        except ValueError:
+            logger.error("Message failed to post to Slack: HTTP {} response is not JSON".format(resp.status_code))
+            return False
+        if not body.get('ok'):
+            if body.get('error') == 'ratelimited':
+                raise RetryableError("ratelimited", _retry_after(resp))
+            # Bad token, unknown channel and the like will not get better by retrying
+            logger.error("Message failed to post to Slack: {}".format(body.get('error')))
+            return False
+
+        logger.debug("Message posted to Slack:\n {}".format(text))
+        return True
+
+
+# Posts to a Mattermost channel using the Incoming Webhooks feature
+class MattermostSender():
+    name = "Mattermost"
+
+    def __init__(self, webhook_url, limit=16383, timeout=30):
+        self.webhook_url = webhook_url
+        self.limit = limit
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, text):
+        payload = {"username": "CertPipe", "icon_url": MATTERMOST_ICON_URL, "text": text}
+        try:
+            resp = self.session.post(self.webhook_url, verify=True, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise RetryableError(str(e))
+
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise RetryableError("HTTP {}".format(resp.status_code), _retry_after(resp))
+
+        if not resp.ok:
+            logger.error("Message failed to post to Mattermost: HTTP {}".format(resp.status_code))
+            return False
+
+        logger.debug("Message posted to Mattermost:\n {}".format(text))
+        return True
+
+
+class AlertDispatcher():
+    def __init__(self, senders, batch_size=50, batch_interval=30, max_retries=5, backoff=2, queue_size=100000):
+        self.senders = senders
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="alert-dispatcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Safe to call from any thread, never blocks
+    def put(self, alert):
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Alert queue full, alert dropped for {}".format(alert.domain))
+
+    # Sends everything still queued, then stops the dispatcher thread
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped
+        }
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._dispatch(batch)
+
+        # Shutdown, flush whatever is left
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._dispatch(batch)
+
+    # Waits for the first alert, then collects more until the batch is full or batch_interval has passed
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.time() + self.batch_interval
+        while len(batch) < self.batch_size and not self.stop_event.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                pass
+        return batch
+
+    # Nothing raised here may end the dispatcher thread, it would silently stop all alerting
+    def _dispatch(self, batch):
+        texts = []
+        for alert in batch:
+            try:
+                texts.append(format_alert(alert))
+            except Exception:
+                self.failed += 1
+                logger.exception("Alert could not be formatted: {!r}".format(alert))
+
+        for sender in self.senders:
+            for message in split_messages(texts, sender.limit):
+                if self._send_with_retry(sender, message):
+                    self.sent += 1
+                    logger.info("The following alert message was sent to {}:\n\n{}".format(sender.name, message))
+                else:
+                    self.failed += 1
+
+    def _send_with_retry(self, sender, message):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return sender.send(message)
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    logger.error("Message failed to post to {} after {} attempts: {}".format(sender.name, attempt + 1, e))
+                    return False
+                wait = e.retry_after if e.retry_after is not None else self.backoff ** attempt
+                logger.warning("Posting to {} failed ({}), retrying in {}s".format(sender.name, e, wait))
+                # Not interrupted by stop_event, the shutdown flush still retries
+                time.sleep(wait)
+            except Exception:
+                logger.exception("Message failed to post to {}".format(sender.name))
+                return False
+        return False
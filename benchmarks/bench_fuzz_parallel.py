@@ -0,0 +1,80 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Measures how keyword fuzzing scales with the number of worker processes, and
+checks the output is identical to the serial result for every worker count.
+
+USAGE:
+
+    python benchmarks/bench_fuzz_parallel.py [--keywords 200] [--workers 1 2 4 8]
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fuzzer import fuzz_keywords_parallel
+
+
+def synthetic_keywords(count, seed):
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(5, 14))) for _ in range(count)]
+
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = sorted(set([1, 2, 4, 8, cores]))
+    default_workers = [w for w in default_workers if w <= cores]
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keywords', type=int, default=200)
+    parser.add_argument('--workers', nargs='+', type=int, default=default_workers)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    keywords = synthetic_keywords(args.keywords, args.seed)
+    print("{} keywords, {} CPU cores".format(len(keywords), cores))
+
+    baseline = None
+    baseline_time = None
+    for workers in args.workers:
+        start = time.perf_counter()
+        result = fuzz_keywords_parallel(keywords, workers=workers)
+        elapsed = time.perf_counter() - start
+
+        if baseline is None:
+            baseline = result
+            baseline_time = elapsed
+
+        variations = sum(len(domains) for _, fuzzed in result for domains in fuzzed.values())
+        print("workers: {:>3}  {:8.3f}s  speedup: {:5.2f}x  variations: {}  identical: {}".format(
+            workers, elapsed, baseline_time / elapsed, variations, result == baseline))
+
+
+if __name__ == '__main__':
+    main()
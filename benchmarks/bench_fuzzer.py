@@ -0,0 +1,82 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Measures DomainFuzz generation time and peak memory per keyword length.
+
+USAGE:
+
+    python benchmarks/bench_fuzzer.py [--lengths 4 8 12 16] [--homoglyph-depth 2] [--max-per-fuzzer 0]
+
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fuzzer import DomainFuzz
+
+
+# Brand-like keyword of the given length, repeating letters the way real brand names do
+def keyword_of_length(length, base='microsoftonlinebankingportal'):
+    return (base * (length // len(base) + 1))[:length]
+
+
+def measure(keyword, max_per_fuzzer, homoglyph_depth, streaming):
+    domain_fuzz = DomainFuzz(keyword, max_per_fuzzer, homoglyph_depth)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if streaming:
+        count = sum(1 for _ in domain_fuzz.fuzz())
+    else:
+        count = sum(len(domains) for domains in domain_fuzz.generate().values())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lengths', nargs='+', type=int, default=[4, 6, 8, 10, 12, 14, 16])
+    parser.add_argument('--homoglyph-depth', type=int, default=2)
+    parser.add_argument('--max-per-fuzzer', type=int, default=0)
+    args = parser.parse_args()
+
+    print("{:>6}  {:<18} {:>10} {:>12} {:>14} {:>14}".format(
+        "length", "keyword", "variations", "seconds", "peak generate", "peak stream"))
+
+    for length in args.lengths:
+        keyword = keyword_of_length(length)
+        count, elapsed, peak = measure(keyword, args.max_per_fuzzer, args.homoglyph_depth, streaming=False)
+        _, _, stream_peak = measure(keyword, args.max_per_fuzzer, args.homoglyph_depth, streaming=True)
+        print("{:>6}  {:<18} {:>10} {:>12.4f} {:>12.1f}KB {:>12.1f}KB".format(
+            length, keyword[:18], count, elapsed, peak / 1024.0, stream_peak / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Compares edit-distance look-alike matching (LookalikeIndex) against expanding the keywords with the single-edit fuzzers.
+
+For each keyword count it reports build time, pattern/index size, domains/sec, and recall on look-alikes made with
+one and two random typos, placed as their own label ('paypa1.com', 'secure-paypa1.net') or inside a longer label
+('paypa1login.com'), plus the share of random domains wrongly reported.
+
+USAGE:
+
+    python benchmarks/bench_lookalike.py [--keyword-counts 10 100 1000] [--domains 5000]
+
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fuzzer import DomainFuzz, variation_pairs
+from lookalike import ADJACENT_KEYS, EDIT_FUZZERS, LookalikeIndex
+from matcher import KeywordMatcher
+
+
+BRANDS = ['google', 'amazon', 'facebook', 'paypal', 'microsoft', 'netflix', 'linkedin', 'dropbox', 'github', 'twitter']
+SUFFIXES = ['.com', '.net', '.org', '.io', '.co.uk', '.de']
+
+
+def make_keywords(count, rng):
+    keywords = BRANDS[:count]
+    while len(keywords) < count:
+        keywords.append(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(6, 12))))
+    return keywords
+
+
+# One random typo: a neighbouring or random key, an extra or missing letter, or two letters swapped
+def typo(word, rng):
+    i = rng.randrange(len(word))
+    kind = rng.choice(['adjacent', 'replace', 'insert', 'delete', 'swap'])
+    if kind == 'adjacent' and word[i] in ADJACENT_KEYS:
+        return word[:i] + rng.choice(sorted(ADJACENT_KEYS[word[i]])) + word[i+1:]
+    if kind == 'insert':
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i:]
+    if kind == 'delete' and len(word) > 2:
+        return word[:i] + word[i+1:]
+    if kind == 'swap' and i < len(word) - 1:
+        return word[:i] + word[i+1] + word[i] + word[i+2:]
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i+1:]
+
+
+def lookalike(keyword, edits, rng):
+    while True:
+        word = keyword
+        for _ in range(edits):
+            word = typo(word, rng)
+        if word != keyword:
+            return word
+
+
+def random_label(rng):
+    return ''.join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(rng.randint(4, 16)))
+
+
+def test_sets(keywords, count, rng):
+    sets = {}
+    for edits in (1, 2):
+        sets['{} edit, own label'.format(edits)] = [
+            rng.choice(['', 'www.', 'secure-', 'login.']) + lookalike(rng.choice(keywords), edits, rng) + rng.choice(SUFFIXES)
+            for _ in range(count)]
+        sets['{} edit, in label'.format(edits)] = [
+            lookalike(rng.choice(keywords), edits, rng) + rng.choice(['login', 'account', 'support']) + rng.choice(SUFFIXES)
+            for _ in range(count)]
+    sets['random'] = [rng.choice(['', 'www.', 'mail.']) + random_label(rng) + rng.choice(SUFFIXES) for _ in range(count)]
+    return sets
+
+
+def measure(match, domains):
+    start = time.perf_counter()
+    hits = sum(1 for domain in domains if match(domain))
+    return hits / float(len(domains)), len(domains) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keyword-counts', nargs='+', type=int, default=[10, 100, 1000])
+    parser.add_argument('--domains', type=int, default=5000, help="Domains in each test set")
+    parser.add_argument('--max-edits', type=int, default=2)
+    parser.add_argument('--max-distance', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for count in args.keyword_counts:
+        keywords = make_keywords(count, rng)
+
+        start = time.perf_counter()
+        fuzzed = [(keyword, 'Original*') for keyword in keywords]
+        for keyword in keywords:
+            fuzzed.extend(variation_pairs(DomainFuzz(keyword).generate(EDIT_FUZZERS)))
+        matcher = KeywordMatcher((), (), fuzzed)
+        expand_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        exact = KeywordMatcher((), (), [(keyword, 'Original*') for keyword in keywords])
+        index = LookalikeIndex(keywords, args.max_edits, args.max_distance, min_length=1)
+        index_build = time.perf_counter() - start
+
+        print("\n{} keywords".format(count))
+        print("  expand:        {:8} patterns, built in {:.3f}s".format(len(matcher), expand_build))
+        print("  edit-distance: {:8} index entries, built in {:.3f}s".format(len(index), index_build))
+        print("  {:22} {:>14} {:>14} {:>16} {:>16}".format("test set", "expand", "edit-distance", "expand dom/s", "edit dom/s"))
+
+        for name, domains in sorted(test_sets(keywords, args.domains, rng).items()):
+            # A fresh index each time so one set's cached tokens do not speed up the next
+            index = LookalikeIndex(keywords, args.max_edits, args.max_distance, min_length=1)
+            expand_rate, expand_speed = measure(matcher.match, domains)
+            index_rate, index_speed = measure(lambda d: exact.match(d) or index.match(d), domains)
+            print("  {:22} {:>13.1f}% {:>13.1f}% {:>16.0f} {:>16.0f}".format(
+                name, expand_rate * 100, index_rate * 100, expand_speed, index_speed))
+
+
+if __name__ == '__main__':
+    main()
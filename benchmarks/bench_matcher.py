@@ -0,0 +1,126 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Compares the Aho-Corasick KeywordMatcher against the original linear keyword scan.
+
+USAGE:
+
+    python benchmarks/bench_matcher.py [--keywords google amazon facebook] [--domains 5000]
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fuzzer import DomainFuzz, variation_pairs
+from matcher import KeywordMatcher
+
+
+# The check_match logic from before the matcher, kept here as the baseline
+def linear_check_match(domain, ignore_keywords, no_fuzz_keywords, fuzzed_keywords):
+    for keyword in ignore_keywords:
+        if keyword in domain:
+            return False, ""
+
+    for keyword in no_fuzz_keywords:
+        if keyword in domain:
+            return True, keyword
+
+    for keyword in fuzzed_keywords:
+        if keyword in domain:
+            return True, keyword
+
+    return False, ""
+
+
+def build_fuzzed(keywords):
+    fuzzed = [(keyword, 'Original*') for keyword in keywords]
+    for keyword in keywords:
+        fuzzed.extend(variation_pairs(DomainFuzz(keyword).generate()))
+    return fuzzed
+
+
+# Mostly random CT-looking names with a sprinkling of real fuzzed hits
+def synthetic_domains(fuzzed, count, match_rate, seed):
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789-'
+    suffixes = ['.com', '.net', '.org', '.io', '.co.uk', '.cloudfront.net', '.azurewebsites.net']
+    domains = []
+    for _ in range(count):
+        label = ''.join(rng.choice(alphabet) for _ in range(rng.randint(6, 20))).strip('-') or 'x'
+        if rng.random() < match_rate:
+            label = label[:4] + rng.choice(fuzzed)[0] + label[4:]
+        domains.append(rng.choice(['', 'www.', 'mail.', 'api.']) + label + rng.choice(suffixes))
+    return domains
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keywords', nargs='+', default=['google', 'amazon', 'facebook'])
+    parser.add_argument('--no-fuzz-keywords', nargs='*', default=['userdata', 'admin', 'database'])
+    parser.add_argument('--ignore-keywords', nargs='*', default=[])
+    parser.add_argument('--domains', type=int, default=5000)
+    parser.add_argument('--match-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    fuzzed = build_fuzzed(args.keywords)
+    fuzz_time = time.perf_counter() - start
+    fuzzed_strings = [keyword for keyword, _ in fuzzed]
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(args.ignore_keywords, args.no_fuzz_keywords, fuzzed)
+    build_time = time.perf_counter() - start
+
+    domains = synthetic_domains(fuzzed, args.domains, args.match_rate, args.seed)
+
+    start = time.perf_counter()
+    linear_results = [linear_check_match(d, args.ignore_keywords, args.no_fuzz_keywords, fuzzed_strings) for d in domains]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher_results = [matcher.match(d) for d in domains]
+    matcher_time = time.perf_counter() - start
+
+    mismatches = 0
+    for linear, match in zip(linear_results, matcher_results):
+        if linear != ((True, match.keyword) if match else (False, "")):
+            mismatches += 1
+
+    print("keywords: {}  patterns: {}  domains: {}  matches: {}".format(
+        len(args.keywords), len(matcher), len(domains), sum(1 for m in matcher_results if m)))
+    print("fuzz: {:.3f}s  matcher build: {:.3f}s".format(fuzz_time, build_time))
+    print("linear scan:  {:10.1f} domains/sec".format(len(domains) / linear_time))
+    print("aho-corasick: {:10.1f} domains/sec  ({:.1f}x)".format(len(domains) / matcher_time, linear_time / matcher_time))
+    print("result mismatches: {}".format(mismatches))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+End-to-end benchmark of the CertPipe message pipeline.
+
+Drives CertPipe.certstream_callback with synthetic (or recorded) certificate_update
+messages at several keyword list sizes and match rates, and reports for each run:
+
+- startup time of fuzz_keywords and the matcher build
+- messages/sec and domains/sec through certstream_callback
+- per-domain check_match latency percentiles
+- growth of the seen_domains store
+- certificates skipped as duplicates and the match memo hit rate
+
+All outputs (CSV, Slack, Mattermost, URLScan.io) are disabled so only the
+pipeline itself is measured. Results can be written as JSON and compared
+against an earlier run.
+
+USAGE:
+
+    python benchmarks/bench_pipeline.py [--keyword-counts 3 30 100] [--match-rates 0.001 0.01]
+                                        [--messages 5000] [--duplicate-rate 0.3] [--recording file.ndjson.gz]
+                                        [--homoglyph-matching expand|skeleton] [--lookalike-matching expand|edit-distance]
+                                        [--json results.json] [--compare baseline.json]
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import config as cfg
+import certpipe
+from sources import read_recording
+
+
+BRANDS = ['google', 'amazon', 'facebook', 'paypal', 'microsoft', 'apple', 'netflix', 'linkedin', 'dropbox', 'github']
+SUFFIXES = ['.com', '.net', '.org', '.io', '.co.uk', '.de', '.cloudfront.net', '.azurewebsites.net', '.herokuapp.com']
+
+# Metrics where a bigger number is better, used when comparing runs
+HIGHER_IS_BETTER = set(['messages_per_sec', 'domains_per_sec'])
+
+
+def make_keywords(count, seed):
+    rng = random.Random(seed)
+    keywords = BRANDS[:count]
+    while len(keywords) < count:
+        keywords.append(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(5, 12))))
+    return keywords
+
+
+def random_label(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(rng.randint(4, 16)))
+
+
+# Certificates with 1-6 SANs, a match_rate share of the domains embed one of the fuzzed keywords.
+# A duplicate_rate share of the messages resend an earlier certificate, as another CT log (or the precertificate) would.
+def synthetic_messages(count, fuzzed, match_rate, seed, duplicate_rate=0.0):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        if messages and rng.random() < duplicate_rate:
+            copy = json.loads(json.dumps(rng.choice(messages)))
+            copy['data']['cert_index'] = i
+            messages.append(copy)
+            continue
+
+        domains = []
+        base = random_label(rng) + rng.choice(SUFFIXES)
+        for _ in range(rng.randint(1, 6)):
+            domain = rng.choice(['', 'www.', 'mail.', '*.', 'api.', random_label(rng) + '.']) + base
+            if rng.random() < match_rate:
+                domain = domain.replace(base, rng.choice(fuzzed)[0] + '-' + base, 1)
+            domains.append(domain)
+        messages.append({
+            'message_type': 'certificate_update',
+            'data': {
+                'update_type': 'X509LogEntry',
+                'cert_index': i,
+                'seen': time.time(),
+                'leaf_cert': {'all_domains': domains, 'serial_number': '{:032X}'.format(i),
+                              'issuer': {'aggregated': '/C=US/O=Benchmark CA/CN=Benchmark CA R1'}}
+            }
+        })
+    return messages
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(keywords, messages_for, match_rate):
+    cfg.keywords = keywords
+    cfg.enable_fuzz_cache = False
+
+    # A fresh pipe each run, so the dedup stores and the match memo start empty
+    pipe = certpipe.CertPipe(cfg)
+
+    start = time.perf_counter()
+    fuzzed = pipe.fuzz_keywords(cfg.keywords)
+    fuzz_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipe.fuzzed_keywords = fuzzed
+    pipe.keyword_index = pipe.build_keyword_index(fuzzed)
+    build_time = time.perf_counter() - start
+
+    messages = messages_for(fuzzed, match_rate)
+    domains = [d[2:] if d.startswith('*') else d
+               for m in messages if m.get('message_type') == 'certificate_update'
+               for d in m['data']['leaf_cert']['all_domains']]
+
+    memory_before = pipe.seen_domains.memory_bytes()
+
+    start = time.perf_counter()
+    for message in messages:
+        pipe.certstream_callback(message, None)
+    elapsed = time.perf_counter() - start
+
+    memory_after = pipe.seen_domains.memory_bytes()
+
+    # Latency is measured in a separate pass so the timer calls do not skew the throughput figures
+    latencies = []
+    check_match = pipe.check_match
+    clock = time.perf_counter
+    for domain in domains:
+        t = clock()
+        check_match(domain)
+        latencies.append(clock() - t)
+    latencies.sort()
+
+    return {
+        'keywords': len(keywords),
+        'patterns': len(pipe.keyword_index.matcher),
+        'match_rate': match_rate,
+        'messages': len(messages),
+        'domains': len(domains),
+        'matches': pipe.seen_domains.stats()['entries'],
+        'fuzz_keywords_sec': fuzz_time,
+        'matcher_build_sec': build_time,
+        'messages_per_sec': len(messages) / elapsed if elapsed else 0.0,
+        'domains_per_sec': len(domains) / elapsed if elapsed else 0.0,
+        'check_match_p50_us': percentile(latencies, 0.50) * 1e6,
+        'check_match_p90_us': percentile(latencies, 0.90) * 1e6,
+        'check_match_p99_us': percentile(latencies, 0.99) * 1e6,
+        'check_match_max_us': percentile(latencies, 1.0) * 1e6,
+        'seen_domains_growth_bytes': memory_after - memory_before,
+        'duplicate_certificates': pipe.seen_certificates.stats()['hits'] if pipe.seen_certificates is not None else 0,
+        'match_memo_hit_rate': pipe.match_memo.stats()['hit_rate'] if pipe.match_memo is not None else 0.0
+    }
+
+
+def run_key(result):
+    return "{}:{}".format(result['keywords'], result['match_rate'])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print("{:>8} {:>9} {:>10} {:>8} {:>10} {:>12} {:>9} {:>9} {:>9} {:>12} {:>9} {:>9}".format(
+        "keywords", "patterns", "match_rate", "fuzz_s", "msg/s", "domains/s", "p50_us", "p99_us", "max_us", "seen_bytes",
+        "dup_certs", "memo_hit"))
+    for r in results:
+        print("{:>8} {:>9} {:>10} {:>8.3f} {:>10.0f} {:>12.0f} {:>9.1f} {:>9.1f} {:>9.1f} {:>12} {:>9} {:>9.3f}".format(
+            r['keywords'], r['patterns'], r['match_rate'], r['fuzz_keywords_sec'], r['messages_per_sec'],
+            r['domains_per_sec'], r['check_match_p50_us'], r['check_match_p99_us'], r['check_match_max_us'],
+            r['seen_domains_growth_bytes'], r['duplicate_certificates'], r['match_memo_hit_rate']))
+
+
+def print_comparison(results, baseline):
+    previous = dict((run_key(r), r) for r in baseline['results'])
+    print("\nCompared to {} ({}):".format(baseline.get('revision') or 'baseline', baseline.get('timestamp')))
+    for r in results:
+        old = previous.get(run_key(r))
+        if old is None:
+            continue
+        changes = []
+        for metric in ('messages_per_sec', 'check_match_p50_us', 'check_match_p99_us', 'fuzz_keywords_sec'):
+            if old.get(metric):
+                change = (r[metric] - old[metric]) / old[metric] * 100
+                worse = change < 0 if metric in HIGHER_IS_BETTER else change > 0
+                changes.append("{} {:+.1f}%{}".format(metric, change, " (worse)" if worse else ""))
+        print("  keywords={} match_rate={}: {}".format(r['keywords'], r['match_rate'], ", ".join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keyword-counts', nargs='+', type=int, default=[3, 10, 30])
+    parser.add_argument('--match-rates', nargs='+', type=float, default=[0.001, 0.01, 0.1])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--duplicate-rate', type=float, default=0.0,
+                        help="Share of synthetic messages that resend an earlier certificate")
+    parser.add_argument('--recording', help="Replay this NDJSON recording instead of synthetic messages")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--homoglyph-matching', choices=['expand', 'skeleton'], default=cfg.homoglyph_matching)
+    parser.add_argument('--lookalike-matching', choices=['expand', 'edit-distance'], default=cfg.lookalike_matching)
+    parser.add_argument('--json', help="Write the results to this file as JSON")
+    parser.add_argument('--compare', help="Compare against results previously written with --json")
+    args = parser.parse_args()
+
+    # Keep the benchmark to the pipeline itself
+    cfg.enable_logging = False
+    cfg.enable_csv_output = False
+    cfg.enable_json_output = False
+    cfg.enable_slack = False
+    cfg.enable_mattermost = False
+    cfg.enable_urlscanio = False
+    cfg.record_file = ""
+    cfg.homoglyph_matching = args.homoglyph_matching
+    cfg.lookalike_matching = args.lookalike_matching
+    logging.getLogger().setLevel(logging.CRITICAL + 1)
+
+    if args.recording:
+        recorded = list(read_recording(args.recording))
+        messages_for = lambda fuzzed, match_rate: recorded
+        match_rates = ['recorded']
+    else:
+        messages_for = lambda fuzzed, match_rate: synthetic_messages(args.messages, fuzzed, match_rate, args.seed, args.duplicate_rate)
+        match_rates = args.match_rates
+
+    results = []
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        for count in args.keyword_counts:
+            keywords = make_keywords(count, args.seed)
+            for match_rate in match_rates:
+                # certstream_callback prints every match, keep that out of the report
+                sys.stdout = devnull
+                try:
+                    results.append(run(keywords, messages_for, match_rate))
+                finally:
+                    sys.stdout = stdout
+
+    print_results(results)
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'recording': args.recording,
+        'homoglyph_matching': args.homoglyph_matching,
+        'lookalike_matching': args.lookalike_matching,
+        'results': results
+    }
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            print_comparison(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
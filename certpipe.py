@@ -23,490 +23,827 @@
   _____  _______  ______ _______  _____  _____  _____   ______
  |       |______ |_____/    |    |_____]   |   |_____] |______
  |_____  |______ |    \_    |    |       __|__ |       |______
-                                                              
-A CertStream monitoring tool. Monitor and alert on certificate 
+
+A CertStream monitoring tool. Monitor and alert on certificate
 transparency logs by looking for keyword matches.
 
 View README.md for setup information.
 
 BASIC USAGE:
-    
+
     1. Install dependencies: pip install -r requirements.txt
     2. Edit config.py
     3. Run using:
 
         python certpipe.py
 
+    Settings can also be given on the command line, see python certpipe.py --help
+
+LIBRARY USAGE:
+
+    import config
+    from certpipe import CertPipe
+
+    pipe = CertPipe(config)     # Any object with the settings of config.py as attributes
+    pipe.setup()
+    pipe.run()
+
+Outputs and matching modes are only imported when they are enabled.
 """
 
+import atexit
 import logging
-import sys
-from datetime import datetime 
-import os
-import re
+import signal
+from datetime import datetime
 import threading
-import requests
-import certstream
-from slackclient import SlackClient
+import time
+from collections import namedtuple
 import config as cfg
+from fuzzer import fuzz_keywords_parallel, variation_pairs
+from matcher import KeywordMatcher
+from dedup import LRUDedup, MatchMemo, create_dedup_store
+from sources import create_source, certificate_details, certificate_key, raw_certificate_key
 
 
 log_level = logging.INFO #logging.DEBUG
-logger = logging.getLogger()
-
-# Will contains the list of fuzzed keywords
-fuzzed_keywords = []
-
-# Keep track of previously matched domains in a hashtable
-seen_domains = set()
-
-# For bulk sending of alert messages
-bulk_alert_message = ""
-
-# Fuzzing code based on: https://github.com/elceef/dnstwist 
-class DomainFuzz():
-    def __init__(self, domain):
-        self.domain = domain
-        self.domains = []
-        self.qwerty = {
-        '1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
-        'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
-        'a': 'qwsz', 's': 'edxzaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
-        'z': 'asx', 'x': 'zsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
-        }
-        self.qwertz = {
-        '1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7zt5', '7': '8uz6', '8': '9iu7', '9': '0oi8', '0': 'po9',
-        'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6zgfr5', 'z': '7uhgt6', 'u': '8ijhz7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
-        'a': 'qwsy', 's': 'edxyaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'zhbvft', 'h': 'ujnbgz', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
-        'y': 'asx', 'x': 'ysdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
-        }
-        self.azerty = {
-        '1': '2a', '2': '3za1', '3': '4ez2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
-        'a': '2zq1', 'z': '3esqa2', 'e': '4rdsz3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0m',
-        'q': 'zswa', 's': 'edxwqz', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'iknhu', 'k': 'olji', 'l': 'kopm', 'm': 'lp',
-        'w': 'sxq', 'x': 'wsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhj'
-        }
-        self.keyboards = [ self.qwerty, self.qwertz, self.azerty ]
-
-    def __validate_domain(self, domain):
-        try:
-            domain_idna = domain.encode('idna').decode()
-        except UnicodeError:
-            # '.tla'.encode('idna') raises UnicodeError: label empty or too long
-            # This can be obtained when __omission takes a one-letter domain.
-            return False
-        if len(domain) == len(domain_idna) and domain != domain_idna:
-            return False
-        allowed = re.compile('(?=^.{4,253}$)(^((?!-)[a-zA-Z0-9-]{1,63}(?<!-)\.)+[a-zA-Z]{2,63}\.?$)', re.IGNORECASE)
-        return allowed.match(domain_idna)
-
-    def __bitsquatting(self):
-        result = []
-        masks = [1, 2, 4, 8, 16, 32, 64, 128]
-        for i in range(0, len(self.domain)):
-            c = self.domain[i]
-            for j in range(0, len(masks)):
-                b = chr(ord(c) ^ masks[j])
-                o = ord(b)
-                if (o >= 48 and o <= 57) or (o >= 97 and o <= 122) or o == 45:
-                    result.append(self.domain[:i] + b + self.domain[i+1:])
-
-        return result
-
-    def __homoglyph(self):
-        glyphs = {
-        'a': [u'à', u'á', u'â', u'ã', u'ä', u'å', u'ɑ', u'ạ', u'ǎ', u'ă', u'ȧ', u'ą'],
-        'b': ['d', 'lb', u'ʙ', u'ɓ', u'ḃ', u'ḅ', u'ḇ', u'ƅ'],
-        'c': ['e', u'ƈ', u'ċ', u'ć', u'ç', u'č', u'ĉ'],
-        'd': ['b', 'cl', 'dl', u'ɗ', u'đ', u'ď', u'ɖ', u'ḑ', u'ḋ', u'ḍ', u'ḏ', u'ḓ'],
-        'e': ['c', u'é', u'è', u'ê', u'ë', u'ē', u'ĕ', u'ě', u'ė', u'ẹ', u'ę', u'ȩ', u'ɇ', u'ḛ'],
-        'f': [u'ƒ', u'ḟ'],
-        'g': ['q', u'ɢ', u'ɡ', u'ġ', u'ğ', u'ǵ', u'ģ', u'ĝ', u'ǧ', u'ǥ'],
-        'h': ['lh', u'ĥ', u'ȟ', u'ħ', u'ɦ', u'ḧ', u'ḩ', u'ⱨ', u'ḣ', u'ḥ', u'ḫ', u'ẖ'],
-        'i': ['1', 'l', u'í', u'ì', u'ï', u'ı', u'ɩ', u'ǐ', u'ĭ', u'ỉ', u'ị', u'ɨ', u'ȋ', u'ī'],
-        'j': [u'ʝ', u'ɉ'],
-        'k': ['lk', 'ik', 'lc', u'ḳ', u'ḵ', u'ⱪ', u'ķ'],
-        'l': ['1', 'i', u'ɫ', u'ł'],
-        'm': ['n', 'nn', 'rn', 'rr', u'ṁ', u'ṃ', u'ᴍ', u'ɱ', u'ḿ'],
-        'n': ['m', 'r', u'ń', u'ṅ', u'ṇ', u'ṉ', u'ñ', u'ņ', u'ǹ', u'ň', u'ꞑ'],
-        'o': ['0', u'ȯ', u'ọ', u'ỏ', u'ơ', u'ó', u'ö'],
-        'p': [u'ƿ', u'ƥ', u'ṕ', u'ṗ'],
-        'q': ['g', u'ʠ'],
-        'r': [u'ʀ', u'ɼ', u'ɽ', u'ŕ', u'ŗ', u'ř', u'ɍ', u'ɾ', u'ȓ', u'ȑ', u'ṙ', u'ṛ', u'ṟ'],
-        's': [u'ʂ', u'ś', u'ṣ', u'ṡ', u'ș', u'ŝ', u'š'],
-        't': [u'ţ', u'ŧ', u'ṫ', u'ṭ', u'ț', u'ƫ'],
-        'u': [u'ᴜ', u'ǔ', u'ŭ', u'ü', u'ʉ', u'ù', u'ú', u'û', u'ũ', u'ū', u'ų', u'ư', u'ů', u'ű', u'ȕ', u'ȗ', u'ụ'],
-        'v': [u'ṿ', u'ⱱ', u'ᶌ', u'ṽ', u'ⱴ'],
-        'w': ['vv', u'ŵ', u'ẁ', u'ẃ', u'ẅ', u'ⱳ', u'ẇ', u'ẉ', u'ẘ'],
-        'y': [u'ʏ', u'ý', u'ÿ', u'ŷ', u'ƴ', u'ȳ', u'ɏ', u'ỿ', u'ẏ', u'ỵ'],
-        'z': [u'ʐ', u'ż', u'ź', u'ᴢ', u'ƶ', u'ẓ', u'ẕ', u'ⱬ']
-        }
-
-        result_1pass = set()
-
-        for ws in range(1, len(self.domain)):
-            for i in range(0, (len(self.domain)-ws)+1):
-                win = self.domain[i:i+ws]
-                j = 0
-                while j < ws:
-                    c = win[j]
-                    if c in glyphs:
-                        win_copy = win
-                        for g in glyphs[c]:
-                            win = win.replace(c, g)
-                            result_1pass.add(self.domain[:i] + win + self.domain[i+ws:])
-                            win = win_copy
-                    j += 1
-
-        result_2pass = set()
-
-        for domain in result_1pass:
-            for ws in range(1, len(domain)):
-                for i in range(0, (len(domain)-ws)+1):
-                    win = domain[i:i+ws]
-                    j = 0
-                    while j < ws:
-                        c = win[j]
-                        if c in glyphs:
-                            win_copy = win
-                            for g in glyphs[c]:
-                                win = win.replace(c, g)
-                                result_2pass.add(domain[:i] + win + domain[i+ws:])
-                                win = win_copy
-                        j += 1
-
-        return list(result_1pass | result_2pass)
-
-    def __hyphenation(self):
-        result = []
-
-        for i in range(1, len(self.domain)):
-            result.append(self.domain[:i] + '-' + self.domain[i:])
-
-        return result
-
-    def __insertion(self):
-        result = []
-
-        for i in range(1, len(self.domain)-1):
-            for keys in self.keyboards:
-                if self.domain[i] in keys:
-                    for c in keys[self.domain[i]]:
-                        result.append(self.domain[:i] + c + self.domain[i] + self.domain[i+1:])
-                        result.append(self.domain[:i] + self.domain[i] + c + self.domain[i+1:])
-
-        return list(set(result))
-
-    def __omission(self):
-        result = []
-
-        for i in range(0, len(self.domain)):
-            result.append(self.domain[:i] + self.domain[i+1:])
+logger = logging.getLogger("certpipe")
 
-        n = re.sub(r'(.)\1+', r'\1', self.domain)
+# Everything check_match searches, built together and replaced as a whole when the keywords are reloaded:
+# - matcher: prebuilt multi-pattern matcher over the ignore, no-fuzz and fuzzed keywords
+# - skeletons: matches keyword look-alikes by confusable skeleton, only when cfg.homoglyph_matching is 'skeleton'
+# - lookalikes: matches typo look-alikes by edit distance, only when cfg.lookalike_matching is 'edit-distance'
+# - base_keywords: the keyword each fuzzed variation came from, {variation: keyword}, only when cfg.enable_metrics is set
+KeywordIndex = namedtuple('KeywordIndex', ['matcher', 'skeletons', 'lookalikes', 'base_keywords'])
 
-        if n not in result and n != self.domain:
-            result.append(n)
+MATCH_DOMAIN_PARTS = ('all', 'no-suffix', 'registered-name')
 
-        return list(set(result))
+# Settings that can be changed while running, the rest need a restart
+RELOADABLE_SETTINGS = ['keywords', 'no_fuzz_keywords', 'ignore_keywords']
 
-    def __repetition(self):
-        result = []
 
-        for i in range(0, len(self.domain)):
-            if self.domain[i].isalpha():
-                result.append(self.domain[:i] + self.domain[i] + self.domain[i] + self.domain[i+1:])
+# Every metric CertPipe records. Gauges read the components' own stats when scraped.
+class CertPipeMetrics():
+    def __init__(self, pipe, slots):
+        import metrics as metrics_lib
 
-        return list(set(result))
+        self.registry = metrics_lib.Registry(slots)
+        r = self.registry
+        self.messages_received = r.counter("certpipe_messages_received_total", "CertStream messages received")
+        self.domains_processed = r.counter("certpipe_domains_processed_total", "Domains checked against the keywords")
+        self.check_match_seconds = r.histogram("certpipe_check_match_seconds", "Time spent in check_match per domain")
+        self.duplicate_certificates = r.counter("certpipe_duplicate_certificates_total", "Certificates skipped as already processed")
+        self.match_memo_hits = r.counter("certpipe_match_memo_hits_total", "Domains answered from the match memo without running check_match")
+        self.matches = r.labeled_counter("certpipe_matches_total", "Keyword matches, before duplicate suppression", ["keyword", "fuzzer"])
+        self.csv_flush_seconds = r.histogram("certpipe_csv_flush_seconds", "Time spent writing a batch of rows to the CSV file")
+        self.websocket_connects = r.counter("certpipe_websocket_connects_total", "CertStream websocket connections opened, including reconnects")
+        self.websocket_errors = r.counter("certpipe_websocket_errors_total", "CertStream websocket errors")
+        r.counter_callback("certpipe_dedup_lookups_total", "Duplicate suppression lookups", lambda: pipe.seen_domains.stats()['lookups'])
+        r.counter_callback("certpipe_dedup_hits_total", "Matches suppressed as already seen", lambda: pipe.seen_domains.stats()['hits'])
+        r.gauge("certpipe_dedup_memory_bytes", "Estimated memory used by the duplicate suppression store", lambda: pipe.seen_domains.stats()['memory_bytes'])
+        r.gauge("certpipe_urlscan_queue_depth", "Domains waiting for URLScan.io submission", lambda: pipe.urlscan_submitter.stats()['queued'] if pipe.urlscan_submitter else None)
+        r.gauge("certpipe_alert_queue_depth", "Alerts waiting to be sent", lambda: pipe.alert_dispatcher.stats()['queued'] if pipe.alert_dispatcher else None)
+        r.gauge("certpipe_syslog_queue_depth", "Syslog messages waiting to be sent", lambda: pipe.syslog_sender.stats()['queued'] if pipe.syslog_sender else None)
+        r.counter_callback("certpipe_syslog_dropped_total", "Syslog messages dropped because the queue was full", lambda: pipe.syslog_sender.stats()['dropped'] if pipe.syslog_sender else None)
+        r.gauge("certpipe_pipeline_queue_depth", "Messages waiting for a matcher worker", lambda: pipe.message_pipeline.stats()['input_queue_depth'] if pipe.message_pipeline else None)
+        r.counter_callback("certpipe_pipeline_dropped_total", "Messages dropped because the matcher queue was full", lambda: pipe.message_pipeline.stats()['dropped'] if pipe.message_pipeline else None)
 
-    def __replacement(self):
-        result = []
 
-        for i in range(0, len(self.domain)):
-            for keys in self.keyboards:
-                if self.domain[i] in keys:
-                    for c in keys[self.domain[i]]:
-                        result.append(self.domain[:i] + c + self.domain[i+1:])
+class CertPipe():
+    # config is the config module or any object with the same settings as attributes. Reloading keywords when the
+    # settings change needs its __file__.
+    def __init__(self, config=cfg):
+        self.cfg = config
 
-        return list(set(result))
+        # Will contains the list of fuzzed keywords as (keyword, fuzzer) pairs
+        self.fuzzed_keywords = []
 
-    def __subdomain(self):
-        result = []
+        # Fuzzed variations of each keyword, {keyword: {fuzzer: [variation, ...]}}, kept so a reload only fuzzes new keywords
+        self.keyword_variations = {}
 
-        for i in range(1, len(self.domain)):
-            if self.domain[i] not in ['-', '.'] and self.domain[i-1] not in ['-', '.']:
-                result.append(self.domain[:i] + '.' + self.domain[i:])
+        # What check_match searches, see KeywordIndex
+        self.keyword_index = KeywordIndex(KeywordMatcher(), None, None, None)
 
+        # Serialises keyword reloads
+        self.reload_lock = threading.Lock()
+
+        # Settings of the watched config file when it was last loaded, None until setup() starts watching it
+        self.file_settings = None
+
+        # Keep track of previously matched domains in a bounded store (see dedup_mode in config.py)
+        self.seen_domains = create_dedup_store(config)
+
+        # Certificates already matched by this process, so copies from other CT logs are skipped, None when disabled
+        self.seen_certificates = LRUDedup(config.certificate_dedup_max_entries) if config.certificate_dedup_max_entries else None
+
+        # Splits domains at their public suffix for match_domain_parts and ignore_suffixes, None when neither needs it
+        self.ignored_suffixes = frozenset(config.ignore_suffixes)
+        self.public_suffixes = None
+        if config.match_domain_parts != "all" or self.ignored_suffixes:
+            from publicsuffix import DEFAULT_LIST, PublicSuffixList
+            self.public_suffixes = PublicSuffixList(config.public_suffix_file or DEFAULT_LIST)
+
+        # Recent check_match results per domain, stored as (keyword_index, result) so a reload makes them stale, None when disabled
+        self.match_memo = MatchMemo(config.match_memo_max_entries) if config.match_memo_max_entries else None
+
+        # The optional parts below are created in setup() when enabled, and stay None otherwise
+
+        # On-disk history of matched domains
+        self.match_history = None
+
+        # Batches alerts and posts them to Slack and/or Mattermost
+        self.alert_dispatcher = None
+
+        # Sends matches to a syslog collector in the background
+        self.syslog_sender = None
+
+        # Background URLScan.io submission queue
+        self.urlscan_submitter = None
+
+        # Long-lived buffered CSV output file
+        self.csv_writer = None
+
+        # Long-lived buffered NDJSON output file with the certificate details of each match
+        self.json_writer = None
+
+        # The latest matches for the live results page
+        self.match_feed = None
+
+        # Records every received message for later replay when cfg.record_file is set
+        self.message_recorder = None
+
+        # Matcher worker processes, only used when cfg.matcher_workers is set
+        self.message_pipeline = None
+
+        # Hot path metrics, None when cfg.enable_metrics is off so each instrumented line costs a single truth test
+        self.metrics = None
+
+    # Logs the stats of each pipeline component every cfg.stats_log_interval seconds
+    def log_stats(self):
+        while True:
+            time.sleep(self.cfg.stats_log_interval)
+            self.log_stats_once()
+
+    def log_stats_once(self):
+        logger.debug("Dedup stats: {}".format(self.seen_domains.stats()))
+
+        # Matching happens in the worker processes when there are any, their stats are only in the metrics
+        if not self.message_pipeline:
+            if self.public_suffixes:
+                logger.debug("Public suffix stats: {}".format(self.public_suffixes.stats()))
+            if self.seen_certificates is not None:
+                logger.debug("Certificate dedup stats: {}".format(self.seen_certificates.stats()))
+            if self.match_memo is not None:
+                logger.debug("Match memo stats: {}".format(self.match_memo.stats()))
+
+        if self.match_history:
+            logger.debug("Match history stats: {}".format(self.match_history.stats()))
+
+        if self.message_pipeline:
+            logger.debug("Pipeline stats: {}".format(self.message_pipeline.stats()))
+
+        if self.urlscan_submitter:
+            logger.debug("URLScan.io stats: {}".format(self.urlscan_submitter.stats()))
+
+        if self.alert_dispatcher:
+            logger.debug("Alert stats: {}".format(self.alert_dispatcher.stats()))
+
+        if self.syslog_sender:
+            logger.debug("Syslog stats: {}".format(self.syslog_sender.stats()))
+
+        if self.match_feed:
+            logger.debug("Web UI stats: {}".format(self.match_feed.stats()))
+
+    # Write matched domains to a local CSV file. CSV file has 4 columns: timestamp, matched_keyword, domain, scan_results_url
+    # Rows are buffered and written out by csv_writer in batches, see the output_csv_* settings in config.py
+    def write_to_csv_output(self, matched_keyword, domain, scan_results_url):
+        self.csv_writer.write([str(datetime.now()), matched_keyword, domain, scan_results_url])
+
+    # Write a match to the NDJSON output file, one JSON object per line with the certificate details when they were kept.
+    # The record is serialised by json_writer's flusher thread, see the output_json_* settings in config.py
+    def write_to_json_output(self, matched_keyword, fuzzer, domain, scan_results_url, certificate):
+        self.json_writer.write({
+            'timestamp': datetime.now().isoformat(),
+            'matched_keyword': matched_keyword,
+            'fuzzer': fuzzer,
+            'domain': domain,
+            'scan_results_url': scan_results_url,
+            'certificate': certificate
+        })
+
+    # Queue the match for the syslog collector
+    def send_to_syslog(self, matched_keyword, fuzzer, domain, scan_results_url):
+        params = [('keyword', matched_keyword), ('fuzzer', fuzzer), ('domain', domain), ('scan_results_url', scan_results_url or None)]
+        self.syslog_sender.put(params, "Matched keyword " + matched_keyword + ": " + domain)
+
+    # Queue the domain for URLScan.io submission. The match is reported with the scan results URL once the
+    # submission finishes, or straight away without one if the submission queue is full.
+    def submit_to_urlscanio(self, matched_keyword, fuzzer, domain, certificate=None):
+        def on_complete(domain, scan_results_url):
+            self.report_match(matched_keyword, fuzzer, domain, scan_results_url, certificate)
+
+        if not self.urlscan_submitter.submit(domain, on_complete):
+            logger.warning("URLScan.io submission queue full, reporting without a scan: {}".format(domain))
+            self.report_match(matched_keyword, fuzzer, domain, "", certificate)
+
+    # Generate fuzzed keywords to look for lookalike domains/keywords. Returns (keyword, fuzzer) pairs.
+    def fuzz_keywords(self, wordlist):
+        return self.fuzzed_pairs(wordlist, self.fuzz_keyword_variations(wordlist))
+
+    # Variations of each keyword, {keyword: {fuzzer: [variation, ...]}}. Keywords in known are reused as they are,
+    # keywords found in the on-disk fuzz cache are loaded from it, the rest are fuzzed across cfg.fuzz_workers processes.
+    def fuzz_keyword_variations(self, wordlist, known=None):
+        cfg = self.cfg
+        fuzzers = cfg.keyword_fuzzers
+        # Skeleton matching finds homoglyphs without the pre-expanded variations
+        if cfg.homoglyph_matching == "skeleton":
+            fuzzers = [fuzzer for fuzzer in fuzzers if fuzzer != 'Homoglyph']
+        # Edit-distance matching finds single (and double) edits without them
+        if cfg.lookalike_matching == "edit-distance":
+            from lookalike import EDIT_FUZZERS
+            fuzzers = [fuzzer for fuzzer in fuzzers if fuzzer not in EDIT_FUZZERS]
+
+        fuzz_cache = None
+        if cfg.enable_fuzz_cache:
+            from fuzzcache import FuzzCache
+            fuzz_cache = FuzzCache(cfg.fuzz_cache_dir, fuzzers, cfg.fuzz_max_per_fuzzer, cfg.fuzz_homoglyph_depth)
+
+        variations = {}
+        for keyword in wordlist:
+            if known and keyword in known:
+                variations[keyword] = known[keyword]
+                continue
+            cached = fuzz_cache.get(keyword) if fuzz_cache else None
+            if cached is not None:
+                variations[keyword] = cached
+
+        missing = [keyword for keyword in wordlist if keyword not in variations]
+        for keyword, generated in fuzz_keywords_parallel(missing, fuzzers, cfg.fuzz_max_per_fuzzer,
+                                                         cfg.fuzz_homoglyph_depth, cfg.fuzz_workers):
+            variations[keyword] = generated
+            if fuzz_cache:
+                fuzz_cache.put(keyword, generated)
+
+        if fuzz_cache:
+            fuzz_cache.prune(cfg.fuzz_cache_max_age_days)
+            logger.info("Fuzz cache: {} keywords loaded, {} keywords fuzzed".format(fuzz_cache.hits, fuzz_cache.misses))
+
+        return variations
+
+    # Flattens the variations of each keyword into (keyword, fuzzer) pairs, the original keywords first
+    @staticmethod
+    def fuzzed_pairs(wordlist, variations):
+        fuzzed_list = []
+        fuzzed_list.extend((keyword, 'Original*') for keyword in wordlist)
+        for keyword in wordlist:
+            fuzzed_list.extend(variation_pairs(variations[keyword]))
+        return fuzzed_list
+
+    # The current value of each of the RELOADABLE_SETTINGS
+    def keyword_lists(self):
+        return dict((name, getattr(self.cfg, name)) for name in RELOADABLE_SETTINGS)
+
+    # Build every index check_match uses. lists holds the RELOADABLE_SETTINGS to build it from, the current ones if None,
+    # and variations the fuzzed variations of lists['keywords'], self.keyword_variations if None.
+    def build_keyword_index(self, fuzzed_list, lists=None, variations=None):
+        lists = lists or self.keyword_lists()
+        base_keywords = None
+        if self.cfg.enable_metrics:
+            base_keywords = self.build_base_keywords(lists['keywords'], self.keyword_variations if variations is None else variations)
+        return KeywordIndex(self.build_keyword_matcher(fuzzed_list, lists), self.build_skeleton_matcher(lists),
+                            self.build_lookalike_index(lists), base_keywords)
+
+    # The keyword each variation came from, in the order of fuzzed_pairs so a variation of several keywords maps to the
+    # one the matcher reports it for. Keeps the match metrics labelled by keyword rather than by every variation.
+    @staticmethod
+    def build_base_keywords(wordlist, variations):
+        base_keywords = dict((keyword, keyword) for keyword in wordlist)
+        for keyword in wordlist:
+            for variation, _ in variation_pairs(variations.get(keyword, {})):
+                base_keywords.setdefault(variation, keyword)
+        return base_keywords
+
+    # Build the matcher once, all keyword classes are searched together in a single pass over each domain
+    def build_keyword_matcher(self, fuzzed_list, lists):
+        return KeywordMatcher(lists['ignore_keywords'], lists['no_fuzz_keywords'], fuzzed_list)
+
+    # Build the skeleton matcher over the keywords, or None when homoglyphs are matched by expansion
+    def build_skeleton_matcher(self, lists):
+        cfg = self.cfg
+        if cfg.homoglyph_matching == "skeleton":
+            from confusables import SkeletonMatcher
+            return SkeletonMatcher(lists['keywords'], lists['ignore_keywords'])
+        if cfg.homoglyph_matching != "expand":
+            raise ValueError("Unknown homoglyph_matching: {}".format(cfg.homoglyph_matching))
+        return None
+
+    # Build the edit-distance index over the keywords, or None when typos are matched by expansion
+    def build_lookalike_index(self, lists):
+        cfg = self.cfg
+        if cfg.lookalike_matching == "edit-distance":
+            from lookalike import LookalikeIndex
+            return LookalikeIndex(lists['keywords'], cfg.lookalike_max_edits, cfg.lookalike_max_distance, cfg.lookalike_min_length,
+                                  lists['ignore_keywords'])
+        if cfg.lookalike_matching != "expand":
+            raise ValueError("Unknown lookalike_matching: {}".format(cfg.lookalike_matching))
+        return None
+
+    # Check if a domain matches any of the keywords (or variations).
+    # Ignore keywords win, then 'no fuzz' keywords, then fuzzed keywords, then keyword skeletons, then edit distance.
+    # Returns (is_match, keyword, fuzzer). For skeleton and edit-distance matches the fuzzer describes the look-alike.
+    def check_match(self, domain):
+        # Read once, a reload may swap in a new index at any time
+        index = self.keyword_index
+        match = index.matcher.match(domain)
+
+        if match is None:
+            if index.skeletons:
+                similar = index.skeletons.match(domain)
+                if similar:
+                    from confusables import describe
+                    logger.debug("Found homoglyph match: {}".format(domain))
+                    return True, similar.keyword, describe(similar)
+            if index.lookalikes:
+                similar = index.lookalikes.match(domain)
+                if similar:
+                    from lookalike import describe
+                    logger.debug("Found lookalike match: {}".format(domain))
+                    return True, similar.keyword, describe(similar)
+            return False, "", ""
+
+        logger.debug("Found match: {}".format(domain))
+        return True, match.keyword, match.fuzzer or ""
+
+    # Domain preprocessing. Returns the domain without its wildcard and the part of it check_match should search,
+    # or None when the domain is under one of the ignored suffixes (see match_domain_parts in config.py)
+    def prepare_domain(self, domain):
+        if domain[0] == '*':
+            domain = domain[2:]
+
+        parts = self.cfg.match_domain_parts
+        ignored_suffixes = self.ignored_suffixes
+        if not ignored_suffixes:
+            if parts == "all":
+                return domain, domain
+            # The common case, only the suffix length is needed
+            if parts == "no-suffix":
+                return domain, domain[:max(len(domain) - self.public_suffixes.suffix_length(domain) - 1, 0)]
+
+        split = self.public_suffixes.split(domain)
+        if split.suffix in ignored_suffixes or split.registered_domain in ignored_suffixes:
+            return None
+
+        if parts == "no-suffix":
+            return domain, domain[:len(domain) - len(split.suffix) - 1] if split.name else ""
+        if parts == "registered-name":
+            return domain, split.name
+        return domain, domain
+
+    # check_match through the match memo. Results are only reused while the keyword index they came from is current.
+    def memo_check_match(self, domain):
+        metrics = self.metrics
+        match_memo = self.match_memo
+        if match_memo is not None:
+            index = self.keyword_index
+            memo = match_memo.get(domain)
+            if memo is not None and memo[0] is index:
+                if metrics:
+                    metrics.match_memo_hits.inc()
+                    metrics.domains_processed.inc()
+                return memo[1]
+
+        if metrics:
+            start = time.perf_counter()
+            result = self.check_match(domain)
+            metrics.check_match_seconds.observe(time.perf_counter() - start)
+            metrics.domains_processed.inc()
+        else:
+            result = self.check_match(domain)
+
+        if match_memo is not None:
+            match_memo.put(domain, (index, result))
         return result
 
-    def __transposition(self):
-        result = []
-
-        for i in range(0, len(self.domain)-1):
-            if self.domain[i+1] != self.domain[i]:
-                result.append(self.domain[:i] + self.domain[i+1] + self.domain[i] + self.domain[i+2:])
-
-        return result
-
-    def __vowel_swap(self):
-        vowels = 'aeiou'
-        result = []
-
-        for i in range(0, len(self.domain)):
-            for vowel in vowels:
-                if self.domain[i] in vowels:
-                    result.append(self.domain[:i] + vowel + self.domain[i+1:])
+    # Called when data is pulled from CertStream
+    # With matcher workers enabled the message may still be the raw JSON text, it is decoded in the worker process.
+    def certstream_callback(self, message, context):
+        if self.metrics:
+            self.metrics.messages_received.inc()
 
-        return list(set(result))
+        # Formatting a whole certificate is expensive, only do it when it will be logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Message -> {}".format(message))
 
-    def __addition(self):
-        result = []
+        if self.message_recorder:
+            self.message_recorder.record(message)
 
-        for i in range(97, 123):
-            result.append(self.domain + chr(i))
-
-        return result
-
-    def generate(self):
-        self.domains.append({ 'fuzzer': 'Original*', 'domain-name': self.domain })
-
-        for domain in self.__addition():
-            self.domains.append({ 'fuzzer': 'Addition', 'domain-name': domain })
-        for domain in self.__bitsquatting():
-            self.domains.append({ 'fuzzer': 'Bitsquatting', 'domain-name': domain })
-        for domain in self.__homoglyph():
-            self.domains.append({ 'fuzzer': 'Homoglyph', 'domain-name': domain })
-        for domain in self.__hyphenation():
-            self.domains.append({ 'fuzzer': 'Hyphenation', 'domain-name': domain })
-        for domain in self.__insertion():
-            self.domains.append({ 'fuzzer': 'Insertion', 'domain-name': domain })
-        for domain in self.__omission():
-            self.domains.append({ 'fuzzer': 'Omission', 'domain-name': domain })
-        for domain in self.__repetition():
-            self.domains.append({ 'fuzzer': 'Repetition', 'domain-name': domain })
-        for domain in self.__replacement():
-            self.domains.append({ 'fuzzer': 'Replacement', 'domain-name': domain })
-        for domain in self.__subdomain():
-            self.domains.append({ 'fuzzer': 'Subdomain', 'domain-name': domain })
-        for domain in self.__transposition():
-            self.domains.append({ 'fuzzer': 'Transposition', 'domain-name': domain })
-        for domain in self.__vowel_swap():
-            self.domains.append({ 'fuzzer': 'Vowel-swap', 'domain-name': domain })
-
-
-# This function bulk sends alert data and gets called every n seconds based on cfg.alert_send_frequency
-def bulk_post_alerts():
-    
-    global bulk_alert_message
-
-    # Start the timer for the next run of this function
-    threading.Timer(cfg.alert_send_frequency, bulk_post_alerts).start()
-    
-    if bulk_alert_message:
-        
-        if cfg.enable_slack:
-            post_to_slack(bulk_alert_message)
-        
-        if cfg.enable_mattermost:
-            post_to_mattermost(bulk_alert_message)
-        
-        logger.info("The following alert message was sent:\n\n" + bulk_alert_message)
-
-        bulk_alert_message = ""
-
-
-# Posts a message to a Slack Channel using the Slack API and an access token
-def post_to_slack(msg):
-    sc = SlackClient(cfg.slack_token)
-    sc.api_call(
-        "chat.postMessage",
-        channel = cfg.slack_channel,
-        text = msg
-    )
-    logger.debug("Message posted to Slack:\n {}".format(msg))
-
-
-# Posts a message to a Mattermost Channel using the Incoming Webhooks feature
-def post_to_mattermost(msg):
-    if requests.post(cfg.mattermost_webhook_url, verify=True, json={"username":"CertPipe", "icon_url":"https://www.mattermost.org/wp-content/uploads/2016/04/icon.png", "text": msg}):
-        logger.debug("Message posted to Mattermost:\n {}".format(msg))
-    else:
-        logger.error("Message failed to post to Mattermost")
-
-
-# Write matched domains to a local CSV file. CSV file hase 3 columns: timestamp, matched_keyword, domain
-def write_to_csv_output(matched_keyword, domain, scan_results_url):
-    logger.info("Writing output to CSV file")
-    
-    # Create the file and add the first row header if it does not exist
-    if not os.path.exists(cfg.output_csv_file):
-        with open(cfg.output_csv_file, "w+") as output_file:
-            output_file.write("timestamp, matched_keyword, domain, scan_results_url\r\n")
-            output_file.close()
-
-    # Add a new row to the csv file and close it
-    try:
-        with open(cfg.output_csv_file, "a") as output_file:
-            output_file.write(str(datetime.now()) + ", " + str(matched_keyword) + ", " + str(domain) + ", " + str(scan_results_url) + "\r\n")
-            output_file.close()
-    except IOError as e:
-        logger.error("CSV File I/O error({0}): {1}".format(e.errno, e.strerror))
-        
-
-# Submit the domain to URLScan.io's API and return the URL link to the scan result.
-def submit_to_urlscanio(domain): 
-    req_headers = {'Content-Type':'Application/json', 'API-Key':cfg.urlscanio_api_key}
-    req_payload = {'url': domain, 'public':'on'}
-    resp = requests.post("https://urlscan.io/api/v1/scan/", verify=True, headers=req_headers, json=req_payload)
-
-    if resp.ok:
-        logger.info("Domain submitted to URLScan.io: {}".format(domain))    
-        logger.info("Scan results URL: " + str(resp.json()['result']))
-        return resp.json()['result']
-    else:
-        logger.info("Domain unable to be scanned by URLScan.io: {}".format(domain))
-        return ""
-
-# Generate fuzzed keywords to look for lookalike domains/keywords
-def fuzz_keywords(wordlist):
-    fuzzed_list = []
-    fuzzed_list.extend(wordlist)
-    for keyword in cfg.keywords:
-        domain_fuzz = DomainFuzz(keyword)
-        domain_fuzz.generate()
-        for domain in domain_fuzz.domains:
-            fuzzed_list.append(domain['domain-name'])
-    return fuzzed_list
-
-
-# Check if a domain matches any of the keywords (or variations)
-def check_match(domain):
-    # Check if the domain contains any of the keywords to ignore (no match)
-    for keyword in cfg.ignore_keywords:
-        if keyword in domain:
-            return False, ""
-
-    # Check if the domains contains any of the 'no fuzz' keywords
-    for keyword in cfg.no_fuzz_keywords:
-        if keyword in domain:
-            logger.info("Found match: {}".format(domain))
-            return True, keyword
-
-    # Check if the domain contains any of the fuzzed keywords
-    for keyword in fuzzed_keywords:
-        if keyword in domain:
-            logger.info("Found match: {}".format(domain))
-            return True, keyword
-
-    return False, ""
-
-
-# Called when data is pulled from CertStream
-def certstream_callback(message, context):
-    global bulk_alert_message
-
-    logger.debug("Message -> {}".format(message))
-
-    if message['message_type'] == "heartbeat":
-        return
-
-    if message['message_type'] == "certificate_update":
-        all_domains = message['data']['leaf_cert']['all_domains']
-        
-        if len(all_domains) == 0:
+        # Hand the message to the matcher processes, or match it here on the CertStream thread
+        if self.message_pipeline:
+            self.message_pipeline.put(message)
             return
 
-        for domain in all_domains:
-            
-            # Remove the leading *. on the domain if it exists
-            if domain[0] == '*':
-                domain = domain[2:]
-
-            is_match, matched_keyword = check_match(domain)
-
-            # Check whether or not we've seen the same domain previously, avoids duplicates domains in output
-            if domain not in seen_domains:
-                seen_before = False
-                seen_domains.add(domain)
-            else:
-                seen_before = True
-
-            if is_match and not seen_before: 
-                logger.info("Matched Keyword: " + matched_keyword + "\n" + domain)
-
-                scan_results_url = ""
-                if cfg.enable_urlscanio:
-                    scan_results_url = submit_to_urlscanio(domain)
-
-                if cfg.enable_csv_output:
-                    write_to_csv_output(matched_keyword, domain, scan_results_url)
-
-                # Add to the bulk alert message string
-                if cfg.enable_slack or cfg.enable_mattermost:
-                    bulk_alert_message = bulk_alert_message + "Keyword: " + matched_keyword + "\nDomain: " + domain
-                    
-                    if scan_results_url:
-                        bulk_alert_message = bulk_alert_message + "\nScan: " + scan_results_url
-                    
-                    bulk_alert_message = bulk_alert_message + "\n\n"
-                
-
-                print(matched_keyword + " : " + domain)
-
-
-# Called when the CertSream listener is opened
-def on_open(instance):
-    return
+        for match in self.match_message(message):
+            self.handle_match(*match)
+
+    # Match stage. Returns (domain, matched_keyword, fuzzer, certificate) for every domain in the message that matches a
+    # keyword. certificate holds the certificate details for the JSON output, and is None when that output is disabled.
+    # Runs in the matcher worker processes when cfg.matcher_workers is set, so it must not touch any output state.
+    def match_message(self, message):
+        if message['message_type'] != "certificate_update":
+            return []
+
+        if self.seen_certificates is not None:
+            key = certificate_key(message)
+            if key and self.seen_certificates.seen_before(key):
+                if self.metrics:
+                    self.metrics.duplicate_certificates.inc()
+                return []
+
+        matches = []
+        certificate = None
+        for domain in message['data']['leaf_cert']['all_domains']:
+            # A malformed name is skipped on its own, the other names in the certificate are still checked
+            try:
+                prepared = self.prepare_domain(domain)
+            except Exception as e:
+                logger.warning("Skipping malformed domain {!r}: {}".format(domain, e))
+                continue
+            if prepared is None:
+                continue
+            domain, text = prepared
+
+            is_match, matched_keyword, fuzzer = self.memo_check_match(text)
+
+            if is_match:
+                # Only copied out of the message once it has a match
+                if certificate is None and self.cfg.enable_json_output:
+                    certificate = certificate_details(message)
+                matches.append((domain, matched_keyword, fuzzer, certificate))
+
+        return matches
+
+    # Output stage. Runs on a single thread, the CertStream thread or the pipeline output thread.
+    def handle_match(self, domain, matched_keyword, fuzzer, certificate=None):
+        if self.metrics:
+            # The keyword the variation came from and only the fuzzer name, not the variation or the details of a skeleton
+            # or edit-distance match, to keep the label set small. A match from before a reload may be of a keyword
+            # the index no longer has.
+            base_keywords = self.keyword_index.base_keywords or {}
+            self.metrics.matches.inc(base_keywords.get(matched_keyword, matched_keyword), fuzzer.split(" (")[0])
+
+        # Check whether or not we've seen the same matched domain previously, avoids duplicates domains in output.
+        # The history covers domains matched before a restart and domains the in-memory store has since forgotten.
+        match_history = self.match_history
+        if self.seen_domains.seen_before(domain) or (match_history and match_history.seen(domain, self.cfg.dedup_ttl)):
+            if match_history:
+                match_history.touch(domain)
+            return
 
+        logger.info("Matched Keyword: " + matched_keyword + (" (" + fuzzer + ")" if fuzzer else "") + "\n" + domain)
+
+        if self.urlscan_submitter:
+            self.submit_to_urlscanio(matched_keyword, fuzzer, domain, certificate)
+        else:
+            self.report_match(matched_keyword, fuzzer, domain, "", certificate)
+
+    # Send a matched domain to the CSV and JSON files, the alert dispatcher and the terminal.
+    # Called from the output stage and from the URLScan.io workers, every sink it uses is thread-safe.
+    def report_match(self, matched_keyword, fuzzer, domain, scan_results_url, certificate=None):
+        if self.match_history:
+            self.match_history.record(domain, matched_keyword, fuzzer, scan_results_url)
+
+        if self.csv_writer:
+            self.write_to_csv_output(matched_keyword, domain, scan_results_url)
+
+        if self.json_writer:
+            self.write_to_json_output(matched_keyword, fuzzer, domain, scan_results_url, certificate)
+
+        if self.syslog_sender:
+            self.send_to_syslog(matched_keyword, fuzzer, domain, scan_results_url)
+
+        if self.match_feed:
+            self.match_feed.publish(matched_keyword, fuzzer, domain, scan_results_url)
+
+        # Queue the alert, the dispatcher sends alerts in batches
+        if self.alert_dispatcher:
+            from alerts import Alert
+            self.alert_dispatcher.put(Alert(matched_keyword, fuzzer, domain, scan_results_url))
+
+        print(matched_keyword + " : " + domain)
+
+    # Called when the CertSream listener is opened
+    def on_open(self, instance):
+        if self.metrics:
+            self.metrics.websocket_connects.inc()
+
+    # Called when the CertStream listener encounters an error
+    def on_error(self, instance, exception):
+        if self.metrics:
+            self.metrics.websocket_errors.inc()
+
+    # Called by the config watcher with the settings of the changed config file. Only new keywords are fuzzed, the new
+    # index is built while matching carries on with the old one, then swapped in with a single assignment. The config
+    # is only updated after that, so a failed build leaves everything as it was and the next reload tries again.
+    # Matcher worker processes hold a copy of the index from when they were forked, so they are replaced by fresh ones.
+    def reload_keywords(self, settings):
+        cfg = self.cfg
+        with self.reload_lock:
+            changed = [name for name in RELOADABLE_SETTINGS if settings.get(name, getattr(cfg, name)) != getattr(cfg, name)]
+            # Compared with the file as it was, the running config also holds command line overrides
+            previous = self.file_settings
+            ignored = sorted(name for name, value in settings.items()
+                             if previous is not None and name not in RELOADABLE_SETTINGS and hasattr(cfg, name)
+                             and (name not in previous or value != previous[name]))
+            if ignored:
+                logger.warning("Restart CertPipe to apply changes to: {}".format(", ".join(ignored)))
+            self.file_settings = settings
+            if not changed:
+                logger.info("No keyword changes to apply")
+                return
+
+            keywords = settings.get('keywords', cfg.keywords)
+            added = [keyword for keyword in keywords if keyword not in self.keyword_variations]
+            removed = [keyword for keyword in cfg.keywords if keyword not in keywords]
+            logger.info("Keyword reload: {} keywords added, {} removed, {} changed".format(len(added), len(removed), ", ".join(changed)))
+
+            lists = self.keyword_lists()
+            for name in changed:
+                lists[name] = list(settings[name])
+
+            start = time.time()
+            variations = self.fuzz_keyword_variations(lists['keywords'], self.keyword_variations)
+            fuzzed_list = self.fuzzed_pairs(lists['keywords'], variations)
+            index = self.build_keyword_index(fuzzed_list, lists, variations)
+
+            self.keyword_index = index
+            self.keyword_variations = variations
+            self.fuzzed_keywords = fuzzed_list
+            for name in changed:
+                setattr(cfg, name, lists[name])
+            # Certificates already processed may match the new keywords
+            if self.seen_certificates is not None:
+                self.seen_certificates.clear()
+            logger.info("Keyword index rebuilt in {:.2f}s with {} unique keywords".format(time.time() - start, len(index.matcher)))
+
+            if self.message_pipeline:
+                self.message_pipeline.restart_workers()
+
+    # Runs before starting CertStream. Creates and starts every enabled output, builds the keyword index and starts
+    # the matcher workers.
+    def setup(self):
+        cfg = self.cfg
+
+        # Every module logs to a child of the certpipe logger, so this switches all of them without touching the logging
+        # configuration of an application that embeds CertPipe (main() configures the handlers and level)
+        logger.setLevel(logging.NOTSET if cfg.enable_logging else logging.CRITICAL + 1)
+
+        # Metrics have one slot per process that records them, the main process and each matcher worker, twice over since
+        # restarted workers briefly run alongside the ones they replace (see ShardedPipeline.restart_workers)
+        if cfg.enable_metrics:
+            import metrics as metrics_lib
+            self.metrics = CertPipeMetrics(self, cfg.matcher_workers * 2 + 1)
+            metrics_lib.serve_metrics(self.metrics.registry, cfg.metrics_host, cfg.metrics_port)
+            logger.info("Metrics: http://{}:{}/metrics".format(cfg.metrics_host, cfg.metrics_port))
+
+        # Log alerting configuration
+        logger.info("CSV output file: {}".format("Enabled" if cfg.enable_csv_output else "Disabled"))
+
+        if cfg.enable_csv_output:
+            from output import CSVWriter
+            self.csv_writer = CSVWriter(cfg.output_csv_file, ["timestamp", "matched_keyword", "domain", "scan_results_url"],
+                flush_rows=cfg.output_csv_flush_rows, flush_interval=cfg.output_csv_flush_interval,
+                rotate_bytes=cfg.output_csv_rotate_bytes, rotate_daily=cfg.output_csv_rotate_daily, compress=cfg.output_csv_compress,
+                on_flush=self.metrics.csv_flush_seconds.observe if self.metrics else None)
+            atexit.register(self.csv_writer.close)
+
+        logger.info("JSON output file: {}".format("Enabled" if cfg.enable_json_output else "Disabled"))
+
+        if cfg.enable_json_output:
+            from output import JSONWriter
+            self.json_writer = JSONWriter(cfg.output_json_file,
+                flush_rows=cfg.output_json_flush_rows, flush_interval=cfg.output_json_flush_interval,
+                rotate_bytes=cfg.output_json_rotate_bytes, rotate_daily=cfg.output_json_rotate_daily, compress=cfg.output_json_compress)
+            atexit.register(self.json_writer.close)
+
+        logger.info("Slack alerting: {}".format("Enabled" if cfg.enable_slack else "Disabled"))
+        logger.info("Mattermost alerting: {}".format("Enabled" if cfg.enable_mattermost else "Disabled"))
+
+        if cfg.enable_slack or cfg.enable_mattermost:
+            from alerts import AlertDispatcher, MattermostSender, SlackSender
+            logger.info("Remote alerts will be sent every {} seconds or every {} alerts".format(cfg.alert_send_frequency, cfg.alert_batch_size))
+            senders = []
+            if cfg.enable_slack:
+                senders.append(SlackSender(cfg.slack_token, cfg.slack_channel, cfg.slack_message_limit))
+            if cfg.enable_mattermost:
+                senders.append(MattermostSender(cfg.mattermost_webhook_url, cfg.mattermost_message_limit))
+            self.alert_dispatcher = AlertDispatcher(senders, cfg.alert_batch_size, cfg.alert_send_frequency, cfg.alert_max_retries)
+            self.alert_dispatcher.start()
+            atexit.register(self.alert_dispatcher.stop, 30)
+
+        logger.info("Syslog output: {}".format("{}:{} ({})".format(cfg.syslog_server, cfg.syslog_port, cfg.syslog_protocol) if cfg.enable_syslog else "Disabled"))
+
+        if cfg.enable_syslog:
+            from syslogsink import SyslogSender
+            self.syslog_sender = SyslogSender(cfg.syslog_server, cfg.syslog_port, cfg.syslog_protocol, cfg.syslog_facility, cfg.syslog_severity,
+                queue_size=cfg.syslog_queue_size, ca_file=cfg.syslog_tls_ca_file, verify=cfg.syslog_tls_verify)
+            self.syslog_sender.start()
+            atexit.register(self.syslog_sender.stop, 10)
+
+        if cfg.enable_web_ui:
+            from webui import MatchFeed, serve_web_ui
+            self.match_feed = MatchFeed(cfg.web_ui_buffer_size)
+            self.match_feed.start()
+            serve_web_ui(self.match_feed, cfg.web_ui_host, cfg.web_ui_port, cfg.web_ui_max_viewers)
+            logger.info("Live results: http://{}:{}/".format(cfg.web_ui_host, cfg.web_ui_port))
+
+        logger.info("Duplicate suppression: {}".format(self.seen_domains.mode))
+
+        # Warm start duplicate suppression from the history of earlier runs
+        if cfg.enable_history:
+            from history import MatchHistory
+            self.match_history = MatchHistory(cfg.history_file, cfg.history_retention_days, cfg.history_flush_rows, cfg.history_flush_interval)
+            recent = self.match_history.recent(cfg.dedup_ttl, cfg.dedup_max_entries if self.seen_domains.mode == 'lru' else 0)
+            for domain in recent:
+                self.seen_domains.add(domain)
+            logger.info("Match history: {} ({} domains loaded)".format(cfg.history_file, len(recent)))
+            self.match_history.start()
+            atexit.register(self.match_history.close, 10)
+
+        # URLScan.io configuration
+        logger.info("URLScan.io submission: {}".format("Enabled" if cfg.enable_urlscanio else "Disabled"))
+
+        if cfg.enable_urlscanio:
+            from urlscan import URLScanSubmitter
+            logger.info("Note: URLScan.io links will return an HTTP 404 response until the scan has finished (~10s)")
+            self.urlscan_submitter = URLScanSubmitter(cfg.urlscanio_api_key, api_url=cfg.urlscanio_api_url, workers=cfg.urlscanio_workers,
+                queue_size=cfg.urlscanio_queue_size, rate_limit=cfg.urlscanio_rate_limit, burst=cfg.urlscanio_burst,
+                max_retries=cfg.urlscanio_max_retries)
+            self.urlscan_submitter.start()
+            # Registered after the outputs so it runs before they close, domains still waiting are reported without a scan
+            atexit.register(self.urlscan_submitter.stop, 10)
+
+        # Created fuzzed keywords
+        logger.info("{} keywords in config file".format(len(cfg.keywords)))
+        logger.info("{} 'No-fuzz' keywords in config file".format(len(cfg.no_fuzz_keywords)))
+        logger.info("{} 'Ignore' keywords in config file".format(len(cfg.ignore_keywords)))
+        if cfg.match_domain_parts not in MATCH_DOMAIN_PARTS:
+            raise ValueError("Unknown match_domain_parts: {}".format(cfg.match_domain_parts))
+        logger.info("Keywords matched in domain parts: {} ({} public suffix rules, {} suffixes ignored)".format(
+            cfg.match_domain_parts, self.public_suffixes.rules if self.public_suffixes else 0, len(self.ignored_suffixes)))
+        logger.info("Keyword fuzzer starting...")
+        self.keyword_variations = self.fuzz_keyword_variations(cfg.keywords)
+        self.fuzzed_keywords = self.fuzzed_pairs(cfg.keywords, self.keyword_variations)
+        logger.info("Keyword fuzzer finished")
+        logger.info("{} fuzzed keywords created".format(len(self.fuzzed_keywords)))
+        self.keyword_index = self.build_keyword_index(self.fuzzed_keywords)
+        logger.info("Keyword matcher built with {} unique keywords".format(len(self.keyword_index.matcher)))
+        if self.keyword_index.skeletons:
+            logger.info("Homoglyphs matched by confusable skeleton of {} keywords".format(len(cfg.keywords)))
+        if self.keyword_index.lookalikes:
+            logger.info("Lookalikes matched within {} edits of {} keywords".format(cfg.lookalike_max_edits, len(self.keyword_index.lookalikes.keywords)))
+
+        # Start the matcher workers after the keyword matcher is built so they share it
+        if cfg.matcher_workers > 0:
+            import metrics as metrics_lib
+            from pipeline import ShardedPipeline
+            logger.info("Matching on {} worker processes (overload policy: {})".format(cfg.matcher_workers, cfg.pipeline_overload_policy))
+            # Sharded by certificate, so every copy of a certificate reaches the worker whose certificate dedup has seen it
+            self.message_pipeline = ShardedPipeline(self.match_message, self.handle_match, cfg.matcher_workers,
+                cfg.pipeline_queue_size, cfg.pipeline_overload_policy, worker_init=lambda i: metrics_lib.set_process_slot(i + 1),
+                shard_key=raw_certificate_key)
+            self.message_pipeline.start()
+            atexit.register(self.message_pipeline.stop, 10)
+
+        if cfg.record_file:
+            from sources import MessageRecorder
+            logger.info("Recording CertStream messages to {}".format(cfg.record_file))
+            self.message_recorder = MessageRecorder(cfg.record_file)
+            atexit.register(self.message_recorder.close)
+
+        # Apply keyword changes without a restart, see config_reload_interval in config.py
+        config_file = getattr(cfg, '__file__', None)
+        if cfg.enable_config_reload and config_file:
+            from configwatch import ConfigWatcher, load_config
+            self.file_settings = load_config(config_file)
+            config_watcher = ConfigWatcher(config_file, self.reload_keywords, cfg.config_reload_interval)
+            config_watcher.start()
+            logger.info("Keywords reloaded when {} changes{}".format(config_file, " or on SIGHUP" if config_watcher.on_sighup else ""))
+
+        # Start logging component stats in the background
+        stats_thread = threading.Thread(target=self.log_stats, name="stats")
+        stats_thread.daemon = True
+        stats_thread.start()
+
+    # Connects to the CertStream service (or replays a recording, see input_source in config.py) and specifies callback functions
+    def run(self):
+        cfg = self.cfg
+        source = create_source(cfg)
+        if cfg.input_source == "replay":
+            logger.info("Replaying {} (speed: {})...".format(cfg.replay_file, cfg.replay_speed or "max"))
+        else:
+            logger.info("CertStream listener starting...")
+        source.run(self.certstream_callback, on_open=self.on_open, on_error=self.on_error, raw=self.message_pipeline is not None)
+
+
+# The settings of config.py, overlaid with those of another settings file when path is given and then with overrides.
+# Returns a new object, the config module itself is left as it is.
+def load_settings(path=None, overrides=None):
+    import types
+
+    settings = dict((name, value) for name, value in vars(cfg).items() if not name.startswith('_'))
+    settings['__file__'] = cfg.__file__
+    if path:
+        from configwatch import load_config
+        settings.update(load_config(path))
+        settings['__file__'] = path
+    settings.update(overrides or {})
+    return types.SimpleNamespace(**settings)
+
+
+# Command line options. Every setting in config.py can be set with --set, the most common ones have their own option.
+def parse_args(argv=None):
+    import argparse
+    import ast
+
+    parser = argparse.ArgumentParser(description="Monitor certificate transparency logs for domains that look like your keywords.")
+    parser.add_argument('-c', '--config', metavar='FILE', help="Settings file in the format of config.py, settings it leaves out keep the values in config.py")
+    parser.add_argument('-k', '--keywords', nargs='+', metavar='KEYWORD', help="Keywords to look for, instead of those in the settings file")
+    parser.add_argument('--no-fuzz-keywords', nargs='+', metavar='KEYWORD', help="Keywords to look for as they are, without fuzzing")
+    parser.add_argument('--ignore-keywords', nargs='+', metavar='KEYWORD', help="Domains containing these keywords are never reported")
+    parser.add_argument('--replay', metavar='FILE', help="Replay a recording of CertStream messages instead of listening to CertStream")
+    parser.add_argument('--record', metavar='FILE', help="Record every CertStream message to this file")
+    parser.add_argument('--workers', type=int, metavar='N', help="Number of matcher worker processes")
+    parser.add_argument('--web-ui', metavar='PORT', type=int, help="Serve the live results page on this port")
+    parser.add_argument('--no-output', action='store_true', help="Only print matches, without the CSV, JSON, history, alert, syslog or URLScan.io outputs")
+    parser.add_argument('--debug', action='store_true', help="Verbose logging")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help="Set any setting of config.py. VALUE is read as a Python literal, or as a string if it is not one, e.g. --set dedup_mode=bloom")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for assignment in args.set:
+        name, sep, value = assignment.partition('=')
+        if not sep or not hasattr(cfg, name.strip()):
+            parser.error("--set {}: expected NAME=VALUE with a setting from config.py".format(assignment))
+        try:
+            overrides[name.strip()] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name.strip()] = value
+
+    if args.keywords is not None:
+        overrides['keywords'] = args.keywords
+    if args.no_fuzz_keywords is not None:
+        overrides['no_fuzz_keywords'] = args.no_fuzz_keywords
+    if args.ignore_keywords is not None:
+        overrides['ignore_keywords'] = args.ignore_keywords
+    # A reload would put back the keywords from the settings file
+    if set(overrides) & set(RELOADABLE_SETTINGS):
+        overrides['enable_config_reload'] = False
+    if args.replay:
+        overrides['input_source'] = "replay"
+        overrides['replay_file'] = args.replay
+    if args.record:
+        overrides['record_file'] = args.record
+    if args.workers is not None:
+        overrides['matcher_workers'] = args.workers
+    if args.web_ui:
+        overrides['enable_web_ui'] = True
+        overrides['web_ui_port'] = args.web_ui
+    if args.no_output:
+        for name in ('enable_csv_output', 'enable_json_output', 'enable_history', 'enable_slack', 'enable_mattermost',
+                     'enable_syslog', 'enable_urlscanio'):
+            overrides[name] = False
+    if args.debug:
+        overrides['enable_logging'] = True
+
+    return args, load_settings(args.config, overrides)
+
+
+# docker stop sends SIGTERM, exit normally so the atexit handlers flush the outputs
+def exit_on_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
 
-# Called when the CertStream listener encounters an error
-def on_error(instance, exception):
-    return
 
+# Setup and run the application
+def main(argv=None):
+    global log_level
 
-# Runs before starting CertStream
-def initial_configuration():
-    global fuzzed_keywords
+    args, settings = parse_args(argv)
+    if args.debug:
+        log_level = logging.DEBUG
 
     # Setup logging
     logging.basicConfig(format='[%(levelname)s:%(name)s] %(asctime)s - %(message)s', level=log_level)
-    logger.disabled = not cfg.enable_logging
+    # Silences the libraries CertPipe uses as well as its own loggers
+    if not settings.enable_logging:
+        logging.getLogger().setLevel(logging.CRITICAL + 1)
     logger.info("Logging level: {}".format("INFO" if 20 == log_level else "DEBUG" ))
 
-    # Log alerting configuration
-    logger.info("CSV output file: ".format("Enabled" if cfg.enable_csv_output else "Disabled"))
-    logger.info("Slack alerting: {}".format("Enabled" if cfg.enable_slack else "Disabled"))
-    logger.info("Mattermost alerting: {}".format("Enabled" if cfg.enable_mattermost else "Disabled"))
-    
-    if cfg.enable_slack or cfg.enable_mattermost:
-        logger.info("Remote alerts will be sent every {} seconds".format(cfg.alert_send_frequency))
-
-    # URLScan.io configuration
-    logger.info("URLScan.io submission: {}".format("Enabled" if cfg.enable_urlscanio else "Disabled"))
-    
-    if cfg.enable_urlscanio:
-        logger.info("Note: URLScan.io links will return an HTTP 404 response until the scan has finished (~10s)")
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
 
-    # Created fuzzed keywords
-    logger.info("{} keywords in config file".format(len(cfg.keywords)))
-    logger.info("{} 'No-fuzz' keywords in config file".format(len(cfg.no_fuzz_keywords)))
-    logger.info("{} 'Ignore' keywords in config file".format(len(cfg.ignore_keywords)))
-    logger.info("Keyword fuzzer starting...")
-    fuzzed_keywords = fuzz_keywords(cfg.keywords)
-    logger.info("Keyword fuzzer finished")
-    logger.info("{} fuzzed keywords created".format(len(fuzzed_keywords)))
+    pipe = CertPipe(settings)
+    pipe.setup()
+    pipe.run()
 
-    # Start the bulk alert posting thread timer
-    bulk_post_alerts()
-
-
-# Connects to the CertStream service and specifies callback functions
-def start_certstream(): 
-    logger.info("CertStream listener starting...")
-    certstream.listen_for_events(message_callback=certstream_callback, on_open=on_open, on_error=on_error, url='wss://certstream.calidog.io/')
-
-
-# Setup and run the application
-initial_configuration()
-start_certstream()
 
+if __name__ == '__main__':
+    main()
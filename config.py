@@ -18,39 +18,184 @@
 #
 ###########################################################################
 
+# Where certificates come from. 'certstream' listens to the live CertStream websocket at certstream_url,
+# 'replay' plays back a recorded NDJSON file of CertStream messages (see record_file and sources.py).
+input_source = "certstream"
+certstream_url = "wss://certstream.calidog.io/"
+replay_file = "certstream_recording.ndjson.gz"
+replay_speed = 1.0                          # 1 replays at the recorded pace, 10 is ten times faster, 0 as fast as possible
+replay_loop = False
+
+# Record every received CertStream message to this NDJSON file (gzipped if it ends in .gz). Leave empty to disable.
+record_file = ""
+
+# Matching can be spread over several worker processes for high certificate volumes. 0 matches on the CertStream thread.
+matcher_workers = 0
+pipeline_queue_size = 10000                 # Messages waiting for the matcher workers, shared out between them
+pipeline_overload_policy = "block"          # When the queue is full: 'block' waits for a worker, 'drop' discards the message
+
+# The same certificate arrives several times: as a precertificate and as the final certificate, and from several CT logs.
+# Certificates already processed (by serial number and issuer) are skipped, and the match results of recently checked
+# domains are reused instead of running the matcher again. Each matcher worker keeps its own, and gets every copy of the
+# certificates it is sent. 0 disables either.
+certificate_dedup_max_entries = 100000
+match_memo_max_entries = 100000
+
+# Serve counters and latency histograms in the Prometheus text format at http://metrics_host:metrics_port/metrics.
+# When disabled nothing is recorded at all.
+enable_metrics = False
+metrics_host = "127.0.0.1"
+metrics_port = 9108
+
+# Serve a page with the latest matches, updated live, at http://web_ui_host:web_ui_port/. The last web_ui_buffer_size
+# matches are kept in memory; at most web_ui_max_viewers browsers can watch at once.
+enable_web_ui = False
+web_ui_host = "127.0.0.1"
+web_ui_port = 8080
+web_ui_buffer_size = 1000
+web_ui_max_viewers = 50
+
+# Reload keywords, no_fuzz_keywords and ignore_keywords when this file changes (checked every config_reload_interval
+# seconds, 0 to only reload on SIGHUP) or on SIGHUP, without dropping the CertStream connection. Only new keywords
+# are fuzzed. Other settings still need a restart.
+enable_config_reload = False
+config_reload_interval = 5
+
+# How often, in seconds, the stats of each component are written to the debug log.
+stats_log_interval = 60
+
 # Set to True to enable verbose logging. Set to False to only output the matched keywords and domains.
 enable_logging = True
 
 # These keywords will be fuzzed so that look-alike domain matches are identified. 
 keywords = ['google', 'amazon', 'facebook']
 
+# Fuzzers used to create look-alike variations of the keywords above.
+keyword_fuzzers = ['Addition', 'Bitsquatting', 'Homoglyph', 'Hyphenation', 'Insertion', 'Omission',
+                   'Repetition', 'Replacement', 'Subdomain', 'Transposition', 'Vowel-swap']
+
+# Limits on fuzzing long keywords. Homoglyph substitution is applied this many times (each round multiplies the
+# variations), and each fuzzer can be capped at a maximum number of variations per keyword (0 for no cap).
+fuzz_homoglyph_depth = 2
+fuzz_max_per_fuzzer = 0
+
+# How homoglyph look-alikes (gοοgle with Greek omicrons, g00gle, rnicrosoft) are found. 'expand' fuzzes the keywords
+# with the Homoglyph fuzzer above and matches every variation. 'skeleton' skips that fuzzer and instead decodes each
+# punycode domain and folds every look-alike character onto the letter it imitates before matching, which needs one
+# pattern per keyword and catches any number of substitutions. Skeleton matches report the characters substituted.
+homoglyph_matching = "expand"
+
+# How typo look-alikes (gooogle, amzaon, paypa1) are found. 'expand' fuzzes the keywords with the single-edit fuzzers
+# above (Addition, Bitsquatting, Insertion, Omission, Repetition, Replacement, Transposition, Vowel-swap) and matches
+# every variation anywhere in the domain. 'edit-distance' skips those fuzzers and instead compares each dot or hyphen
+# separated part of the domain with the keywords, allowing up to lookalike_max_edits edits. Typos on neighbouring keys
+# and doubled letters count half, and a part is reported if its weighted distance is at most lookalike_max_distance.
+# Keywords shorter than lookalike_min_length are only matched by the other fuzzers, and look-alikes run together with
+# other words in one part (paypa1login) are only found by 'expand'.
+lookalike_matching = "expand"
+lookalike_max_edits = 2
+lookalike_max_distance = 1.0
+lookalike_min_length = 5
+
+# Number of processes used to fuzz keywords at startup. 1 fuzzes in the main process, 0 uses every CPU core.
+fuzz_workers = 1
+
+# Cache fuzzed keywords on disk so restarts only need to fuzz new or changed keywords.
+enable_fuzz_cache = False
+fuzz_cache_dir = ".fuzz_cache"
+# Cached keywords not used for this many days are removed at startup, 0 keeps them forever.
+fuzz_cache_max_age_days = 30
+
 # These keywords will NOT be fuzzed. Useful for searching for domains that contains specific words (i.e., 'prod', 'database', 'bucket', etc...). 
 no_fuzz_keywords = ['userdata', 'admin', 'database']
 
 # These keywords will be ingored.  If a domain contains any of these keywords, then it will not be included in the results.
 ignore_keywords = []
 
-# Save all matched domains to a csv file.  CSV file has three columns (timestamp, matched_keyword, domain).
+# Which part of each domain the keywords are looked for in, after splitting off the public suffix (publicsuffix.org,
+# including hosting providers such as cloudfront.net): 'all' is the whole domain, 'no-suffix' everything in front of the
+# public suffix (subdomains and registered name), 'registered-name' only the label in front of the public suffix.
+# The public suffix list is only loaded for the last two, or when ignore_suffixes is set.
+match_domain_parts = "all"
+
+# Domains under these public suffixes or registered domains are skipped, e.g. ['azurewebsites.net', 'mycompany.com']
+ignore_suffixes = []
+
+# Public suffix list to use, empty for the bundled public_suffix_list.dat
+public_suffix_file = ""
+
+# Save all matched domains to a csv file.  CSV file has four columns (timestamp, matched_keyword, domain, scan_results_url).
 enable_csv_output = True
 output_csv_file = "certpipe_matches.csv"
+output_csv_flush_rows = 100                 # Rows are buffered and written out once this many are waiting...
+output_csv_flush_interval = 5               # ...or every n seconds, whichever comes first
+output_csv_rotate_bytes = 0                 # Rotate the file once it reaches this size in bytes, 0 to disable
+output_csv_rotate_daily = False             # Rotate the file at the start of each day
+output_csv_compress = ""                    # Compress rotated files: 'gzip', 'zstd' (needs the zstandard package) or "" for none
+
+# Save all matched domains to a newline-delimited JSON file, one object per match with the keyword, fuzzer, scan results
+# URL and the certificate details (subject, issuer, validity, fingerprint, every domain on the certificate, CT log).
+enable_json_output = False
+output_json_file = "certpipe_matches.ndjson"
+output_json_flush_rows = 100
+output_json_flush_interval = 5
+output_json_rotate_bytes = 0
+output_json_rotate_daily = False
+output_json_compress = ""                   # Compress rotated files: 'gzip', 'zstd' (needs the zstandard package) or "" for none
+
+# Duplicate suppression for matched domains. 'lru' keeps an exact record of the most recently matched domains,
+# 'bloom' uses a fixed memory budget and accepts a small false positive rate (a new domain wrongly treated as seen).
+dedup_mode = "lru"
+dedup_max_entries = 1000000                 # lru: maximum number of domains remembered
+dedup_ttl = 0                               # lru: forget domains not seen for this many seconds, 0 to disable
+dedup_memory_bytes = 16 * 1024 * 1024       # bloom: memory budget in bytes
+dedup_false_positive_rate = 0.0001          # bloom: target false positive rate
+
+# Keep a history of matched domains on disk (SQLite) so restarts do not report them again. On startup the most recent
+# domains are loaded into the duplicate suppression store above, and domains it no longer holds are looked up here.
+# Domains not seen for history_retention_days are removed, 0 keeps them forever.
+enable_history = False
+history_file = "certpipe_history.db"
+history_retention_days = 90
+history_flush_rows = 500                    # Matches are written in batches once this many are waiting...
+history_flush_interval = 5                  # ...or every n seconds, whichever comes first
 
-# Alert bulk sending.  Groups alert messages together into single alert every n seconds.
+# Alert bulk sending.  Groups alert messages together into single alert every n seconds, or sooner once
+# alert_batch_size alerts are waiting. Failed posts are retried with exponential backoff.
 alert_send_frequency = 30
+alert_batch_size = 50
+alert_max_retries = 5
 
 # Slack alerting configuration.
 enable_slack = False
 slack_token = "<INSERT SLACK API TOKEN>"
 slack_channel = "<INSERT SLACK CHANNEL>"
+slack_message_limit = 4000                  # Longer alert messages are split into several posts
 
 # Mattermost alerting configuration. Requires an Incoming Webhook to be created and added to a channel.
 enable_mattermost = False
 mattermost_webhook_url = "https://<INSERT MATTERMOST SITE>/hooks/<INSERT GENERATED KEY>"
+mattermost_message_limit = 16383
 
 # Submit matched domains to URLScan.io and output links to the scan results in output / alerts. 
 enable_urlscanio = False
 urlscanio_api_key = "<INSERT URLSCAN.IO API KEY>"
+urlscanio_api_url = "https://urlscan.io/api/v1/scan/"
+urlscanio_workers = 2                       # Submissions run in the background on this many worker threads
+urlscanio_queue_size = 1000                 # Matches beyond this many pending submissions are reported without a scan
+urlscanio_rate_limit = 1.0                  # Submissions per second, keep within your URLScan.io API quota
+urlscanio_burst = 5
+urlscanio_max_retries = 3
 
-# Syslog configuration TODO
-#enable_syslog = False
-#syslog_server = "10.10.11.18"
-#syslog_port = 514
+# Syslog output. Each match is sent as an RFC 5424 message with the keyword, fuzzer, domain and scan results URL
+# in structured data. Messages are sent in the background over one long-lived connection, if the collector falls
+# behind the oldest queued messages are dropped (and counted) rather than slowing down CertStream processing.
+enable_syslog = False
+syslog_server = "10.10.11.18"
+syslog_port = 514
+syslog_protocol = "udp"                     # 'udp', 'tcp' or 'tls'
+syslog_facility = "local0"
+syslog_severity = "warning"
+syslog_queue_size = 10000
+syslog_tls_ca_file = None                   # CA bundle to verify the collector's certificate, None for the system CAs
+syslog_tls_verify = True
@@ -0,0 +1,114 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Watches config.py for changes, by polling its modification time and on
+SIGHUP, and hands the new settings to a callback on a background thread.
+
+The file is read into a fresh namespace, so the running config module is
+never touched by the watcher and a config with errors is reported and skipped.
+"""
+
+import logging
+import os
+import runpy
+import signal
+import threading
+
+
+logger = logging.getLogger("certpipe.configwatch")
+
+
+# Runs a config file and returns its settings as a dict
+def load_config(path):
+    settings = runpy.run_path(path)
+    return dict((name, value) for name, value in settings.items() if not name.startswith('_'))
+
+
+class ConfigWatcher():
+    # on_change(settings) is called on the watcher thread. interval is how often, in seconds, the file's modification
+    # time is checked, 0 to only reload on SIGHUP.
+    def __init__(self, path, on_change, interval=5):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        # Whether a SIGHUP also reloads the file, set by start()
+        self.on_sighup = False
+        self._mtime = self._modified()
+        self._requested = threading.Event()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="config-watcher")
+        self.thread.daemon = True
+
+    def _modified(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    # SIGHUP handlers can only be installed from the main thread. Started from any other thread, as when CertPipe is
+    # embedded in another application, the file is only polled, every 5 seconds if interval is 0.
+    def start(self):
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.request_reload())
+            self.on_sighup = True
+        elif not self.interval:
+            self.interval = 5
+        self.thread.start()
+
+    # Safe to call from a signal handler, the reload itself happens on the watcher thread
+    def request_reload(self):
+        self._requested.set()
+
+    def stop(self):
+        self._stop.set()
+        self._requested.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            requested = self._requested.wait(self.interval or None)
+            self._requested.clear()
+            if self._stop.is_set():
+                break
+
+            modified = self._modified()
+            if not requested and modified == self._mtime:
+                continue
+            self._mtime = modified
+            self.reload()
+
+    def reload(self):
+        logger.info("Reloading {}".format(self.path))
+        try:
+            settings = load_config(self.path)
+        except Exception:
+            self.failures += 1
+            logger.exception("Failed to load {}, keeping the current settings".format(self.path))
+            return
+
+        try:
+            self.on_change(settings)
+            self.reloads += 1
+        except Exception:
+            self.failures += 1
+            logger.exception("Failed to apply the settings from {}".format(self.path))
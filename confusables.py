@@ -0,0 +1,189 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Homoglyph matching by confusable skeleton, the alternative to pre-expanding
+keywords with the Homoglyph fuzzer (see homoglyph_matching in config.py).
+
+Punycode labels are IDNA-decoded and every character that looks like an ASCII
+letter is folded onto it, using the fuzzer's GLYPHS table, Unicode
+decomposition (accents are dropped) and a table of cross-script look-alikes
+(Cyrillic, Greek, Armenian, ...). The keywords are folded the same way, so one
+pattern per keyword catches any number of substitutions.
+"""
+
+import unicodedata
+from collections import namedtuple
+
+from fuzzer import GLYPHS
+from matcher import KeywordMatcher
+
+
+# A skeleton match. 'glyphs' lists the (domain text, keyword text) pairs that were substituted.
+SkeletonMatch = namedtuple('SkeletonMatch', ['keyword', 'glyphs', 'start'])
+
+# Look-alikes from other scripts that Unicode decomposition does not fold onto ASCII
+SCRIPT_CONFUSABLES = {
+    # Cyrillic
+    u'а': 'a', u'в': 'b', u'ь': 'b', u'с': 'c', u'ԁ': 'd', u'е': 'e', u'ё': 'e', u'һ': 'h', u'н': 'h', u'і': 'i',
+    u'ї': 'i', u'ј': 'j', u'к': 'k', u'ӏ': 'l', u'м': 'm', u'п': 'n', u'о': 'o', u'р': 'p', u'ԛ': 'q', u'г': 'r',
+    u'ѕ': 's', u'т': 't', u'ц': 'u', u'ѵ': 'v', u'ԝ': 'w', u'х': 'x', u'у': 'y', u'ү': 'y',
+    # Greek
+    u'α': 'a', u'β': 'b', u'ϲ': 'c', u'ε': 'e', u'η': 'n', u'ι': 'i', u'κ': 'k', u'ν': 'v', u'ο': 'o', u'ρ': 'p',
+    u'τ': 't', u'υ': 'u', u'ω': 'w', u'χ': 'x', u'γ': 'y',
+    # Armenian
+    u'ա': 'w', u'ց': 'g', u'հ': 'h', u'յ': 'j', u'ո': 'n', u'օ': 'o', u'ս': 'u', u'զ': 'q',
+    # Latin letters without a decomposition
+    u'ɐ': 'a', u'ǝ': 'e', u'ɛ': 'e', u'ɪ': 'i', u'ɴ': 'n', u'ɵ': 'o', u'ø': 'o', u'œ': 'oe', u'ß': 'ss', u'þ': 'p',
+    u'ŀ': 'l', u'ĸ': 'k',
+}
+
+# ASCII characters that are confused with each other. 'i', 'l' and '1' all fold onto 'l', '0' onto 'o'.
+ASCII_CONFUSABLES = {'0': 'o', '1': 'l', 'i': 'l'}
+
+# Letter pairs that look like a single letter, folded after the single characters
+PAIR_CONFUSABLES = {'rn': 'm', 'vv': 'w', 'cl': 'd'}
+
+
+def _fold_ascii(text):
+    return ''.join(ASCII_CONFUSABLES.get(c, c) for c in text)
+
+
+def _decompose(c):
+    folded = ''.join(d for d in unicodedata.normalize('NFKD', c) if not unicodedata.combining(d))
+    return folded.lower()
+
+
+# Single character foldings, filled in lazily by str.translate as new characters turn up
+class _FoldTable(dict):
+    def __missing__(self, codepoint):
+        c = chr(codepoint)
+        folded = _decompose(c)
+        if folded != c:
+            folded = ''.join(self.get(ord(d), d) if d.isascii() else d for d in folded)
+        self[codepoint] = folded
+        return folded
+
+
+_FOLD = _FoldTable()
+for _letter, _glyphs in GLYPHS.items():
+    for _glyph in _glyphs:
+        if len(_glyph) == 1 and not _glyph.isascii():
+            _FOLD[ord(_glyph)] = _fold_ascii(_letter)
+for _glyph, _letter in SCRIPT_CONFUSABLES.items():
+    _FOLD[ord(_glyph)] = _fold_ascii(_letter)
+for _c, _letter in ASCII_CONFUSABLES.items():
+    _FOLD[ord(_c)] = _letter
+for _c in 'abcdefghjkmnopqrstuvwxyz23456789-.':
+    _FOLD[ord(_c)] = _c
+
+
+# Decodes the punycode (xn--) labels of a domain. Labels that are not valid punycode are left as they are.
+def idna_decode(domain):
+    if 'xn--' not in domain:
+        return domain
+
+    labels = domain.split('.')
+    for i, label in enumerate(labels):
+        if label.startswith('xn--'):
+            try:
+                labels[i] = label.encode('ascii').decode('idna')
+            except UnicodeError:
+                pass
+    return '.'.join(labels)
+
+
+# The confusable skeleton of a (decoded) domain or keyword
+def skeleton(text):
+    folded = text.translate(_FOLD)
+    for pair, letter in PAIR_CONFUSABLES.items():
+        if pair in folded:
+            folded = folded.replace(pair, letter)
+    return folded
+
+
+# Same as skeleton(), but also returns the piece of the original text behind each skeleton character.
+# A character folded onto several letters (œ -> oe) is given to the first of them. Slower, only used to explain a match.
+def skeleton_segments(text):
+    segments = []
+    for i, c in enumerate(text):
+        for folded in c.translate(_FOLD):
+            segments.append((folded, i))
+
+    chars = []
+    sources = []
+    taken = -1
+    j = 0
+    while j < len(segments):
+        folded, first = segments[j]
+        last = first
+        pair = folded + segments[j + 1][0] if j + 1 < len(segments) else None
+        if pair in PAIR_CONFUSABLES:
+            folded = PAIR_CONFUSABLES[pair]
+            last = segments[j + 1][1]
+            j += 1
+        j += 1
+
+        chars.append(folded)
+        sources.append(text[max(first, taken + 1):last + 1])
+        taken = last
+    return ''.join(chars), sources
+
+
+class SkeletonMatcher():
+    # Ignore keywords are folded too, so look-alikes of an ignored name are ignored as well. They are also looked for in
+    # the domain as it is, since a pair fold across their edge (cor|nice -> comlce) hides them from the skeleton.
+    def __init__(self, keywords=(), ignore_keywords=()):
+        self.keywords = list(keywords)
+        self._skeletons = dict((keyword, skeleton(keyword)) for keyword in self.keywords)
+        # The fuzzer slot of each pattern carries the keyword the skeleton came from
+        self._matcher = KeywordMatcher([skeleton(keyword) for keyword in ignore_keywords], (),
+                                       [(self._skeletons[keyword], keyword) for keyword in self.keywords])
+        # As no-fuzz keywords, so match() reports a hit instead of None
+        self._ignore = KeywordMatcher((), [keyword.lower() for keyword in ignore_keywords]) if ignore_keywords else None
+
+    def __len__(self):
+        return len(self._matcher)
+
+    # Returns a SkeletonMatch, or None if no keyword skeleton is in the domain skeleton or an ignore keyword hit
+    def match(self, domain):
+        decoded = idna_decode(domain).lower()
+        match = self._matcher.match(skeleton(decoded))
+        if match is None or (self._ignore and self._ignore.match(decoded)):
+            return None
+
+        keyword = match.fuzzer
+        length = len(self._skeletons[keyword])
+        _, domain_sources = skeleton_segments(decoded)
+        _, keyword_sources = skeleton_segments(keyword)
+
+        glyphs = []
+        for used, expected in zip(domain_sources[match.start:match.start + length], keyword_sources):
+            if used != expected and (used, expected) not in glyphs:
+                glyphs.append((used, expected))
+        return SkeletonMatch(keyword, glyphs, match.start)
+
+
+# Describes the substitutions of a match for logs and alerts, e.g. "Homoglyph (а for a, 0 for o)"
+def describe(match):
+    if not match.glyphs:
+        return "Homoglyph"
+    return "Homoglyph (" + ", ".join(u"{} for {}".format(used, expected) for used, expected in match.glyphs) + ")"
@@ -0,0 +1,256 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Bounded stores for remembering previously matched domains.
+
+Both stores share the same interface: seen_before(domain) records the domain
+and returns True if it was already recorded, and stats() returns a dict with
+the lookup hit rate and an estimate of the memory in use.
+
+MatchMemo is a bounded cache of recent match results per domain, so domains
+that come up again skip the keyword matcher.
+"""
+
+import hashlib
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class DedupStore():
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def seen_before(self, domain):
+        with self.lock:
+            self.lookups += 1
+            seen = self._check_and_add(domain)
+            if seen:
+                self.hits += 1
+            return seen
+
+    def add(self, domain):
+        with self.lock:
+            self._check_and_add(domain)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': float(self.hits) / self.lookups if self.lookups else 0.0,
+                'entries': len(self),
+                'memory_bytes': self.memory_bytes()
+            }
+
+
+# Exact store. Keeps the most recently seen max_entries domains, optionally forgetting domains not seen for ttl seconds.
+class LRUDedup(DedupStore):
+    mode = 'lru'
+
+    def __init__(self, max_entries=1000000, ttl=0):
+        DedupStore.__init__(self)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._domains = OrderedDict()
+        self._string_bytes = 0
+
+    def __len__(self):
+        return len(self._domains)
+
+    def __contains__(self, domain):
+        with self.lock:
+            last_seen = self._domains.get(domain)
+            return last_seen is not None and not self._expired(last_seen, time.time())
+
+    def _expired(self, last_seen, now):
+        return self.ttl > 0 and now - last_seen > self.ttl
+
+    def _check_and_add(self, domain):
+        now = time.time()
+        last_seen = self._domains.get(domain)
+
+        if last_seen is not None:
+            self._domains[domain] = now
+            self._domains.move_to_end(domain)
+            return not self._expired(last_seen, now)
+
+        self._domains[domain] = now
+        self._string_bytes += sys.getsizeof(domain)
+        self._evict(now)
+        return False
+
+    def _evict(self, now):
+        # Oldest entries are at the front, so expired and over-budget entries are all popped from there
+        while self._domains:
+            domain, last_seen = next(iter(self._domains.items()))
+            if len(self._domains) <= self.max_entries and not self._expired(last_seen, now):
+                break
+            self._domains.popitem(last=False)
+            self._string_bytes -= sys.getsizeof(domain)
+            self.evictions += 1
+
+    def memory_bytes(self):
+        return sys.getsizeof(self._domains) + self._string_bytes
+
+    # Forgets every domain, the stats are kept
+    def clear(self):
+        with self.lock:
+            self._domains.clear()
+            self._string_bytes = 0
+
+    def stats(self):
+        stats = DedupStore.stats(self)
+        stats['evictions'] = self.evictions
+        return stats
+
+
+# Probabilistic store with a fixed memory budget. Two Bloom filter generations are kept, when the current one
+# reaches its capacity the older one is dropped, so old domains age out instead of the false positive rate growing.
+class BloomDedup(DedupStore):
+    mode = 'bloom'
+
+    def __init__(self, memory_bytes=16 * 1024 * 1024, false_positive_rate=0.0001):
+        DedupStore.__init__(self)
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("false_positive_rate must be between 0 and 1")
+
+        self.false_positive_rate = false_positive_rate
+        self.num_bits = max(8, (memory_bytes // 2) * 8)
+        self.capacity = max(1, int(-self.num_bits * math.log(2) ** 2 / math.log(false_positive_rate)))
+        self.num_hashes = max(1, int(round(float(self.num_bits) / self.capacity * math.log(2))))
+        self.rotations = 0
+        self._current = bytearray(self.num_bits // 8)
+        self._previous = bytearray(self.num_bits // 8)
+        self._current_count = 0
+        self._previous_count = 0
+
+    def __len__(self):
+        return self._current_count + self._previous_count
+
+    def __contains__(self, domain):
+        positions = self._positions(domain)
+        with self.lock:
+            return self._test(self._current, positions) or self._test(self._previous, positions)
+
+    # Double hashing, k positions from the two halves of a single 128 bit digest
+    def _positions(self, domain):
+        digest = hashlib.blake2b(domain.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    @staticmethod
+    def _test(bits, positions):
+        for p in positions:
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def _check_and_add(self, domain):
+        positions = self._positions(domain)
+
+        if self._test(self._current, positions):
+            return True
+
+        seen = self._test(self._previous, positions)
+
+        if self._current_count >= self.capacity:
+            self._previous = self._current
+            self._previous_count = self._current_count
+            self._current = bytearray(self.num_bits // 8)
+            self._current_count = 0
+            self.rotations += 1
+
+        bits = self._current
+        for p in positions:
+            bits[p >> 3] |= 1 << (p & 7)
+        self._current_count += 1
+
+        return seen
+
+    def memory_bytes(self):
+        return len(self._current) + len(self._previous)
+
+    def stats(self):
+        stats = DedupStore.stats(self)
+        stats['capacity'] = self.capacity
+        stats['false_positive_rate'] = self.false_positive_rate
+        stats['rotations'] = self.rotations
+        return stats
+
+
+# The most recent match result of up to max_entries domains, least recently used results are evicted first.
+# It sits in front of the matcher on every domain, so unlike the stores above it has no lock: only use it from one thread.
+class MatchMemo():
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    # Returns the result stored for the domain, or None
+    def get(self, domain):
+        self.lookups += 1
+        result = self._results.get(domain)
+        if result is not None:
+            self._results.move_to_end(domain)
+            self.hits += 1
+        return result
+
+    # Called after get(), which already moved a stale entry for the domain to the most recent end
+    def put(self, domain, result):
+        results = self._results
+        results[domain] = result
+        if len(results) > self.max_entries:
+            results.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.lookups
+        hits = self.hits
+        return {
+            'lookups': lookups,
+            'hits': hits,
+            'hit_rate': float(hits) / lookups if lookups else 0.0,
+            'entries': len(self._results),
+            'evictions': self.evictions
+        }
+
+
+# Build the dedup store selected in the config
+def create_dedup_store(cfg):
+    if cfg.dedup_mode == 'lru':
+        return LRUDedup(cfg.dedup_max_entries, cfg.dedup_ttl)
+    if cfg.dedup_mode == 'bloom':
+        return BloomDedup(cfg.dedup_memory_bytes, cfg.dedup_false_positive_rate)
+    raise ValueError("Unknown dedup_mode: {}".format(cfg.dedup_mode))
@@ -0,0 +1,144 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+On-disk cache of fuzzed keyword variations, so restarts only fuzz new or changed keywords.
+
+Each keyword is cached in its own file, named after a hash of the keyword, the
+fuzzer settings (which fuzzers ran and their limits) and the version of
+fuzzer.py that generated it. Any
+change to one of those produces a different file name, so stale entries are
+never read back. Entries that go unused for fuzz_cache_max_age_days are
+removed by prune(). The file is plain UTF-8 text: one '#Fuzzer' line per fuzzer
+followed by the variations it generated, in generation order.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import time
+
+import fuzzer
+
+
+logger = logging.getLogger("certpipe.fuzzcache")
+
+CACHE_SUFFIX = ".fuzz"
+
+
+# Hash of the fuzzer source, any change to the fuzzing code invalidates every cached keyword
+def code_version():
+    with open(fuzzer.__file__, 'rb') as source:
+        return hashlib.sha1(source.read()).hexdigest()
+
+
+class FuzzCache():
+    def __init__(self, directory, fuzzers, max_per_fuzzer=0, homoglyph_depth=2):
+        self.directory = directory
+        self.version = code_version()
+        self.settings = sorted(fuzzers) + ["max_per_fuzzer={}".format(max_per_fuzzer), "homoglyph_depth={}".format(homoglyph_depth)]
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, keyword):
+        key = u"\0".join([self.version, keyword] + self.settings)
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + CACHE_SUFFIX)
+
+    # Returns the cached variations as {fuzzer: [variation, ...]}, or None if the keyword has not been cached.
+    # A file that cannot be read back is deleted and counted as a miss, so the keyword is fuzzed and cached again.
+    def get(self, keyword):
+        path = self.path(keyword)
+        try:
+            with io.open(path, 'r', encoding='utf-8') as cache_file:
+                text = cache_file.read()
+            os.utime(path)
+        except UnicodeDecodeError:
+            text = u""
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+
+        variations = _parse(text)
+        if variations is None:
+            logger.warning("Removing unreadable fuzz cache file {}".format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return variations
+
+    def put(self, keyword, variations):
+        lines = []
+        for fuzzer_name, domains in variations.items():
+            lines.append(u"#" + fuzzer_name)
+            lines.extend(domains)
+
+        # Written to a temporary file first so a crash mid-write never leaves a truncated cache entry
+        path = self.path(keyword)
+        temp_path = path + ".tmp"
+        try:
+            with io.open(temp_path, 'w', encoding='utf-8') as cache_file:
+                cache_file.write(u"\n".join(lines) + u"\n")
+            os.replace(temp_path, path)
+        except (IOError, OSError) as e:
+            logger.error("Unable to write fuzz cache file {}: {}".format(path, e))
+
+    # Remove cache files not read or written for max_age_days. Entries of other keyword lists or settings sharing
+    # the directory are kept while they are in use, get() refreshes the modification time of the files it reads.
+    def prune(self, max_age_days):
+        if max_age_days <= 0:
+            return 0
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+# Variations from the text of a cache file, None if it is not one. put() always writes at least a newline.
+def _parse(text):
+    if not text.endswith(u"\n"):
+        return None
+    variations = {}
+    current = None
+    for line in text.split(u"\n"):
+        if line.startswith(u"#"):
+            current = variations.setdefault(line[1:], [])
+        elif line:
+            if current is None:
+                return None
+            current.append(line)
+    return variations
@@ -0,0 +1,295 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Keyword fuzzing. Generates look-alike variations of the configured keywords.
+"""
+
+import os
+import re
+
+
+# Every fuzzer DomainFuzz.generate can run, in the order it runs them
+FUZZERS = ['Addition', 'Bitsquatting', 'Homoglyph', 'Hyphenation', 'Insertion', 'Omission',
+           'Repetition', 'Replacement', 'Subdomain', 'Transposition', 'Vowel-swap']
+
+# Keyboard layouts, each key maps to the keys around it
+QWERTY = {
+    '1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
+    'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
+    'a': 'qwsz', 's': 'edxzaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
+    'z': 'asx', 'x': 'zsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
+}
+
+QWERTZ = {
+    '1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7zt5', '7': '8uz6', '8': '9iu7', '9': '0oi8', '0': 'po9',
+    'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6zgfr5', 'z': '7uhgt6', 'u': '8ijhz7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
+    'a': 'qwsy', 's': 'edxyaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'zhbvft', 'h': 'ujnbgz', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
+    'y': 'asx', 'x': 'ysdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
+}
+
+AZERTY = {
+    '1': '2a', '2': '3za1', '3': '4ez2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
+    'a': '2zq1', 'z': '3esqa2', 'e': '4rdsz3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0m',
+    'q': 'zswa', 's': 'edxwqz', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'iknhu', 'k': 'olji', 'l': 'kopm', 'm': 'lp',
+    'w': 'sxq', 'x': 'wsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhj'
+}
+
+KEYBOARDS = [QWERTY, QWERTZ, AZERTY]
+
+# Characters that look like each ASCII letter
+GLYPHS = {
+    'a': [u'à', u'á', u'â', u'ã', u'ä', u'å', u'ɑ', u'ạ', u'ǎ', u'ă', u'ȧ', u'ą'],
+    'b': ['d', 'lb', u'ʙ', u'ɓ', u'ḃ', u'ḅ', u'ḇ', u'ƅ'],
+    'c': ['e', u'ƈ', u'ċ', u'ć', u'ç', u'č', u'ĉ'],
+    'd': ['b', 'cl', 'dl', u'ɗ', u'đ', u'ď', u'ɖ', u'ḑ', u'ḋ', u'ḍ', u'ḏ', u'ḓ'],
+    'e': ['c', u'é', u'è', u'ê', u'ë', u'ē', u'ĕ', u'ě', u'ė', u'ẹ', u'ę', u'ȩ', u'ɇ', u'ḛ'],
+    'f': [u'ƒ', u'ḟ'],
+    'g': ['q', u'ɢ', u'ɡ', u'ġ', u'ğ', u'ǵ', u'ģ', u'ĝ', u'ǧ', u'ǥ'],
+    'h': ['lh', u'ĥ', u'ȟ', u'ħ', u'ɦ', u'ḧ', u'ḩ', u'ⱨ', u'ḣ', u'ḥ', u'ḫ', u'ẖ'],
+    'i': ['1', 'l', u'í', u'ì', u'ï', u'ı', u'ɩ', u'ǐ', u'ĭ', u'ỉ', u'ị', u'ɨ', u'ȋ', u'ī'],
+    'j': [u'ʝ', u'ɉ'],
+    'k': ['lk', 'ik', 'lc', u'ḳ', u'ḵ', u'ⱪ', u'ķ'],
+    'l': ['1', 'i', u'ɫ', u'ł'],
+    'm': ['n', 'nn', 'rn', 'rr', u'ṁ', u'ṃ', u'ᴍ', u'ɱ', u'ḿ'],
+    'n': ['m', 'r', u'ń', u'ṅ', u'ṇ', u'ṉ', u'ñ', u'ņ', u'ǹ', u'ň', u'ꞑ'],
+    'o': ['0', u'ȯ', u'ọ', u'ỏ', u'ơ', u'ó', u'ö'],
+    'p': [u'ƿ', u'ƥ', u'ṕ', u'ṗ'],
+    'q': ['g', u'ʠ'],
+    'r': [u'ʀ', u'ɼ', u'ɽ', u'ŕ', u'ŗ', u'ř', u'ɍ', u'ɾ', u'ȓ', u'ȑ', u'ṙ', u'ṛ', u'ṟ'],
+    's': [u'ʂ', u'ś', u'ṣ', u'ṡ', u'ș', u'ŝ', u'š'],
+    't': [u'ţ', u'ŧ', u'ṫ', u'ṭ', u'ț', u'ƫ'],
+    'u': [u'ᴜ', u'ǔ', u'ŭ', u'ü', u'ʉ', u'ù', u'ú', u'û', u'ũ', u'ū', u'ų', u'ư', u'ů', u'ű', u'ȕ', u'ȗ', u'ụ'],
+    'v': [u'ṿ', u'ⱱ', u'ᶌ', u'ṽ', u'ⱴ'],
+    'w': ['vv', u'ŵ', u'ẁ', u'ẃ', u'ẅ', u'ⱳ', u'ẇ', u'ẉ', u'ẘ'],
+    'y': [u'ʏ', u'ý', u'ÿ', u'ŷ', u'ƴ', u'ȳ', u'ɏ', u'ỿ', u'ẏ', u'ỵ'],
+    'z': [u'ʐ', u'ż', u'ź', u'ᴢ', u'ƶ', u'ẓ', u'ẕ', u'ⱬ']
+}
+
+
+# Fuzzing code based on: https://github.com/elceef/dnstwist
+#
+# Each fuzzer is a generator, so variations are produced one at a time and never built up in intermediate lists.
+# DomainFuzz.fuzz() streams (variation, fuzzer) pairs, deduplicated within each fuzzer and optionally capped at
+# max_per_fuzzer variations. homoglyph_depth is how many rounds of glyph substitution are applied, 2 by default.
+class DomainFuzz():
+    def __init__(self, domain, max_per_fuzzer=0, homoglyph_depth=2):
+        self.domain = domain
+        self.max_per_fuzzer = max_per_fuzzer
+        self.homoglyph_depth = homoglyph_depth
+        self.variations = {}
+        self.qwerty = QWERTY
+        self.qwertz = QWERTZ
+        self.azerty = AZERTY
+        self.keyboards = KEYBOARDS
+
+    def __validate_domain(self, domain):
+        try:
+            domain_idna = domain.encode('idna').decode()
+        except UnicodeError:
+            # '.tla'.encode('idna') raises UnicodeError: label empty or too long
+            # This can be obtained when __omission takes a one-letter domain.
+            return False
+        if len(domain) == len(domain_idna) and domain != domain_idna:
+            return False
+        allowed = re.compile('(?=^.{4,253}$)(^((?!-)[a-zA-Z0-9-]{1,63}(?<!-)\.)+[a-zA-Z]{2,63}\.?$)', re.IGNORECASE)
+        return allowed.match(domain_idna)
+
+    def __bitsquatting(self):
+        masks = [1, 2, 4, 8, 16, 32, 64, 128]
+        for i in range(0, len(self.domain)):
+            c = self.domain[i]
+            for j in range(0, len(masks)):
+                b = chr(ord(c) ^ masks[j])
+                o = ord(b)
+                if (o >= 48 and o <= 57) or (o >= 97 and o <= 122) or o == 45:
+                    yield self.domain[:i] + b + self.domain[i+1:]
+
+    # One round of glyph substitution on a domain. The original dnstwist code slides every window size over the
+    # domain and replaces all occurrences of a character inside the window. The distinct results of that are every
+    # contiguous run of a character's occurrences replaced by one of its glyphs, as long as the run does not span the
+    # whole domain (windows are at most len - 1 long), so those runs are enumerated directly.
+    @staticmethod
+    def __homoglyph_round(domain):
+        occurrences = {}
+        for p, c in enumerate(domain):
+            if c in GLYPHS:
+                occurrences.setdefault(c, []).append(p)
+
+        last = len(domain) - 1
+        for c, positions in occurrences.items():
+            for a in range(len(positions)):
+                for b in range(a, len(positions)):
+                    if positions[a] == 0 and positions[b] == last:
+                        continue
+                    run = positions[a:b+1]
+                    for g in GLYPHS[c]:
+                        parts = []
+                        prev = 0
+                        for p in run:
+                            parts.append(domain[prev:p])
+                            parts.append(g)
+                            prev = p + 1
+                        parts.append(domain[prev:])
+                        yield ''.join(parts)
+
+    def __homoglyph(self):
+        frontier = [self.domain]
+        seen = set()
+        for depth in range(self.homoglyph_depth):
+            next_frontier = []
+            for domain in frontier:
+                for result in self.__homoglyph_round(domain):
+                    if result not in seen:
+                        seen.add(result)
+                        next_frontier.append(result)
+                        yield result
+            frontier = next_frontier
+
+    def __hyphenation(self):
+        for i in range(1, len(self.domain)):
+            yield self.domain[:i] + '-' + self.domain[i:]
+
+    def __insertion(self):
+        for i in range(1, len(self.domain)-1):
+            for keys in self.keyboards:
+                if self.domain[i] in keys:
+                    for c in keys[self.domain[i]]:
+                        yield self.domain[:i] + c + self.domain[i] + self.domain[i+1:]
+                        yield self.domain[:i] + self.domain[i] + c + self.domain[i+1:]
+
+    def __omission(self):
+        for i in range(0, len(self.domain)):
+            yield self.domain[:i] + self.domain[i+1:]
+
+        n = re.sub(r'(.)\1+', r'\1', self.domain)
+
+        if n != self.domain:
+            yield n
+
+    def __repetition(self):
+        for i in range(0, len(self.domain)):
+            if self.domain[i].isalpha():
+                yield self.domain[:i] + self.domain[i] + self.domain[i] + self.domain[i+1:]
+
+    def __replacement(self):
+        for i in range(0, len(self.domain)):
+            for keys in self.keyboards:
+                if self.domain[i] in keys:
+                    for c in keys[self.domain[i]]:
+                        yield self.domain[:i] + c + self.domain[i+1:]
+
+    def __subdomain(self):
+        for i in range(1, len(self.domain)):
+            if self.domain[i] not in ['-', '.'] and self.domain[i-1] not in ['-', '.']:
+                yield self.domain[:i] + '.' + self.domain[i:]
+
+    def __transposition(self):
+        for i in range(0, len(self.domain)-1):
+            if self.domain[i+1] != self.domain[i]:
+                yield self.domain[:i] + self.domain[i+1] + self.domain[i] + self.domain[i+2:]
+
+    def __vowel_swap(self):
+        vowels = 'aeiou'
+
+        for i in range(0, len(self.domain)):
+            for vowel in vowels:
+                if self.domain[i] in vowels:
+                    yield self.domain[:i] + vowel + self.domain[i+1:]
+
+    def __addition(self):
+        for i in range(97, 123):
+            yield self.domain + chr(i)
+
+    # Streams (variation, fuzzer) pairs for the given fuzzers (all of them by default), starting with the original
+    def fuzz(self, fuzzers=None):
+        yield self.domain, 'Original*'
+
+        generators = [
+            ('Addition', self.__addition),
+            ('Bitsquatting', self.__bitsquatting),
+            ('Homoglyph', self.__homoglyph),
+            ('Hyphenation', self.__hyphenation),
+            ('Insertion', self.__insertion),
+            ('Omission', self.__omission),
+            ('Repetition', self.__repetition),
+            ('Replacement', self.__replacement),
+            ('Subdomain', self.__subdomain),
+            ('Transposition', self.__transposition),
+            ('Vowel-swap', self.__vowel_swap)
+        ]
+
+        for fuzzer, generator in generators:
+            if fuzzers is not None and fuzzer not in fuzzers:
+                continue
+            seen = set()
+            for domain in generator():
+                if domain in seen:
+                    continue
+                seen.add(domain)
+                yield domain, fuzzer
+                if self.max_per_fuzzer and len(seen) >= self.max_per_fuzzer:
+                    break
+
+    # Runs the fuzzers and returns the variations grouped by fuzzer: {fuzzer: [variation, ...]}, in generation order
+    def generate(self, fuzzers=None):
+        self.variations = {}
+        for domain, fuzzer in self.fuzz(fuzzers):
+            self.variations.setdefault(fuzzer, []).append(domain)
+        return self.variations
+
+
+# Flattens {fuzzer: [variation, ...]} back into (variation, fuzzer) pairs
+def variation_pairs(variations):
+    for fuzzer, domains in variations.items():
+        for domain in domains:
+            yield domain, fuzzer
+
+
+# Fuzz a single keyword. Kept at module level so it can be sent to a worker process.
+def fuzz_keyword(keyword, fuzzers=None, max_per_fuzzer=0, homoglyph_depth=2):
+    return DomainFuzz(keyword, max_per_fuzzer, homoglyph_depth).generate(fuzzers)
+
+
+# Fuzz a list of keywords, spread over a pool of worker processes when workers > 1 (0 uses every core).
+# Returns [(keyword, variations), ...] in the order of the keywords given, so the result is the same whatever
+# the number of workers.
+def fuzz_keywords_parallel(keywords, fuzzers=None, max_per_fuzzer=0, homoglyph_depth=2, workers=1):
+    keywords = list(keywords)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(keywords))
+
+    if workers <= 1:
+        return [(keyword, fuzz_keyword(keyword, fuzzers, max_per_fuzzer, homoglyph_depth)) for keyword in keywords]
+
+    # Only imported when a pool is needed, it takes a while to load
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Longest keywords take the longest to fuzz, start them first so no worker is left with one at the end
+        futures = dict((pool.submit(fuzz_keyword, keyword, fuzzers, max_per_fuzzer, homoglyph_depth), keyword)
+                       for keyword in sorted(set(keywords), key=len, reverse=True))
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    return [(keyword, results[keyword]) for keyword in keywords]
@@ -0,0 +1,270 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Persistent history of matched domains, so a restart does not alert on (or
+resubmit to URLScan.io) domains that were already reported.
+
+Matches are kept in a SQLite database in WAL mode, one row per domain with the
+first and last time it was seen, the keyword and fuzzer that matched, the scan
+results URL and the number of times it came up. Writes are queued and applied
+in batches by a writer thread, which retries a batch that fails to write (the
+database locked by another process, a full disk) on its next flushes; lookups
+check the queue first and then the database by primary key. Rows not seen for retention_days are deleted.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger("certpipe.history")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    domain TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    keyword TEXT,
+    fuzzer TEXT,
+    scan_results_url TEXT,
+    hits INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS matches_last_seen ON matches (last_seen);
+"""
+
+# Compaction runs at startup and then this often, in seconds
+COMPACT_INTERVAL = 3600
+
+# Failed writes in a row after which the queued matches are dropped, a batch is retried every flush_interval until then
+MAX_WRITE_RETRIES = 5
+
+
+class MatchHistory():
+    def __init__(self, path, retention_days=90, flush_rows=500, flush_interval=5):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flushed = threading.Condition(self.lock)
+        self.stop_event = threading.Event()
+        # domain -> [first_seen, last_seen, keyword, fuzzer, scan_results_url, hits], for matches not yet written
+        self._pending = {}
+        self.writes = 0
+        self.write_failures = 0
+        self.dropped = 0
+        self.deleted = 0
+        self.lookups = 0
+        self.hits = 0
+
+        # The writer thread has its own connection, this one is for lookups
+        self._db = self._connect(create=True)
+        self._db.executescript(SCHEMA)
+        self._read_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._run, name="match-history")
+        self.thread.daemon = True
+
+    def _connect(self, create=False):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        if create:
+            # Lets compaction free pages without rewriting the whole file. It has to be set before anything creates the
+            # database, switching to WAL mode included, and a database created without it is converted once by VACUUM.
+            db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("Match history: enabling incremental vacuum on {}".format(self.path))
+                db.execute("VACUUM")
+        db.execute("PRAGMA journal_mode=WAL")
+        # A crash can lose the last transactions but never corrupts the database in WAL mode
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def start(self):
+        self.thread.start()
+
+    # Returns the domains seen in the last max_age seconds (all of them if 0), oldest first, at most limit of them
+    def recent(self, max_age=0, limit=0):
+        since = time.time() - max_age if max_age else 0
+        query = "SELECT domain FROM (SELECT domain, last_seen FROM matches WHERE last_seen >= ? ORDER BY last_seen DESC"
+        if limit:
+            query += " LIMIT {:d}".format(limit)
+        query += ") ORDER BY last_seen"
+        with self._read_lock:
+            return [row[0] for row in self._db.execute(query, (since,))]
+
+    # True if the domain was matched in the last max_age seconds (ever, within the retention, if 0)
+    def seen(self, domain, max_age=0):
+        since = time.time() - max_age if max_age else 0
+        with self.lock:
+            self.lookups += 1
+            pending = self._pending.get(domain)
+        if pending is not None:
+            found = pending[1] >= since
+        else:
+            with self._read_lock:
+                row = self._db.execute("SELECT last_seen FROM matches WHERE domain = ?", (domain,)).fetchone()
+            found = row is not None and row[0] >= since
+
+        if found:
+            with self.lock:
+                self.hits += 1
+        return found
+
+    # Records a new match. Safe to call from any thread, never waits on the database.
+    def record(self, domain, keyword, fuzzer, scan_results_url=""):
+        now = time.time()
+        with self.lock:
+            entry = self._pending.get(domain)
+            if entry is None:
+                self._pending[domain] = [now, now, keyword, fuzzer, scan_results_url, 1]
+            else:
+                entry[1:5] = [now, keyword, fuzzer, scan_results_url or entry[4]]
+                entry[5] += 1
+            if len(self._pending) >= self.flush_rows:
+                self.flushed.notify()
+
+    # Notes that an already recorded domain matched again
+    def touch(self, domain):
+        now = time.time()
+        with self.lock:
+            entry = self._pending.get(domain)
+            if entry is None:
+                self._pending[domain] = [now, now, None, None, None, 1]
+            else:
+                entry[1] = now
+                entry[5] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self._pending),
+                'writes': self.writes,
+                'dropped': self.dropped,
+                'deleted': self.deleted,
+                'lookups': self.lookups,
+                'hits': self.hits
+            }
+
+    # Writes everything queued and stops the writer thread
+    def close(self, timeout=None):
+        self.stop_event.set()
+        with self.lock:
+            self.flushed.notify()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        else:
+            self._write(self._db)
+        with self._read_lock:
+            self._db.close()
+
+    def _run(self):
+        db = self._connect()
+        next_compact = 0
+        while not self.stop_event.is_set():
+            if time.time() >= next_compact:
+                self._compact(db)
+                next_compact = time.time() + COMPACT_INTERVAL
+
+            # After a failed write the batch is back in the queue, wait before trying it again
+            if self.write_failures:
+                self.stop_event.wait(self.flush_interval)
+            else:
+                with self.lock:
+                    if len(self._pending) < self.flush_rows and not self.stop_event.is_set():
+                        self.flushed.wait(self.flush_interval)
+            self._write(db)
+
+        self._write(db)
+        db.close()
+
+    def _write(self, db):
+        with self.lock:
+            batch = self._pending
+            self._pending = {}
+        if not batch:
+            return
+
+        new = []
+        seen_again = []
+        for domain, (first_seen, last_seen, keyword, fuzzer, scan_results_url, hits) in batch.items():
+            if keyword is not None:
+                new.append((domain, first_seen, last_seen, keyword, fuzzer, scan_results_url, 0))
+            seen_again.append((last_seen, hits, keyword, fuzzer, scan_results_url, domain))
+
+        # INSERT OR IGNORE then UPDATE rather than an upsert, which older SQLite builds do not have
+        try:
+            with db:
+                db.executemany("INSERT OR IGNORE INTO matches (domain, first_seen, last_seen, keyword, fuzzer, "
+                               "scan_results_url, hits) VALUES (?, ?, ?, ?, ?, ?, ?)", new)
+                db.executemany("UPDATE matches SET last_seen = MAX(last_seen, ?), hits = hits + ?, "
+                               "keyword = COALESCE(?, keyword), fuzzer = COALESCE(?, fuzzer), "
+                               "scan_results_url = COALESCE(NULLIF(?, ''), scan_results_url) WHERE domain = ?", seen_again)
+        except sqlite3.Error:
+            logger.exception("Failed to write {} matches to {}".format(len(batch), self.path))
+            self._requeue(batch)
+            return
+
+        with self.lock:
+            self.writes += len(batch)
+            self.write_failures = 0
+
+    # Puts a batch that failed to write back in the queue, merged with what was queued since, unless it failed too often
+    def _requeue(self, batch):
+        with self.lock:
+            self.write_failures += 1
+            if self.write_failures > MAX_WRITE_RETRIES:
+                logger.error("Dropping {} matches after {} failed writes to {}".format(len(batch), MAX_WRITE_RETRIES + 1, self.path))
+                self.dropped += len(batch)
+                self.write_failures = 0
+                return
+            for domain, entry in batch.items():
+                newer = self._pending.get(domain)
+                if newer is None:
+                    self._pending[domain] = entry
+                else:
+                    # The newer entry is for a domain already in the batch, keep the earliest first_seen and add up the hits
+                    newer[0] = min(newer[0], entry[0])
+                    newer[1] = max(newer[1], entry[1])
+                    if newer[2] is None:
+                        newer[2:4] = entry[2:4]
+                    newer[4] = newer[4] or entry[4]
+                    newer[5] += entry[5]
+
+    # Deletes domains not seen within the retention period and hands the space back to the file system
+    def _compact(self, db):
+        if not self.retention:
+            return
+        try:
+            with db:
+                deleted = db.execute("DELETE FROM matches WHERE last_seen < ?", (time.time() - self.retention,)).rowcount
+            if deleted:
+                # Frees a page per step, execute() only runs the first one
+                db.executescript("PRAGMA incremental_vacuum")
+                db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                logger.info("Match history: {} domains older than the retention period removed".format(deleted))
+        except sqlite3.Error:
+            logger.exception("Failed to compact {}".format(self.path))
+            return
+
+        with self.lock:
+            self.deleted += deleted
@@ -0,0 +1,188 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Edit-distance look-alike matching, the alternative to pre-expanding keywords
+with the single-edit fuzzers (see lookalike_matching in config.py).
+
+Each domain is split into tokens on dots and hyphens and every token is looked
+up in a symmetric-delete index of the keywords: all strings made by deleting up
+to max_edits characters from each keyword point back to it, so a token's own
+deletes find every keyword within max_edits edits with a handful of dict
+lookups, however many keywords there are. Candidates are then scored with a
+weighted Damerau-Levenshtein distance where typos on neighbouring keys
+(from the fuzzer's keyboard tables) and doubled letters cost less than other
+edits.
+"""
+
+from collections import OrderedDict, namedtuple
+
+from fuzzer import KEYBOARDS
+
+
+# The fuzzers that make single edits, which edit-distance matching replaces
+EDIT_FUZZERS = ['Addition', 'Bitsquatting', 'Insertion', 'Omission', 'Repetition', 'Replacement', 'Transposition', 'Vowel-swap']
+
+# A look-alike match. 'token' is the part of the domain that resembles the keyword.
+LookalikeMatch = namedtuple('LookalikeMatch', ['keyword', 'token', 'distance'])
+
+# Cost of an edit a slipped finger would make: a neighbouring key instead of the right one, or an extra neighbouring
+# or doubled key. Every other insertion, deletion, substitution or swap of two letters costs 1.
+ADJACENT_COST = 0.5
+
+# Each key and the keys around it on any of the keyboard layouts
+ADJACENT_KEYS = {}
+for _keyboard in KEYBOARDS:
+    for _key, _neighbours in _keyboard.items():
+        ADJACENT_KEYS.setdefault(_key, set()).update(_neighbours)
+
+
+# Per keyword position, the keys that cost ADJACENT_COST to type instead of the letter there, and the keys that cost
+# ADJACENT_COST to type in front of it (the last entry is for typing past the end)
+def keyword_profile(keyword):
+    substitutions = [ADJACENT_KEYS.get(c, set()) for c in keyword]
+    insertions = []
+    for i in range(len(keyword) + 1):
+        cheap = set()
+        for neighbour in keyword[max(i - 1, 0):i + 1]:
+            cheap.add(neighbour)
+            cheap.update(ADJACENT_KEYS.get(neighbour, ()))
+        insertions.append(cheap)
+    return substitutions, insertions
+
+
+# Weighted Damerau-Levenshtein (optimal string alignment) distance from keyword to token.
+# Gives up and returns None as soon as the distance is certain to be over limit.
+def weighted_distance(keyword, token, limit, profile=None):
+    substitutions, insertions = profile or keyword_profile(keyword)
+    n = len(keyword)
+    previous2 = None
+    previous = [float(i) for i in range(n + 1)]
+
+    for j in range(1, len(token) + 1):
+        typed = token[j - 1]
+        current = [previous[0] + (ADJACENT_COST if typed in insertions[0] else 1)] + [0.0] * n
+        for i in range(1, n + 1):
+            expected = keyword[i - 1]
+            if expected == typed:
+                cost = previous[i - 1]
+            else:
+                cost = previous[i - 1] + (ADJACENT_COST if typed in substitutions[i - 1] else 1)
+            inserted = previous[i] + (ADJACENT_COST if typed in insertions[i] else 1)
+            if inserted < cost:
+                cost = inserted
+            if current[i - 1] + 1 < cost:
+                cost = current[i - 1] + 1
+            if previous2 is not None and i > 1 and expected == token[j - 2] and keyword[i - 2] == typed and previous2[i - 2] + 1 < cost:
+                cost = previous2[i - 2] + 1
+            current[i] = cost
+        if min(current) > limit:
+            return None
+        previous2, previous = previous, current
+
+    return previous[n] if previous[n] <= limit else None
+
+
+# Every string made by deleting up to max_edits characters, including the string itself
+def deletes(text, max_edits):
+    results = set([text])
+    level = results
+    for _ in range(max_edits):
+        level = set(s[:i] + s[i+1:] for s in level for i in range(len(s)))
+        results |= level
+    return results
+
+
+class LookalikeIndex():
+    # Keywords shorter than min_length are left out, a couple of edits turn them into too many real words
+    # Domains containing one of the ignore keywords never match
+    def __init__(self, keywords=(), max_edits=2, max_distance=1.0, min_length=5, ignore_keywords=(), cache_size=100000):
+        self.max_edits = max_edits
+        self.max_distance = max_distance
+        self.ignore_keywords = [keyword for keyword in ignore_keywords if keyword]
+        self.keywords = [keyword for keyword in keywords if len(keyword) >= min_length]
+        self._profiles = dict((keyword, keyword_profile(keyword)) for keyword in self.keywords)
+        self._deletes = {}
+        for keyword in self.keywords:
+            for variant in deletes(keyword, max_edits):
+                self._deletes.setdefault(variant, []).append(keyword)
+
+        lengths = [len(keyword) for keyword in self.keywords]
+        self._min_token = min(lengths) - max_edits if lengths else 0
+        self._max_token = max(lengths) + max_edits if lengths else -1
+
+        # The same labels (www, mail, cdn, customer names) keep coming back, remember the result for each
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def __len__(self):
+        return len(self._deletes)
+
+    # Returns the closest LookalikeMatch over all tokens of the domain, or None.
+    # Exact keyword hits are left to the keyword matcher and not reported.
+    def match(self, domain):
+        best = None
+        for label in domain.split('.'):
+            for token in label.split('-'):
+                if not self._min_token <= len(token) <= self._max_token:
+                    continue
+                found = self.lookup(token)
+                if found and (best is None or found.distance < best.distance):
+                    best = found
+
+        if best and any(keyword in domain for keyword in self.ignore_keywords):
+            return None
+        return best
+
+    def lookup(self, token):
+        cache = self._cache
+        if token in cache:
+            cache.move_to_end(token)
+            return cache[token]
+
+        found = self._lookup(token)
+        cache[token] = found
+        if len(cache) > self._cache_size:
+            cache.popitem(last=False)
+        return found
+
+    def _lookup(self, token):
+        candidates = set()
+        for variant in deletes(token, self.max_edits):
+            candidates.update(self._deletes.get(variant, ()))
+
+        # In keyword order, so of two equally close keywords the same one is reported in every process, whatever the
+        # hash seed
+        best = None
+        limit = self.max_distance
+        for keyword in sorted(candidates):
+            if keyword == token:
+                continue
+            distance = weighted_distance(keyword, token, limit, self._profiles[keyword])
+            if distance is not None and distance > 0 and (best is None or distance < best.distance):
+                best = LookalikeMatch(keyword, token, distance)
+                limit = distance
+        return best
+
+
+# Describes a match for logs and alerts, e.g. "Lookalike (paypa1, distance 1)"
+def describe(match):
+    return "Lookalike ({}, distance {:g})".format(match.token, match.distance)
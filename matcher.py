@@ -0,0 +1,176 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Multi-pattern keyword matching. An Aho-Corasick automaton is built once over
+the ignore, no-fuzz and fuzzed keyword lists so that every keyword hit in a
+domain is found in a single pass over the domain.
+"""
+
+from collections import deque, namedtuple
+
+
+# Keyword classes, in priority order. When several keywords hit the same domain the lowest class wins.
+IGNORE = 0
+NO_FUZZ = 1
+FUZZED = 2
+
+# A single keyword hit. 'start' is the offset of the keyword in the domain.
+Match = namedtuple('Match', ['keyword', 'keyword_class', 'fuzzer', 'start'])
+
+# Edges are stored in one flat dict keyed on (node << 21 | codepoint), 21 bits covers all of Unicode
+_CHAR_BITS = 21
+_NO_MATCH = 1 << 62
+
+
+class KeywordMatcher():
+    # fuzzed_keywords is a list of (keyword, fuzzer) pairs, in the same order check_match used to scan them
+    def __init__(self, ignore_keywords=(), no_fuzz_keywords=(), fuzzed_keywords=()):
+        self.patterns = []      # rank -> (keyword, keyword_class, fuzzer). Rank order is priority order.
+        self._ranks = {}        # keyword -> rank, the first occurrence of a keyword keeps its priority
+        self._edges = {}
+        self._fail = [0]
+        self._own = [_NO_MATCH]     # rank of the keyword ending exactly at this node
+        self._best = [_NO_MATCH]    # best rank ending at this node or anywhere along its failure chain
+        self._out = [0]             # next node along the failure chain that ends a keyword
+        self._children = [[]]
+
+        for keyword in ignore_keywords:
+            self._add(keyword, IGNORE, None)
+        self.ignore_count = len(self.patterns)
+
+        for keyword in no_fuzz_keywords:
+            self._add(keyword, NO_FUZZ, None)
+
+        for keyword, fuzzer in fuzzed_keywords:
+            self._add(keyword, FUZZED, fuzzer)
+
+        self._build()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def _add(self, keyword, keyword_class, fuzzer):
+        # An empty keyword matches every domain with the linear scan, skip it rather than match everything
+        if not keyword or keyword in self._ranks:
+            return
+
+        rank = len(self.patterns)
+        self._ranks[keyword] = rank
+        self.patterns.append((keyword, keyword_class, fuzzer))
+
+        node = 0
+        for c in keyword:
+            key = (node << _CHAR_BITS) | ord(c)
+            child = self._edges.get(key)
+            if child is None:
+                child = len(self._fail)
+                self._edges[key] = child
+                self._fail.append(0)
+                self._own.append(_NO_MATCH)
+                self._best.append(_NO_MATCH)
+                self._out.append(0)
+                self._children.append([])
+                self._children[node].append((ord(c), child))
+            node = child
+
+        self._own[node] = rank
+        self._best[node] = rank
+
+    # Breadth-first pass that sets the failure links and folds the best rank down each failure chain
+    def _build(self):
+        edges = self._edges
+        fail = self._fail
+        own = self._own
+        best = self._best
+        out = self._out
+
+        queue = deque(child for _, child in self._children[0])
+        while queue:
+            node = queue.popleft()
+            for o, child in self._children[node]:
+                state = fail[node]
+                target = edges.get((state << _CHAR_BITS) | o)
+                while target is None and state:
+                    state = fail[state]
+                    target = edges.get((state << _CHAR_BITS) | o)
+                target = target or 0
+
+                fail[child] = target
+                out[child] = target if own[target] != _NO_MATCH else out[target]
+                if best[target] < best[child]:
+                    best[child] = best[target]
+                queue.append(child)
+
+        # Only needed while building
+        self._children = None
+
+    # Returns the highest priority Match for the domain, or None if nothing matched or an ignore keyword hit
+    def match(self, domain):
+        edges = self._edges
+        fail = self._fail
+        best = self._best
+        ignore_count = self.ignore_count
+
+        node = 0
+        found = _NO_MATCH
+        end = 0
+        for i, o in enumerate(map(ord, domain)):
+            nxt = edges.get((node << _CHAR_BITS) | o)
+            while nxt is None and node:
+                node = fail[node]
+                nxt = edges.get((node << _CHAR_BITS) | o)
+            node = nxt or 0
+
+            rank = best[node]
+            if rank < found:
+                found = rank
+                end = i
+                if rank < ignore_count:
+                    return None
+
+        if found == _NO_MATCH:
+            return None
+
+        keyword, keyword_class, fuzzer = self.patterns[found]
+        # best[] can come from the failure chain, so the keyword may be shorter than the path to the node
+        return Match(keyword, keyword_class, fuzzer, end - len(keyword) + 1)
+
+    # Yields every keyword hit in the domain, of every class, in order of where the hit ends
+    def findall(self, domain):
+        edges = self._edges
+        fail = self._fail
+        own = self._own
+        out = self._out
+
+        node = 0
+        for i, o in enumerate(map(ord, domain)):
+            nxt = edges.get((node << _CHAR_BITS) | o)
+            while nxt is None and node:
+                node = fail[node]
+                nxt = edges.get((node << _CHAR_BITS) | o)
+            node = nxt or 0
+
+            hit = node if own[node] != _NO_MATCH else out[node]
+            while hit:
+                keyword, keyword_class, fuzzer = self.patterns[own[hit]]
+                yield Match(keyword, keyword_class, fuzzer, i - len(keyword) + 1)
+                hit = out[hit]
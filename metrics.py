@@ -0,0 +1,235 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Low-overhead metrics, served in the Prometheus text format.
+
+Counters and histograms keep one slot of shared memory per process. The main
+process writes slot 0 and matcher worker process N writes slot N + 1 (see
+set_process_slot), so no process ever waits on another to record a value and
+the values are summed when the metrics are scraped. Threads of one process share
+its slot and take a per-process lock for each update. Gauges are read from callbacks
+at scrape time and cost nothing in between.
+
+When metrics are disabled CertPipe never creates a registry, and every
+instrumented line is skipped with a single truth test.
+"""
+
+import bisect
+import logging
+import multiprocessing
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger("certpipe.metrics")
+
+# Slot of the current process, set in each matcher worker after it is forked
+_slot = 0
+
+# Serialises updates to the slot of this process. Replaced in forked children, where another thread may have held it.
+_lock = threading.Lock()
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+DEFAULT_LATENCY_BUCKETS = [0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                           0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+
+
+def set_process_slot(slot):
+    global _slot
+    _slot = slot
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)) + "}"
+
+
+def _number(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Counter():
+    kind = "counter"
+
+    def __init__(self, name, help_text, slots):
+        self.name = name
+        self.help = help_text
+        self._values = multiprocessing.RawArray('d', slots)
+
+    def inc(self, amount=1):
+        with _lock:
+            self._values[_slot] += amount
+
+    def value(self):
+        return sum(self._values)
+
+    def samples(self):
+        yield self.name, "", self.value()
+
+
+# Counter with labels, only for use in the main process
+class LabeledCounter():
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in sorted(values):
+            yield self.name, _labels(self.label_names, label_values), value
+
+
+# Gauge read from a callback when scraped. The callback returns a number, or None to leave the gauge out.
+# Also used with kind="counter" for counters that a component already keeps in its own stats.
+class Gauge():
+    def __init__(self, name, help_text, callback, kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            logger.exception("Failed to read gauge {}".format(self.name))
+            return
+        if value is not None:
+            yield self.name, "", value
+
+
+class Histogram():
+    kind = "histogram"
+
+    def __init__(self, name, help_text, slots, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = list(buckets)
+        # Per slot: one count per bucket, one for +Inf, then the sum of observed values
+        self._width = len(self.buckets) + 2
+        self._values = multiprocessing.RawArray('d', slots * self._width)
+
+    def observe(self, value):
+        base = _slot * self._width
+        bucket = base + bisect.bisect_left(self.buckets, value)
+        with _lock:
+            self._values[bucket] += 1
+            self._values[base + self._width - 1] += value
+
+    def samples(self):
+        width = self._width
+        values = self._values[:]
+        slots = len(values) // width
+        totals = [sum(values[s * width + i] for s in range(slots)) for i in range(width)]
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + ["+Inf"], totals[:-1]):
+            cumulative += count
+            yield self.name + "_bucket", '{le="' + str(bound) + '"}', cumulative
+        yield self.name + "_sum", "", totals[-1]
+        yield self.name + "_count", "", cumulative
+
+
+class Registry():
+    def __init__(self, slots=1):
+        self.slots = slots
+        self.metrics = []
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text, self.slots))
+
+    def labeled_counter(self, name, help_text, label_names):
+        return self._add(LabeledCounter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, callback):
+        return self._add(Gauge(name, help_text, callback))
+
+    def counter_callback(self, name, help_text, callback):
+        return self._add(Gauge(name, help_text, callback, kind="counter"))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, self.slots, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append("{}{} {}".format(name, labels, _number(value)))
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: " + format % args)
+
+
+# Serves registry.render() at /metrics on a daemon thread. Returns the server so it can be shut down.
+def serve_metrics(registry, host="127.0.0.1", port=9108):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http")
+    thread.daemon = True
+    thread.start()
+    return server
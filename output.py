@@ -0,0 +1,241 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Long-lived, buffered output files. Records are kept in memory and written out
+when the buffer fills up or the flush interval passes, and the file is rotated
+by size and/or date, optionally compressing the rotated files with gzip or zstd
+(zstd needs the zstandard package).
+"""
+
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+
+logger = logging.getLogger("certpipe.output")
+
+
+# File extension added to rotated files by each compression method
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+# write() only adds to the buffer, a full buffer wakes the flusher thread, so the thread calling write() never waits on
+# the disk and every batch is written by the flusher in the order it was buffered
+class BufferedWriter():
+    # Subclasses with expensive formatting set this so that write() only queues the record, and the flusher thread
+    # formats and writes it
+    format_in_background = False
+
+    # compress is 'gzip', 'zstd' or empty for none. True and False, from older configs, mean 'gzip' and none.
+    # on_flush(seconds) is called after each batch is written, for recording flush times.
+    def __init__(self, path, header=None, flush_rows=100, flush_interval=5, rotate_bytes=0, rotate_daily=False, compress=False,
+                 on_flush=None):
+        if compress is True:
+            compress = 'gzip'
+        if compress and compress not in COMPRESSION_EXTENSIONS:
+            raise ValueError("Unknown compression: {}".format(compress))
+        if compress == 'zstd':
+            # Fail at startup rather than at the first rotation
+            import zstandard
+
+        self.path = path
+        self.header = header
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress or None
+        self.on_flush = on_flush
+        self.rows_written = 0
+        self.flushes = 0
+        self.rotations = 0
+        self._buffer = []
+        # Two locks so that write() never waits on disk I/O, _io_lock is held from taking a batch to writing it
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._file = None
+        self._file_date = None
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        self._compressors = []
+        self._flusher = threading.Thread(target=self._run_flusher, name="flush-" + os.path.basename(path))
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    # Serialise a record to text, one or more complete lines. Overridden by each output format.
+    def format(self, record):
+        return str(record) + "\n"
+
+    def write(self, record):
+        if not self.format_in_background:
+            record = self.format(record)
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.flush_rows:
+                self._wake.set()
+
+    # Write out everything buffered. Normally called by the flusher thread, the I/O lock keeps batches in order if not.
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                lines = self._take_buffer()
+            if self.format_in_background:
+                lines = [self.format(record) for record in lines]
+            self._write_lines(lines)
+
+    # Flush anything buffered and close the file. Waits for rotated files to finish compressing.
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        with self._io_lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+        for compressor in self._compressors:
+            compressor.join()
+
+    def _take_buffer(self):
+        lines = self._buffer
+        self._buffer = []
+        return lines
+
+    # Called with _io_lock held
+    def _write_lines(self, lines):
+        if not lines:
+            return
+
+        start = time.time()
+        try:
+            self._maybe_rotate()
+            if self._file is None:
+                self._open()
+            self._file.write("".join(lines))
+            self._file.flush()
+        except IOError as e:
+            logger.error("Output file I/O error({0}): {1}".format(e.errno, e.strerror))
+            return
+        self.rows_written += len(lines)
+        self.flushes += 1
+
+        elapsed = time.time() - start
+        if self.on_flush:
+            self.on_flush(elapsed)
+        logger.debug("Flushed {} rows to {} in {:.3f}s".format(len(lines), self.path, elapsed))
+
+    def _open(self):
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = io.open(self.path, "a", encoding="utf-8", newline="")
+        self._file_date = datetime.now().date()
+        if is_new and self.header:
+            self._file.write(self.header)
+
+    def _maybe_rotate(self):
+        if not os.path.exists(self.path):
+            return
+
+        # A file left over from a previous run belongs to the day it was last written
+        if self._file_date is None:
+            self._file_date = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+
+        too_big = self.rotate_bytes > 0 and os.path.getsize(self.path) >= self.rotate_bytes
+        new_day = self.rotate_daily and self._file_date != datetime.now().date()
+        if too_big or new_day:
+            self._rotate()
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+        rotated = "{}.{}".format(self.path, datetime.now().strftime("%Y%m%d-%H%M%S"))
+        suffix = 1
+        while os.path.exists(rotated) or any(os.path.exists(rotated + ext) for ext in COMPRESSION_EXTENSIONS.values()):
+            rotated = "{}.{}-{}".format(self.path, datetime.now().strftime("%Y%m%d-%H%M%S"), suffix)
+            suffix += 1
+
+        os.rename(self.path, rotated)
+        self.rotations += 1
+        logger.info("Rotated {} to {}".format(self.path, rotated))
+
+        if self.compress:
+            compressor = threading.Thread(target=_compress_file, args=(rotated, self.compress),
+                                          name=self.compress + "-" + os.path.basename(rotated))
+            compressor.start()
+            self._compressors = [c for c in self._compressors if c.is_alive()] + [compressor]
+
+    def _run_flusher(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._closed.is_set():
+                self.flush()
+
+
+class CSVWriter(BufferedWriter):
+    def __init__(self, path, columns, **kwargs):
+        self.columns = columns
+        BufferedWriter.__init__(self, path, header=self._row_text(columns), **kwargs)
+
+    # The csv module quotes fields containing commas, quotes or newlines so a row can never spill into extra columns
+    @staticmethod
+    def _row_text(values):
+        text = io.StringIO()
+        csv.writer(text).writerow(values)
+        return text.getvalue()
+
+    def format(self, record):
+        return self._row_text(record)
+
+
+# One JSON object per line (NDJSON). Records are serialised on the flusher thread, not by the caller of write().
+class JSONWriter(BufferedWriter):
+    format_in_background = True
+
+    def format(self, record):
+        return json.dumps(record, separators=(',', ':'), ensure_ascii=False, default=str) + "\n"
+
+
+def _compress_file(path, method):
+    target_path = path + COMPRESSION_EXTENSIONS[method]
+    try:
+        with open(path, "rb") as source:
+            if method == 'zstd':
+                import zstandard
+                with open(target_path, "wb") as target:
+                    zstandard.ZstdCompressor().copy_stream(source, target)
+            else:
+                with gzip.open(target_path, "wb") as target:
+                    shutil.copyfileobj(source, target)
+        os.remove(path)
+    except (IOError, OSError) as e:
+        logger.error("Failed to compress {}: {}".format(path, e))
@@ -0,0 +1,237 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Staged, multi-process message pipeline.
+
+    reader thread --(input queue per worker)--> N matcher processes --(output queue)--> output thread
+
+The reader only enqueues raw messages, each to the worker picked by a shard key
+such as the certificate, so the copies of a certificate from different CT logs
+reach the worker that has already seen it. Matcher processes are forked after the
+keyword index is built, so they share it copy-on-write instead of each building
+or unpickling their own, and run match_fn(message) -> [match, ...]. A single
+output thread in the main process calls handle_fn(*match) for every match, so
+dedup, CSV and alerting state is never touched by more than one stage.
+
+The queues are bounded. When a worker's input queue is full the reader either
+waits ('block') or discards the message and counts it ('drop').
+
+restart_workers() replaces the matcher processes with freshly forked ones, so a
+rebuilt keyword index reaches them. Each new worker takes over the input queue of
+the one it replaces right away; the old ones finish the message they are on and exit.
+"""
+
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+
+
+logger = logging.getLogger("certpipe.pipeline")
+
+OVERLOAD_POLICIES = ('block', 'drop')
+
+
+def _run_matcher(index, worker_init, match_fn, input_queue, output_queue, processed, matched, errors, generation, current):
+    # Ctrl+C is handled by the main process, which then stops the workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if worker_init:
+        worker_init(index)
+
+    while current.value == generation:
+        # Wake up now and then to notice being replaced by restart_workers()
+        try:
+            message = input_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        if message is None:
+            break
+        # Replaced while waiting, leave the message to a worker with the new index
+        if current.value != generation:
+            input_queue.put(message)
+            break
+
+        try:
+            if isinstance(message, (str, bytes)):
+                message = json.loads(message)
+            matches = match_fn(message)
+        except Exception:
+            logger.exception("Matcher worker failed to process a message")
+            with errors.get_lock():
+                errors.value += 1
+            continue
+
+        with processed.get_lock():
+            processed.value += 1
+
+        if matches:
+            with matched.get_lock():
+                matched.value += len(matches)
+            output_queue.put(matches)
+
+    output_queue.put(None)
+
+
+class ShardedPipeline():
+    # worker_init(index) is called in each worker process before it starts matching. index is below 2 * workers, workers
+    # started by consecutive restarts get different halves of that range so they never share one while both are running.
+    # Messages with the same shard_key(message) always go to the same worker, those without one (None, or no shard_key)
+    # are spread over the workers in turn. queue_size is shared out between the workers' input queues.
+    def __init__(self, match_fn, handle_fn, workers=2, queue_size=10000, overload_policy='block', worker_init=None,
+                 shard_key=None):
+        if overload_policy not in OVERLOAD_POLICIES:
+            raise ValueError("Unknown overload policy: {}".format(overload_policy))
+
+        # Workers inherit the keyword index by forking, see the module docstring
+        self.context = multiprocessing.get_context('fork')
+        self.match_fn = match_fn
+        self.handle_fn = handle_fn
+        self.worker_init = worker_init
+        self.shard_key = shard_key
+        self.num_workers = workers
+        self.overload_policy = overload_policy
+        self.input_queues = [self.context.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self.next_queue = 0
+        self.output_queue = self.context.Queue(maxsize=queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.processed = self.context.Value('L', 0)
+        self.matched = self.context.Value('L', 0)
+        self.errors = self.context.Value('L', 0)
+        self.workers = []
+        self.retired = []
+        self.generation = self.context.Value('L', 0)
+        self.started = 0
+        self.restarts = 0
+        self.stopping = False
+        self.output_thread = None
+
+    def start(self):
+        self._start_workers()
+
+        self.output_thread = threading.Thread(target=self._run_output, name="pipeline-output")
+        self.output_thread.daemon = True
+        self.output_thread.start()
+
+    def _start_workers(self):
+        generation = self.generation.value
+        offset = (generation % 2) * self.num_workers
+        for i in range(self.num_workers):
+            worker = self.context.Process(target=_run_matcher, name="matcher-{}-{}".format(generation, i),
+                args=(offset + i, self.worker_init, self.match_fn, self.input_queues[i], self.output_queue,
+                      self.processed, self.matched, self.errors, generation, self.generation))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.started += self.num_workers
+
+    # Replaces the workers with new ones forked from the current state of this process, without pausing matching.
+    # Not thread safe, call from one thread at a time.
+    def restart_workers(self):
+        # Workers from the restart before last used the same indexes, they have had plenty of time to exit
+        for worker in self.retired:
+            worker.join()
+        self.retired = self.workers
+        self.workers = []
+
+        with self.generation.get_lock():
+            self.generation.value += 1
+        self._start_workers()
+        self.restarts += 1
+        logger.info("Matcher workers restarted ({} restarts)".format(self.restarts))
+
+    # Called from the reader thread. Returns False if the message was dropped.
+    def put(self, message):
+        self.received += 1
+
+        key = self.shard_key(message) if self.shard_key else None
+        if key is None:
+            shard = self.next_queue
+            self.next_queue = (shard + 1) % self.num_workers
+        else:
+            shard = hash(key) % self.num_workers
+        input_queue = self.input_queues[shard]
+
+        if self.overload_policy == 'block':
+            input_queue.put(message)
+            return True
+
+        try:
+            input_queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning("Matcher queue full, {} messages dropped so far".format(self.dropped))
+            return False
+
+    # Let the workers finish what is queued, then wait for the output stage to handle the last matches
+    def stop(self, timeout=None):
+        self.stopping = True
+        # Retired workers exit on their own within a second. Waiting for them first means a message one of them puts back
+        # on its queue is ahead of the None that stops its replacement.
+        for worker in self.retired:
+            worker.join(timeout)
+        for i, worker in enumerate(self.workers):
+            if worker.is_alive():
+                self.input_queues[i].put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+        if self.output_thread:
+            self.output_thread.join(timeout)
+
+    def _run_output(self):
+        # Every worker ever started sends None when it exits, including those retired by restart_workers()
+        finished = 0
+        while not (self.stopping and finished == self.started):
+            matches = self.output_queue.get()
+            if matches is None:
+                finished += 1
+                continue
+            for match in matches:
+                try:
+                    self.handle_fn(*match)
+                except Exception:
+                    logger.exception("Failed to handle match {}".format(match))
+
+    def stats(self):
+        try:
+            input_depth = sum(input_queue.qsize() for input_queue in self.input_queues)
+            output_depth = self.output_queue.qsize()
+        except NotImplementedError:
+            # qsize() is not available on macOS
+            input_depth = output_depth = None
+
+        return {
+            'workers': self.num_workers,
+            'restarts': self.restarts,
+            'received': self.received,
+            'dropped': self.dropped,
+            'processed': self.processed.value,
+            'matched': self.matched.value,
+            'errors': self.errors.value,
+            'input_queue_depth': input_depth,
+            'output_queue_depth': output_depth
+        }
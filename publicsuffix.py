@@ -0,0 +1,156 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Splits domains into subdomain, registered name and public suffix with the
+Public Suffix List (https://publicsuffix.org), bundled as public_suffix_list.dat.
+
+The rules are loaded into a trie keyed on labels from the right, with rules
+for internationalised suffixes converted to their xn-- form as they appear in
+certificates. Where the walk stands after the last two labels of a domain is
+cached on those labels, so most lookups cost a dict lookup and at most a step
+or two further down the trie.
+
+The private section of the list (cloudfront.net, azurewebsites.net,
+herokuapp.com, ...) is included by default, so a customer's name on a hosting
+provider is treated as a registered name of its own.
+"""
+
+import os
+from collections import OrderedDict, namedtuple
+
+
+DEFAULT_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+
+# registered_domain is name.suffix, empty when the domain is itself a public suffix
+DomainParts = namedtuple('DomainParts', ['domain', 'subdomain', 'name', 'suffix', 'registered_domain'])
+
+# Marks a trie node that ends a rule, an object so that no label can be mistaken for it
+_RULE = object()
+
+
+def _ascii_label(label):
+    try:
+        return label.encode('idna').decode('ascii')
+    except UnicodeError:
+        return label
+
+
+# Lookups share one cache without a lock, use an instance from one thread only
+class PublicSuffixList():
+    def __init__(self, path=DEFAULT_LIST, private=True, cache_size=100000):
+        self.rules = 0
+        self._trie = {}
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self.lookups = 0
+        self.hits = 0
+
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('// ===BEGIN PRIVATE DOMAINS===') and not private:
+                    break
+                if not line or line.startswith('//'):
+                    continue
+                self._add(line.split()[0])
+
+    def _add(self, rule):
+        exception = rule.startswith('!')
+        labels = [_ascii_label(label) for label in rule.lstrip('!').lower().split('.')]
+        node = self._trie
+        for label in reversed(labels[1:] if exception else labels):
+            node = node.setdefault(label, {})
+        if exception:
+            # Kept on the parent of the excepted label, '!' never appears in a label
+            node['!' + labels[0]] = True
+        else:
+            node[_RULE] = True
+        self.rules += 1
+
+    # Length in characters of the public suffix at the end of the domain, at least its last label (the implicit '*' rule).
+    # Raises ValueError for a domain with an empty label, such as x..co.uk, which no rule can apply to.
+    def suffix_length(self, domain):
+        if '..' in domain or domain[:1] == '.' or domain[-1:] == '.':
+            raise ValueError("Empty label in domain: {!r}".format(domain))
+        dot = domain.rfind('.')
+        second = domain.rfind('.', 0, dot) if dot > 0 else -1
+        key = domain[second + 1:]
+
+        cache = self._cache
+        self.lookups += 1
+        state = cache.get(key)
+        if state is None:
+            state = self._walk(key, self._trie, len(key), len(key) - key.rfind('.') - 1)
+            cache[key] = state
+            if len(cache) > self._cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+            self.hits += 1
+
+        length, node = state
+        if node is None or second < 0:
+            return length
+        return self._walk(domain, node, second, length)[0]
+
+    # Walks the trie through the labels of the domain right to left, starting from node with the label that ends at
+    # end. Returns the suffix length so far and the node reached, or None for the node once more labels cannot change
+    # the answer.
+    def _walk(self, domain, node, end, length):
+        while end > 0:
+            dot = domain.rfind('.', 0, end)
+            label = domain[dot + 1:end]
+            if '!' + label in node:
+                return len(domain) - end - 1, None
+            child = node.get(label)
+            if child is None:
+                child = node.get('*')
+                if child is None:
+                    return length, None
+            node = child
+            if _RULE in node:
+                length = len(domain) - dot - 1
+            # Nothing below this rule
+            if len(node) == 1 and _RULE in node:
+                return length, None
+            end = dot
+        return length, node
+
+    def suffix(self, domain):
+        return domain[len(domain) - self.suffix_length(domain):]
+
+    def split(self, domain):
+        length = self.suffix_length(domain)
+        suffix = domain[len(domain) - length:]
+        if length >= len(domain):
+            return DomainParts(domain, '', '', suffix, '')
+        subdomain, _, name = domain[:len(domain) - length - 1].rpartition('.')
+        return DomainParts(domain, subdomain, name, suffix, name + '.' + suffix)
+
+    def stats(self):
+        return {
+            'rules': self.rules,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': float(self.hits) / self.lookups if self.lookups else 0.0,
+            'entries': len(self._cache)
+        }
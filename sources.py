@@ -0,0 +1,380 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Message sources for CertPipe. Every source calls message_callback(message, context)
+with decoded CertStream messages, the same way certstream.listen_for_events does,
+or with the raw JSON text when run with raw=True and the source supports it.
+
+- CertStreamSource: the live CertStream websocket.
+- ReplaySource: recorded messages from an NDJSON file (optionally gzipped),
+  replayed at the recorded speed, scaled, or as fast as possible.
+- MessageRecorder: writes messages to NDJSON for later replay.
+- ReplayServer: a local websocket server that serves a recording in the
+  CertStream wire format, so the real client can be pointed at it.
+
+USAGE (local CertStream stand-in):
+
+    python sources.py recording.ndjson.gz --port 8765 --speed 0
+
+Then set certstream_url = "ws://127.0.0.1:8765/" in config.py.
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+
+logger = logging.getLogger("certpipe.sources")
+
+CERTSTREAM_URL = "wss://certstream.calidog.io/"
+
+# Fixed GUID from RFC 6455 used to compute Sec-WebSocket-Accept
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def open_ndjson(path, mode="r"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return io.open(path, mode, encoding="utf-8")
+
+
+# The time a message was produced: 'seen' for certificate updates, 'timestamp' for heartbeats
+def message_time(message):
+    data = message.get('data') or {}
+    return data.get('seen') or message.get('timestamp')
+
+
+# The certificate fields of a certificate_update message worth keeping with a match. The DER encoding is left out.
+def certificate_details(message):
+    data = message.get('data') or {}
+    leaf_cert = dict((key, value) for key, value in (data.get('leaf_cert') or {}).items() if key != 'as_der')
+    chain = data.get('chain') or []
+    return {
+        'update_type': data.get('update_type'),
+        'cert_index': data.get('cert_index'),
+        'cert_link': data.get('cert_link'),
+        'seen': data.get('seen'),
+        'source': data.get('source'),
+        'leaf_cert': leaf_cert,
+        'issuer': chain[0].get('subject') if chain else None,
+        'chain': [cert.get('subject') for cert in chain]
+    }
+
+
+# Identifies a certificate across CT logs. The serial number and issuer are the same for a precertificate and the
+# certificate issued from it, the fingerprint is used when they are missing. None if the message has neither.
+def certificate_key(message):
+    leaf_cert = (message.get('data') or {}).get('leaf_cert') or {}
+    serial_number = leaf_cert.get('serial_number')
+    if serial_number:
+        issuer = leaf_cert.get('issuer') or {}
+        return serial_number + "/" + (issuer.get('aggregated') or "")
+    return leaf_cert.get('fingerprint')
+
+
+# The leaf certificate's serial number, read from the JSON text without decoding it
+_SERIAL_NUMBER = re.compile(r'"serial_number"\s*:\s*"([^"]*)"')
+
+
+# certificate_key for a message that may still be its raw JSON text, as the matcher pipeline gets them. Only the serial
+# number is read from the text, which is enough to send the copies of a certificate from each CT log to the same place.
+def raw_certificate_key(message):
+    if isinstance(message, dict):
+        return certificate_key(message)
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    start = message.find('"leaf_cert"')
+    if start < 0:
+        return None
+    found = _SERIAL_NUMBER.search(message, start)
+    return found.group(1) if found else None
+
+
+# Reads recorded messages, sleeping between them so they come out at the recorded pace divided by speed.
+# A speed of 0 yields every message immediately. Lines that are not valid JSON are skipped.
+def read_recording(path, speed=0, stop_event=None):
+    first_time = None
+    start = time.time()
+
+    with open_ndjson(path) as recording:
+        for line in recording:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping invalid line in {}".format(path))
+                continue
+
+            if speed > 0:
+                recorded = message_time(message)
+                if recorded is not None:
+                    if first_time is None:
+                        first_time = recorded
+                    delay = start + (recorded - first_time) / float(speed) - time.time()
+                    if delay > 0:
+                        if stop_event is not None:
+                            if stop_event.wait(delay):
+                                return
+                        else:
+                            time.sleep(delay)
+
+            if stop_event is not None and stop_event.is_set():
+                return
+
+            yield message
+
+
+# With raw=True the message callback gets the undecoded JSON text, for handing off to another process to decode
+class CertStreamSource():
+    def __init__(self, url=CERTSTREAM_URL):
+        self.url = url
+
+    def run(self, message_callback, on_open=None, on_error=None, raw=False):
+        import certstream
+
+        if not raw:
+            certstream.listen_for_events(message_callback=message_callback, on_open=on_open, on_error=on_error, url=self.url)
+            return
+
+        class RawCertStreamClient(certstream.core.CertStreamClient):
+            def _on_message(self, _, message):
+                if self.skip_heartbeats and '"heartbeat"' in message[:64]:
+                    return
+                self.message_callback(message, self._context)
+
+        try:
+            while True:
+                client = RawCertStreamClient(message_callback, self.url, on_open=on_open, on_error=on_error)
+                client.run_forever()
+                time.sleep(5)
+        except KeyboardInterrupt:
+            logger.info("Kill command received, exiting!!")
+
+
+class ReplaySource():
+    def __init__(self, path, speed=0, loop=False, skip_heartbeats=True):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.skip_heartbeats = skip_heartbeats
+        self.messages = 0
+        self.stop_event = threading.Event()
+
+    # Recorded messages are always decoded to read their timestamps, so raw is accepted but has no effect
+    def run(self, message_callback, on_open=None, on_error=None, raw=False):
+        if on_open:
+            on_open(self)
+
+        context = {}
+        while not self.stop_event.is_set():
+            for message in read_recording(self.path, self.speed, self.stop_event):
+                if self.skip_heartbeats and message.get('message_type') == "heartbeat":
+                    continue
+                self.messages += 1
+                message_callback(message, context)
+            if not self.loop:
+                break
+
+        logger.info("Replay of {} finished, {} messages".format(self.path, self.messages))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# Appends every message to an NDJSON file (gzipped if the name ends in .gz), for replay with ReplaySource
+class MessageRecorder():
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open_ndjson(path, "a")
+
+    # Accepts decoded messages or raw JSON text
+    def record(self, message):
+        if not isinstance(message, str):
+            message = json.dumps(message, separators=(',', ':'))
+        line = message.strip() + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def _websocket_frame(payload, opcode=0x1):
+    header = bytearray([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header.append(length)
+    elif length < (1 << 16):
+        header.append(126)
+        header.extend(struct.pack("!H", length))
+    else:
+        header.append(127)
+        header.extend(struct.pack("!Q", length))
+    return bytes(header) + payload
+
+
+def _read_exact(sock_file, count):
+    data = sock_file.read(count)
+    if data is None or len(data) < count:
+        raise EOFError()
+    return data
+
+
+class _ReplayHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if not self._handshake():
+            return
+
+        closed = threading.Event()
+        send_lock = threading.Lock()
+        reader = threading.Thread(target=self._read_frames, args=(closed, send_lock))
+        reader.daemon = True
+        reader.start()
+
+        sent = 0
+        try:
+            while not closed.is_set():
+                for message in read_recording(self.server.path, self.server.speed, closed):
+                    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+                    with send_lock:
+                        self.wfile.write(_websocket_frame(payload))
+                    sent += 1
+                if not self.server.loop:
+                    break
+            with send_lock:
+                self.wfile.write(_websocket_frame(b"", opcode=0x8))
+        except (socket.error, EOFError):
+            pass
+
+        logger.info("Replay client {} disconnected after {} messages".format(self.client_address, sent))
+
+    def _handshake(self):
+        headers = {}
+        request_line = self.rfile.readline()
+        if not request_line:
+            return False
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get('sec-websocket-key')
+        if not key:
+            self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                          "Upgrade: websocket\r\n"
+                          "Connection: Upgrade\r\n"
+                          "Sec-WebSocket-Accept: " + accept + "\r\n\r\n").encode('ascii'))
+        return True
+
+    # Client frames are only read to answer pings and notice the client going away
+    def _read_frames(self, closed, send_lock):
+        try:
+            while not closed.is_set():
+                first, second = bytearray(_read_exact(self.rfile, 2))
+                opcode = first & 0x0F
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", _read_exact(self.rfile, 2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", _read_exact(self.rfile, 8))[0]
+                mask = bytearray(_read_exact(self.rfile, 4)) if second & 0x80 else None
+                payload = bytearray(_read_exact(self.rfile, length))
+                if mask:
+                    for i in range(length):
+                        payload[i] ^= mask[i % 4]
+
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    with send_lock:
+                        self.wfile.write(_websocket_frame(bytes(payload), opcode=0xA))
+        except (socket.error, EOFError, ValueError):
+            pass
+        closed.set()
+
+
+# Serves a recording to every client that connects, each client gets its own replay from the start
+class ReplayServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, path, host="127.0.0.1", port=8765, speed=0, loop=False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        socketserver.TCPServer.__init__(self, (host, port), _ReplayHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "ws://{}:{}/".format(host, port)
+
+
+# Build the message source selected in the config
+def create_source(cfg):
+    if cfg.input_source == "certstream":
+        return CertStreamSource(cfg.certstream_url)
+    if cfg.input_source == "replay":
+        return ReplaySource(cfg.replay_file, cfg.replay_speed, cfg.replay_loop)
+    raise ValueError("Unknown input_source: {}".format(cfg.input_source))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a recorded CertStream feed over a local websocket.")
+    parser.add_argument('recording', help="NDJSON file of CertStream messages, optionally gzipped")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument('--loop', action='store_true', help="Start the recording again when it ends")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(levelname)s:%(name)s] %(asctime)s - %(message)s', level=logging.INFO)
+    server = ReplayServer(args.recording, args.host, args.port, args.speed, args.loop)
+    logger.info("Serving {} on {}".format(args.recording, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Syslog output. Matches are formatted as RFC 5424 messages with the match in
+structured data and sent over UDP, TCP or TLS (RFC 6587 / RFC 5425 octet
+counting) by a single sender thread that keeps one connection open, sends in
+batches and reconnects with exponential backoff. put() never blocks: when the
+collector falls behind the queue drops its oldest messages and counts them.
+
+USAGE (local listener that prints what it receives, for testing):
+
+    python syslogsink.py --protocol tcp --port 5514
+
+Then set syslog_server = "127.0.0.1", syslog_port = 5514 and syslog_protocol = "tcp" in config.py.
+"""
+
+import argparse
+import collections
+import logging
+import os
+import socket
+import socketserver
+import ssl
+import threading
+from datetime import datetime, timezone
+
+
+logger = logging.getLogger("certpipe.syslogsink")
+
+PROTOCOLS = ('udp', 'tcp', 'tls')
+
+FACILITIES = {
+    'kern': 0, 'user': 1, 'mail': 2, 'daemon': 3, 'auth': 4, 'syslog': 5, 'lpr': 6, 'news': 7,
+    'uucp': 8, 'cron': 9, 'authpriv': 10, 'ftp': 11,
+    'local0': 16, 'local1': 17, 'local2': 18, 'local3': 19, 'local4': 20, 'local5': 21, 'local6': 22, 'local7': 23
+}
+
+SEVERITIES = {
+    'emerg': 0, 'alert': 1, 'crit': 2, 'err': 3, 'warning': 4, 'notice': 5, 'info': 6, 'debug': 7
+}
+
+# Structured data ID. 32473 is the enterprise number RFC 5612 sets aside for examples and private use.
+SD_ID = "certpipe@32473"
+
+# Largest message sent over UDP, longer ones are truncated so they are not fragmented or dropped along the way
+UDP_MAX_BYTES = 2048
+
+MAX_BACKOFF = 60
+
+
+def _sd_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(']', '\\]')
+
+
+def _header_field(value, max_length):
+    # Header fields are printable US-ASCII without spaces, '-' stands for an empty field
+    value = ''.join(c for c in str(value) if 33 <= ord(c) <= 126)[:max_length]
+    return value or '-'
+
+
+# Formats an RFC 5424 message. params go into the structured data element, msg is the free-form text.
+def format_message(params, msg, facility=16, severity=4, app_name="certpipe", hostname=None, msgid="match", timestamp=None):
+    timestamp = timestamp or datetime.now(timezone.utc)
+    header = "<{}>1 {} {} {} {} {}".format(
+        facility * 8 + severity,
+        timestamp.isoformat(timespec='microseconds').replace('+00:00', 'Z'),
+        _header_field(hostname or socket.gethostname(), 255),
+        _header_field(app_name, 48),
+        _header_field(os.getpid(), 128),
+        _header_field(msgid, 32))
+
+    structured_data = "[" + SD_ID + "".join(
+        ' {}="{}"'.format(name, _sd_escape(value)) for name, value in params if value is not None) + "]"
+
+    # The BOM marks the message text as UTF-8
+    return (header + " " + structured_data + " ").encode('utf-8') + b'\xef\xbb\xbf' + msg.encode('utf-8')
+
+
+class SyslogSender():
+    def __init__(self, host, port=514, protocol='udp', facility='local0', severity='warning', app_name="certpipe",
+                 queue_size=10000, batch_size=100, ca_file=None, verify=True, timeout=10):
+        if protocol not in PROTOCOLS:
+            raise ValueError("Unknown syslog protocol: {}".format(protocol))
+
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.facility = FACILITIES[facility] if facility in FACILITIES else int(facility)
+        self.severity = SEVERITIES[severity] if severity in SEVERITIES else int(severity)
+        self.app_name = app_name
+        self.hostname = socket.gethostname()
+        self.batch_size = batch_size
+        self.ca_file = ca_file
+        self.verify = verify
+        self.timeout = timeout
+
+        self.queue = collections.deque(maxlen=queue_size)
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.sock = None
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.connects = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="syslog-sender")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Queues a message, params are (name, value) pairs for the structured data. Safe to call from any thread and never
+    # blocks, the oldest message is dropped if the queue is full. Messages are formatted on the sender thread.
+    def put(self, params, msg):
+        message = (params, msg, datetime.now(timezone.utc))
+        with self.lock:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning("Syslog queue full, {} messages dropped so far".format(self.dropped))
+            self.queue.append(message)
+            self.ready.notify()
+
+    # Sends what is still queued (without retrying), then stops the sender thread
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        with self.lock:
+            self.ready.notify()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queued': len(self.queue),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'connects': self.connects
+            }
+
+    def _run(self):
+        backoff = 1
+        while True:
+            with self.lock:
+                while not self.queue and not self.stop_event.is_set():
+                    self.ready.wait()
+                if not self.queue:
+                    break
+                batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+
+            try:
+                if self.sock is None:
+                    self._connect()
+                self._send([format_message(params, msg, self.facility, self.severity, self.app_name, self.hostname,
+                                           timestamp=timestamp) for params, msg, timestamp in batch])
+                backoff = 1
+                with self.lock:
+                    self.sent += len(batch)
+            except (socket.error, ssl.SSLError) as e:
+                self._close()
+                with self.lock:
+                    self.errors += 1
+                    if self.stop_event.is_set():
+                        break
+                    # Put the batch back in front, anything that no longer fits is dropped as the oldest
+                    for message in reversed(batch):
+                        if len(self.queue) == self.queue.maxlen:
+                            self.dropped += 1
+                            continue
+                        self.queue.appendleft(message)
+                logger.warning("Syslog send to {}:{} failed ({}), retrying in {}s".format(self.host, self.port, e, backoff))
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+        self._close()
+
+    def _connect(self):
+        if self.protocol == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((self.host, self.port))
+        else:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            if self.protocol == 'tls':
+                context = ssl.create_default_context(cafile=self.ca_file)
+                if not self.verify:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                sock = context.wrap_socket(sock, server_hostname=self.host)
+            self.sock = sock
+        self.connects += 1
+        logger.info("Connected to syslog collector {}:{} over {}".format(self.host, self.port, self.protocol.upper()))
+
+    def _send(self, batch):
+        if self.protocol == 'udp':
+            for message in batch:
+                self.sock.send(message[:UDP_MAX_BYTES])
+        else:
+            # Octet counting framing, the whole batch goes out in one write
+            self.sock.sendall(b"".join(str(len(message)).encode('ascii') + b" " + message for message in batch))
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+
+class _UDPListenerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.on_message(self.request[0])
+
+
+# Reads octet-counted frames, falling back to newline-delimited ones for senders that do not count
+class _TCPListenerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            first = self.rfile.read(1)
+            if not first:
+                return
+            if first.isdigit():
+                length = first
+                while True:
+                    c = self.rfile.read(1)
+                    if not c or c == b" ":
+                        break
+                    length += c
+                self.server.on_message(self.rfile.read(int(length)))
+            else:
+                self.server.on_message(first + self.rfile.readline().rstrip(b"\n"))
+
+
+class SyslogListener():
+    # A minimal collector for trying out the syslog output. on_message(bytes) is called for every message received.
+    def __init__(self, host="127.0.0.1", port=5514, protocol='udp', on_message=None, certfile=None, keyfile=None):
+        if protocol == 'udp':
+            self.server = socketserver.ThreadingUDPServer((host, port), _UDPListenerHandler)
+        else:
+            self.server = socketserver.ThreadingTCPServer((host, port), _TCPListenerHandler)
+            if protocol == 'tls':
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                context.load_cert_chain(certfile, keyfile)
+                self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.server.daemon_threads = True
+        self.server.on_message = on_message or (lambda message: print(message.decode('utf-8', 'replace')))
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever, name="syslog-listener")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print syslog messages received on a local port.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=5514)
+    parser.add_argument('--protocol', choices=PROTOCOLS, default='udp')
+    parser.add_argument('--certfile', help="Server certificate, for --protocol tls")
+    parser.add_argument('--keyfile', help="Server private key, for --protocol tls")
+    args = parser.parse_args()
+
+    listener = SyslogListener(args.host, args.port, args.protocol, certfile=args.certfile, keyfile=args.keyfile)
+    print("Listening for syslog over {} on {}:{}".format(args.protocol.upper(), args.host, listener.port))
+    try:
+        listener.serve_forever()
+    except KeyboardInterrupt:
+        listener.stop()
+
+
+if __name__ == '__main__':
+    main()
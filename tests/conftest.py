@@ -0,0 +1,5 @@
+# The modules sit in the repository root, next to certpipe.py
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
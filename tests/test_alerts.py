@@ -0,0 +1,131 @@
+# AlertDispatcher batching, retries and error handling, with fake senders and a local HTTP stand-in for Slack
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from alerts import Alert, AlertDispatcher, RetryableError, SlackSender, split_messages
+
+
+# Records every message, failing the first len(errors) sends with the given exceptions
+class FakeSender():
+    name = "Fake"
+    limit = 1000
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.messages = []
+
+    def send(self, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.messages.append(text)
+        return True
+
+
+def alert(domain):
+    return Alert('paypal', 'Original*', domain, '')
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_split_messages():
+    assert split_messages(['aaa', 'bb', 'cccc'], 5) == ['aaabb', 'cccc']
+    assert split_messages(['aaaaaaa'], 3) == ['aaa', 'aaa', 'a']
+    assert split_messages([], 5) == []
+
+
+def test_batches_by_size():
+    sender = FakeSender()
+    dispatcher = AlertDispatcher([sender], batch_size=3, batch_interval=60)
+    dispatcher.start()
+    for i in range(3):
+        dispatcher.put(alert('d{}.com'.format(i)))
+    assert wait_for(lambda: sender.messages)
+    dispatcher.stop(5)
+    assert len(sender.messages) == 1
+    assert all('d{}.com'.format(i) in sender.messages[0] for i in range(3))
+    assert dispatcher.stats()['sent'] == 1
+
+
+def test_stop_sends_what_is_queued():
+    sender = FakeSender()
+    dispatcher = AlertDispatcher([sender], batch_size=100, batch_interval=60)
+    dispatcher.start()
+    dispatcher.put(alert('a.com'))
+    dispatcher.put(alert('b.com'))
+    dispatcher.stop(5)
+    assert 'a.com' in "".join(sender.messages) and 'b.com' in "".join(sender.messages)
+
+
+def test_retries_with_backoff():
+    sender = FakeSender([RetryableError("HTTP 503"), RetryableError("ratelimited", retry_after=0.2)])
+    dispatcher = AlertDispatcher([sender], batch_size=1, batch_interval=0, backoff=0.1)
+    start = time.time()
+    dispatcher._dispatch([alert('a.com')])
+    assert time.time() - start >= 0.3
+    assert len(sender.messages) == 1
+    assert dispatcher.stats()['sent'] == 1
+
+
+def test_gives_up_after_max_retries():
+    sender = FakeSender([RetryableError("HTTP 503")] * 3)
+    dispatcher = AlertDispatcher([sender], max_retries=2, backoff=0)
+    dispatcher._dispatch([alert('a.com')])
+    assert sender.messages == []
+    assert dispatcher.stats()['failed'] == 1
+
+
+def test_unexpected_errors_do_not_stop_alerting():
+    sender = FakeSender([ValueError("not JSON"), ConnectionError("refused")])
+    dispatcher = AlertDispatcher([sender], batch_size=1, batch_interval=0)
+    dispatcher.start()
+    try:
+        for domain in ('a.com', 'b.com', 'c.com'):
+            dispatcher.put(alert(domain))
+        assert wait_for(lambda: sender.messages)
+        assert dispatcher.thread.is_alive()
+        assert 'c.com' in sender.messages[0]
+        assert dispatcher.stats()['failed'] == 2
+    finally:
+        dispatcher.stop(5)
+
+
+def test_bad_alert_does_not_drop_the_batch():
+    sender = FakeSender()
+    dispatcher = AlertDispatcher([sender])
+    dispatcher._dispatch([Alert(None, None, 'bad.com', ''), alert('good.com')])
+    assert len(sender.messages) == 1 and 'good.com' in sender.messages[0]
+    assert dispatcher.stats()['failed'] == 1
+
+
+def test_slack_non_json_response():
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            body = b"<html>Bad gateway</html>"
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        sender = SlackSender("token", "#alerts")
+        sender.api_url = "http://127.0.0.1:{}/api/chat.postMessage".format(server.server_address[1])
+        assert sender.send("hello") is False
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,75 @@
+# Homoglyph matching by confusable skeleton
+import pytest
+
+from confusables import SkeletonMatcher, describe, idna_decode, skeleton
+
+
+@pytest.mark.parametrize('text,folded', [
+    ('google', 'google'),
+    # Digits and i fold onto the letters they imitate, i and l together
+    ('g00gle', 'google'),
+    ('paypa1', 'paypal'),
+    ('paypai', 'paypal'),
+    # Letter pairs
+    ('rnicrosoft', 'mlcrosoft'),
+    ('arnazon', 'amazon'),
+    ('vvikipedia', 'wlklpedla'),
+    ('clropbox', 'dropbox'),
+    # Greek omicrons, Cyrillic a and o, accents
+    (u'gοοgle', 'google'),
+    (u'pаypаl', 'paypal'),
+    (u'аmаzоn', 'amazon'),
+    (u'gööglé', 'google'),
+])
+def test_skeleton(text, folded):
+    assert skeleton(text) == folded
+
+
+def test_idna_decode():
+    assert idna_decode('xn--ggle-0nda.com') == u'gοοgle.com'
+    assert idna_decode('www.xn--pypl-53dc.example.com') == u'www.pаypаl.example.com'
+    assert idna_decode('google.com') == 'google.com'
+    # Invalid punycode is left as it is, the other labels are still decoded
+    assert idna_decode('xn--zz.xn--ggle-0nda.com') == u'xn--zz.gοοgle.com'
+    assert idna_decode('xn--broken-.com') == 'xn--broken-.com'
+    assert idna_decode('xn--.com') == 'xn--.com'
+
+
+@pytest.mark.parametrize('domain,keyword,description', [
+    # Greek omicrons and Cyrillic a, as they appear in certificates
+    ('xn--ggle-0nda.com', 'google', u'Homoglyph (ο for o)'),
+    ('login.xn--pypl-53dc.com', 'paypal', u'Homoglyph (а for a)'),
+    ('g00gle-login.com', 'google', 'Homoglyph (0 for o)'),
+    ('secure-paypa1.net', 'paypal', 'Homoglyph (1 for l)'),
+    ('rnicrosoft.com', 'microsoft', 'Homoglyph (rn for m)'),
+    ('arnazon-shop.com', 'amazon', 'Homoglyph (rn for m)'),
+    ('rnicr0soft.com', 'microsoft', 'Homoglyph (rn for m, 0 for o)'),
+    ('google.com', 'google', 'Homoglyph'),
+])
+def test_match(domain, keyword, description):
+    matcher = SkeletonMatcher(['google', 'paypal', 'microsoft', 'amazon'])
+    match = matcher.match(domain)
+    assert match.keyword == keyword
+    assert describe(match) == description
+
+
+def test_no_match():
+    matcher = SkeletonMatcher(['google', 'paypal'])
+    assert matcher.match('example.com') is None
+    assert matcher.match('xn--zz.com') is None
+    assert len(matcher) == 2
+
+
+def test_ignore_keywords():
+    matcher = SkeletonMatcher(['google'], ['googleapis'])
+    assert matcher.match('g00gleapis.com') is None
+    assert matcher.match('g00gle.com').keyword == 'google'
+
+
+def test_ignore_keyword_across_a_pair_fold():
+    # cornice folds to comlce, where neither nice nor cor survive, but the domain still holds them
+    for ignore in ('nice', 'cor', 'Nice'):
+        matcher = SkeletonMatcher(['mice'], [ignore])
+        assert matcher.match('cornice.com') is None
+    assert SkeletonMatcher(['mice']).match('cornice.com').keyword == 'mice'
+    assert SkeletonMatcher(['mice'], ['nice']).match('rnlce.com').keyword == 'mice'
@@ -0,0 +1,133 @@
+# Duplicate suppression stores
+import sys
+import types
+
+import pytest
+
+import dedup
+from dedup import BloomDedup, LRUDedup, create_dedup_store
+
+
+class Clock():
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup.time, 'time', clock.time)
+    return clock
+
+
+def test_lru_evicts_the_least_recently_seen():
+    store = LRUDedup(max_entries=3)
+    for domain in ('a.com', 'b.com', 'c.com'):
+        assert store.seen_before(domain) is False
+    # Seeing a.com again makes b.com the oldest
+    assert store.seen_before('a.com') is True
+    assert store.seen_before('d.com') is False
+    assert len(store) == 3
+    assert 'b.com' not in store
+    assert 'a.com' in store
+    assert store.seen_before('b.com') is False
+    assert store.stats()['evictions'] == 2
+
+
+def test_lru_ttl(clock):
+    store = LRUDedup(max_entries=100, ttl=60)
+    store.seen_before('a.com')
+    store.seen_before('b.com')
+    clock.now += 30
+    assert store.seen_before('a.com') is True
+    clock.now += 45
+    # a.com was seen 45 seconds ago, b.com 75
+    assert 'a.com' in store
+    assert 'b.com' not in store
+    assert store.seen_before('b.com') is False
+    # Adding evicts what has expired
+    clock.now += 61
+    store.seen_before('c.com')
+    assert len(store) == 1
+
+
+def test_lru_stats_and_memory():
+    store = LRUDedup(max_entries=1000)
+    empty = store.memory_bytes()
+    for i in range(500):
+        store.seen_before('host{}.example.com'.format(i))
+    for i in range(100):
+        store.seen_before('host{}.example.com'.format(i))
+    stats = store.stats()
+    assert stats['mode'] == 'lru'
+    assert (stats['lookups'], stats['hits'], stats['entries']) == (600, 100, 500)
+    assert stats['hit_rate'] == pytest.approx(100 / 600.0)
+    # At least the strings themselves
+    assert stats['memory_bytes'] >= empty + 500 * sys.getsizeof('host0.example.com')
+    store.clear()
+    assert store.memory_bytes() == sys.getsizeof(store._domains)
+    assert store.stats()['lookups'] == 600
+
+
+def test_bloom_false_positive_rate_within_the_budget():
+    store = BloomDedup(memory_bytes=64 * 1024, false_positive_rate=0.01)
+    assert store.memory_bytes() == 64 * 1024
+    # Filled to capacity, before the first rotation
+    for i in range(store.capacity):
+        store.add('seen{}.example.com'.format(i))
+    assert store.rotations == 0
+    assert all('seen{}.example.com'.format(i) in store for i in range(0, store.capacity, 97))
+
+    trials = 20000
+    false_positives = sum('new{}.example.com'.format(i) in store for i in range(trials))
+    assert false_positives / float(trials) < 2 * 0.01
+
+
+def test_bloom_generations_rotate():
+    store = BloomDedup(memory_bytes=4096, false_positive_rate=0.001)
+    capacity = store.capacity
+    first = ['first{}.com'.format(i) for i in range(capacity)]
+    for domain in first:
+        store.add(domain)
+    store.add('second0.com')
+    assert store.rotations == 1
+    # The previous generation is still consulted
+    assert sum(domain in store for domain in first) == capacity
+    assert store.seen_before(first[0]) is True
+
+    for i in range(1, capacity + 1):
+        store.add('second{}.com'.format(i))
+    assert store.rotations == 2
+    # The first generation has been dropped, only false positives remain
+    assert sum(domain in store for domain in first) < capacity * 0.01
+    assert store.memory_bytes() == 4096
+
+
+def test_bloom_stats():
+    store = BloomDedup(memory_bytes=4096, false_positive_rate=0.001)
+    store.seen_before('a.com')
+    store.seen_before('a.com')
+    stats = store.stats()
+    assert stats['mode'] == 'bloom'
+    assert (stats['lookups'], stats['hits'], stats['entries'], stats['rotations']) == (2, 1, 1, 0)
+    assert stats['memory_bytes'] == 4096
+    assert stats['false_positive_rate'] == 0.001
+    assert stats['capacity'] == store.capacity
+    with pytest.raises(ValueError):
+        BloomDedup(false_positive_rate=1)
+
+
+def test_create_dedup_store():
+    settings = types.SimpleNamespace(dedup_mode='lru', dedup_max_entries=10, dedup_ttl=5, dedup_memory_bytes=4096,
+                                     dedup_false_positive_rate=0.001)
+    store = create_dedup_store(settings)
+    assert (store.mode, store.max_entries, store.ttl) == ('lru', 10, 5)
+    settings.dedup_mode = 'bloom'
+    store = create_dedup_store(settings)
+    assert (store.mode, store.memory_bytes()) == ('bloom', 4096)
+    settings.dedup_mode = 'redis'
+    with pytest.raises(ValueError):
+        create_dedup_store(settings)
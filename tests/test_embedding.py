@@ -0,0 +1,62 @@
+# CertPipe used as a library, inside an application with its own logging and threads
+import logging
+import threading
+
+import certpipe
+from configwatch import ConfigWatcher
+
+
+def make_pipe(**overrides):
+    settings = dict(keywords=['paypal'], no_fuzz_keywords=[], ignore_keywords=[], keyword_fuzzers=['Omission'],
+                    fuzz_workers=1, enable_fuzz_cache=False, enable_csv_output=False, enable_history=False,
+                    enable_config_reload=False)
+    settings.update(overrides)
+    return certpipe.CertPipe(certpipe.load_settings(overrides=settings))
+
+
+def test_disabled_logging_leaves_the_application_loggers_alone():
+    root = logging.getLogger()
+    level = root.level
+    pipe = make_pipe(enable_logging=False)
+    pipe.setup()
+    try:
+        assert root.level == level
+        assert logging.getLogger('myapp').isEnabledFor(logging.WARNING)
+        for name in ('certpipe', 'certpipe.sources', 'certpipe.configwatch'):
+            assert not logging.getLogger(name).isEnabledFor(logging.CRITICAL)
+    finally:
+        logging.getLogger('certpipe').setLevel(logging.NOTSET)
+
+    make_pipe(enable_logging=True).setup()
+    assert logging.getLogger('certpipe.sources').isEnabledFor(logging.WARNING)
+
+
+def test_setup_off_the_main_thread(tmp_path):
+    path = tmp_path / 'settings.py'
+    path.write_text("keywords = ['paypal']\n")
+    pipe = make_pipe(enable_config_reload=True, config_reload_interval=0)
+    pipe.cfg.__file__ = str(path)
+    errors = []
+
+    def run_setup():
+        try:
+            pipe.setup()
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=run_setup)
+    thread.start()
+    thread.join(30)
+    assert errors == []
+    assert pipe.check_match('paypl-login.com')[0] is True
+
+
+def test_watcher_polls_without_sighup(tmp_path):
+    path = tmp_path / 'settings.py'
+    path.write_text("keywords = ['paypal']\n")
+    watcher = ConfigWatcher(str(path), lambda settings: None, interval=0)
+    thread = threading.Thread(target=watcher.start)
+    thread.start()
+    thread.join()
+    watcher.stop()
+    assert watcher.on_sighup is False
+    assert watcher.interval == 5
@@ -0,0 +1,76 @@
+# FuzzCache round trips and pruning
+import os
+import time
+
+from fuzzcache import FuzzCache
+
+
+VARIATIONS = {'Omission': ['gogle', 'googe'], 'Homoglyph': ['g00gle']}
+
+
+def make_cache(directory, fuzzers=('Omission', 'Homoglyph')):
+    return FuzzCache(str(directory), list(fuzzers))
+
+
+def age(path, days):
+    then = time.time() - days * 86400
+    os.utime(path, (then, then))
+
+
+def test_round_trip(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get('google') is None
+    cache.put('google', VARIATIONS)
+    assert cache.get('google') == VARIATIONS
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_settings_change_the_entry(tmp_path):
+    make_cache(tmp_path).put('google', VARIATIONS)
+    assert make_cache(tmp_path, ['Omission']).get('google') is None
+
+
+def test_prune_keeps_other_configurations(tmp_path):
+    make_cache(tmp_path).put('google', VARIATIONS)
+    other = make_cache(tmp_path, ['Omission'])
+    other.put('paypal', {'Omission': ['paypl']})
+
+    assert make_cache(tmp_path).prune(30) == 0
+    assert other.get('paypal') == {'Omission': ['paypl']}
+
+
+def test_prune_removes_unused_entries(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('google', VARIATIONS)
+    cache.put('paypal', VARIATIONS)
+    age(cache.path('google'), 40)
+    age(cache.path('paypal'), 40)
+
+    # Reading an entry marks it as used
+    assert cache.get('paypal') == VARIATIONS
+    assert cache.prune(30) == 1
+    assert not os.path.exists(cache.path('google'))
+    assert cache.get('paypal') == VARIATIONS
+
+
+def test_prune_disabled(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('google', VARIATIONS)
+    age(cache.path('google'), 400)
+    assert cache.prune(0) == 0
+    assert cache.get('google') == VARIATIONS
+
+
+def test_unreadable_entries_are_removed(tmp_path):
+    cache = make_cache(tmp_path)
+    for content in [b"gogle\ngooge\n", b"", b"#Omission\ngog", b"#Omission\n\xff\xfe\n"]:
+        cache.put('google', VARIATIONS)
+        with open(cache.path('google'), 'wb') as cache_file:
+            cache_file.write(content)
+        assert cache.get('google') is None
+        assert not os.path.exists(cache.path('google'))
+    assert cache.hits == 0
+
+    # Fuzzed and cached again afterwards
+    cache.put('google', VARIATIONS)
+    assert cache.get('google') == VARIATIONS
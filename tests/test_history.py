@@ -0,0 +1,146 @@
+# On-disk match history
+import os
+import sqlite3
+import time
+
+from history import MAX_WRITE_RETRIES, MatchHistory
+
+
+def pragma(path, name):
+    db = sqlite3.connect(str(path))
+    try:
+        return db.execute("PRAGMA " + name).fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_new_database_uses_incremental_vacuum(tmp_path):
+    path = tmp_path / 'history.db'
+    MatchHistory(str(path)).close()
+    assert pragma(path, 'auto_vacuum') == 2
+    assert pragma(path, 'journal_mode') == 'wal'
+
+
+def test_existing_database_is_converted(tmp_path):
+    path = tmp_path / 'history.db'
+    # As created before auto_vacuum was set ahead of WAL mode
+    db = sqlite3.connect(str(path))
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    db.execute("CREATE TABLE t (x)")
+    db.commit()
+    db.close()
+    assert pragma(path, 'auto_vacuum') == 0
+
+    MatchHistory(str(path)).close()
+    assert pragma(path, 'auto_vacuum') == 2
+
+
+# Connection whose writes fail the first failures times, as when another process holds the database locked
+class FlakyConnection():
+    def __init__(self, path, failures):
+        self.db = sqlite3.connect(path)
+        self.failures = failures
+
+    def __enter__(self):
+        return self.db.__enter__()
+
+    def __exit__(self, *exc):
+        return self.db.__exit__(*exc)
+
+    def executemany(self, sql, rows):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.db.executemany(sql, rows)
+
+
+def test_failed_write_is_retried(tmp_path):
+    path = str(tmp_path / 'history.db')
+    history = MatchHistory(path)
+    db = FlakyConnection(path, 2)
+    history.record('a.example.com', 'example', 'Original*')
+    history._write(db)
+    # Matched again while the first batch waits for its retry
+    history.touch('a.example.com')
+    history.record('b.example.com', 'example', 'Addition')
+    history._write(db)
+    assert history.stats()['pending'] == 2
+    assert history.seen('a.example.com')
+
+    history._write(db)
+    assert history.stats()['pending'] == 0
+    assert history.stats()['writes'] == 2
+    assert history.write_failures == 0
+    row = history._db.execute("SELECT keyword, fuzzer, hits FROM matches WHERE domain = 'a.example.com'").fetchone()
+    assert row == ('example', 'Original*', 2)
+    db.db.close()
+    history.close()
+
+
+def test_failed_writes_are_dropped_after_the_retries(tmp_path):
+    path = str(tmp_path / 'history.db')
+    history = MatchHistory(path)
+    db = FlakyConnection(path, MAX_WRITE_RETRIES + 1)
+    history.record('a.example.com', 'example', 'Original*')
+    for _ in range(MAX_WRITE_RETRIES + 1):
+        history._write(db)
+    assert history.stats()['pending'] == 0
+    assert history.stats()['dropped'] == 1
+
+    # Later matches are written once the database is back
+    history.record('b.example.com', 'example', 'Addition')
+    history._write(db)
+    assert history.stats()['writes'] == 1
+    db.db.close()
+    history.close()
+
+
+def test_survives_restart(tmp_path):
+    path = str(tmp_path / 'history.db')
+    history = MatchHistory(path, flush_rows=2)
+    history.start()
+    history.record('a.example.com', 'example', 'Original*', 'https://urlscan.io/result/1/')
+    history.record('b.example.com', 'example', 'Addition')
+    assert history.seen('a.example.com')
+    history.close(5)
+
+    history = MatchHistory(path)
+    assert history.seen('a.example.com')
+    assert history.seen('b.example.com')
+    assert not history.seen('c.example.com')
+    assert history.recent() == ['a.example.com', 'b.example.com']
+    assert history.recent(limit=1) == ['b.example.com']
+    history.close()
+
+
+def test_retention_shrinks_the_file(tmp_path):
+    path = str(tmp_path / 'history.db')
+    history = MatchHistory(path)
+    history.close()
+
+    # A large batch of matches from well outside the retention period
+    db = sqlite3.connect(path)
+    old = time.time() - 10 * 86400
+    with db:
+        db.executemany("INSERT INTO matches (domain, first_seen, last_seen, keyword) VALUES (?, ?, ?, ?)",
+                       (("host{}-{}.example.com".format(i, 'x' * 100), old, old, 'example') for i in range(20000)))
+        db.execute("INSERT INTO matches (domain, first_seen, last_seen) VALUES ('recent.example.com', ?, ?)", (time.time(), time.time()))
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close()
+    size = os.path.getsize(path)
+
+    # Compaction runs when the writer starts
+    history = MatchHistory(path, retention_days=1)
+    history.start()
+    deadline = time.time() + 10
+    while history.stats()['deleted'] == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    history.close(5)
+
+    assert history.stats()['deleted'] == 20000
+    assert pragma(path, 'freelist_count') == 0
+    assert os.path.getsize(path) < size / 4
+    history = MatchHistory(path)
+    assert history.recent() == ['recent.example.com']
+    history.close()
@@ -0,0 +1,46 @@
+# Edit-distance look-alike matching
+import os
+import subprocess
+import sys
+
+from lookalike import LookalikeIndex, deletes, weighted_distance
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def test_weighted_distance():
+    assert weighted_distance('paypal', 'paypal', 2) == 0
+    assert weighted_distance('paypal', 'paypall', 2) == 0.5      # doubled letter
+    assert weighted_distance('paypal', 'paypak', 2) == 0.5       # neighbouring key
+    assert weighted_distance('paypal', 'paypjl', 2) == 1
+    assert weighted_distance('paypal', 'papyal', 2) == 1         # swapped letters
+    assert weighted_distance('paypal', 'pxyxal', 1) is None
+
+
+def test_deletes():
+    assert deletes('abc', 1) == set(['abc', 'bc', 'ac', 'ab'])
+
+
+def test_match():
+    index = LookalikeIndex(['paypal', 'microsoft'], max_distance=1.0)
+    match = index.match('login.paypa1-secure.com')
+    assert (match.keyword, match.token, match.distance) == ('paypal', 'paypa1', 1)
+    assert index.match('paypal.com') is None                     # exact hits are left to the keyword matcher
+    assert index.match('example.com') is None
+    assert LookalikeIndex(['paypal'], ignore_keywords=['test']).match('paypa1-test.com') is None
+
+
+def test_ties_are_broken_by_keyword():
+    # 'abcde' is one deletion from both keywords
+    index = LookalikeIndex(['abcdeq', 'abcdep'], max_distance=1.0)
+    assert index.match('abcde.com').keyword == 'abcdep'
+
+
+def test_ties_do_not_depend_on_hash_seed():
+    code = ("from lookalike import LookalikeIndex; "
+            "print(LookalikeIndex(['abcdeq', 'abcdep', 'abcdez', 'abcdea'], max_distance=1.0).match('abcde.com').keyword)")
+    results = set()
+    for seed in range(8):
+        env = dict(os.environ, PYTHONHASHSEED=str(seed))
+        results.add(subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, env=env).decode().strip())
+    assert results == set(['abcdea'])
@@ -0,0 +1,63 @@
+# KeywordMatcher must return what the linear keyword scan it replaced returned
+import random
+
+from matcher import FUZZED, IGNORE, NO_FUZZ, KeywordMatcher
+
+
+# The check_match logic from before the matcher, as in benchmarks/bench_matcher.py
+def linear_check_match(domain, ignore_keywords, no_fuzz_keywords, fuzzed_keywords):
+    for keyword in ignore_keywords:
+        if keyword in domain:
+            return False, ""
+    for keyword in no_fuzz_keywords:
+        if keyword in domain:
+            return True, keyword
+    for keyword, _ in fuzzed_keywords:
+        if keyword in domain:
+            return True, keyword
+    return False, ""
+
+
+def matcher_check_match(matcher, domain):
+    match = matcher.match(domain)
+    return (True, match.keyword) if match else (False, "")
+
+
+# A small alphabet so keywords overlap, nest and share prefixes and suffixes often
+def random_word(rng, low, high):
+    return ''.join(rng.choice('abc.-') for _ in range(rng.randint(low, high)))
+
+
+def test_matches_linear_scan():
+    rng = random.Random(1)
+    for _ in range(3000):
+        ignore = [random_word(rng, 2, 5) for _ in range(rng.randint(0, 2))]
+        no_fuzz = [random_word(rng, 1, 4) for _ in range(rng.randint(0, 3))]
+        fuzzed = [(random_word(rng, 1, 6), rng.choice(['Original*', 'Addition', 'Omission'])) for _ in range(rng.randint(0, 8))]
+        matcher = KeywordMatcher(ignore, no_fuzz, fuzzed)
+        for _ in range(10):
+            domain = random_word(rng, 0, 15)
+            expected = linear_check_match(domain, ignore, no_fuzz, fuzzed)
+            assert matcher_check_match(matcher, domain) == expected, (domain, ignore, no_fuzz, fuzzed)
+
+
+def test_priority_and_fuzzer():
+    matcher = KeywordMatcher(['test'], ['admin'], [('google', 'Original*'), ('g00gle', 'Homoglyph'), ('admin', 'Addition')])
+    assert matcher.match('my-test-google.com') is None
+    assert matcher.match('admin.g00gle.com').keyword == 'admin'
+    assert matcher.match('admin.g00gle.com').keyword_class == NO_FUZZ
+    match = matcher.match('login.g00gle.com')
+    assert (match.keyword, match.keyword_class, match.fuzzer, match.start) == ('g00gle', FUZZED, 'Homoglyph', 6)
+    assert matcher.match('example.com') is None
+
+
+def test_findall():
+    matcher = KeywordMatcher(['ab'], ['b'], [('abc', 'Original*'), ('c', 'Addition')])
+    assert [(m.keyword, m.keyword_class, m.start) for m in matcher.findall('xabc')] == \
+        [('ab', IGNORE, 1), ('b', NO_FUZZ, 2), ('abc', FUZZED, 1), ('c', FUZZED, 3)]
+
+
+def test_empty_keyword_is_skipped():
+    matcher = KeywordMatcher([], [''], [('', 'Original*')])
+    assert len(matcher) == 0
+    assert matcher.match('example.com') is None
@@ -0,0 +1,75 @@
+# Counters and histograms shared between threads and processes
+import sys
+import threading
+
+import metrics
+
+
+def hammer(target, threads=8, count=20000):
+    interval = sys.getswitchinterval()
+    # Switch threads as often as possible so unlocked updates would be lost
+    sys.setswitchinterval(1e-6)
+    try:
+        workers = [threading.Thread(target=lambda: [target() for _ in range(count)]) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+    return threads * count
+
+
+def test_concurrent_counter_increments():
+    counter = metrics.Registry(3).counter("test_total", "Test counter")
+    expected = hammer(counter.inc)
+    assert counter.value() == expected
+
+
+def test_concurrent_histogram_observations():
+    histogram = metrics.Registry(3).histogram("test_seconds", "Test histogram", buckets=[0.5])
+    expected = hammer(lambda: histogram.observe(0.25))
+    samples = dict((name + labels, value) for name, labels, value in histogram.samples())
+    assert samples['test_seconds_count'] == expected
+    assert samples['test_seconds_bucket{le="0.5"}'] == expected
+    assert samples['test_seconds_sum'] == expected * 0.25
+
+
+def test_render():
+    registry = metrics.Registry(2)
+    counter = registry.counter("test_total", "Test counter")
+    counter.inc()
+    metrics.set_process_slot(1)
+    try:
+        counter.inc(2)
+    finally:
+        metrics.set_process_slot(0)
+    labeled = registry.labeled_counter("test_matches_total", "Test labels", ["keyword"])
+    labeled.inc('pay"pal')
+    registry.gauge("test_depth", "Test gauge", lambda: 5)
+    registry.gauge("test_missing", "Left out", lambda: None)
+    assert registry.render().splitlines() == [
+        "# HELP test_total Test counter", "# TYPE test_total counter", "test_total 3",
+        "# HELP test_matches_total Test labels", "# TYPE test_matches_total counter", 'test_matches_total{keyword="pay\\"pal"} 1',
+        "# HELP test_depth Test gauge", "# TYPE test_depth gauge", "test_depth 5",
+        "# HELP test_missing Left out", "# TYPE test_missing gauge"]
+
+
+def test_matches_are_labelled_by_keyword():
+    import certpipe
+    pipe = certpipe.CertPipe(certpipe.load_settings(overrides=dict(
+        keywords=['google', 'paypal'], no_fuzz_keywords=['admin'], ignore_keywords=[], keyword_fuzzers=['Omission'],
+        enable_metrics=True, enable_csv_output=False)))
+    pipe.metrics = certpipe.CertPipeMetrics(pipe, 1)
+    pipe.keyword_variations = pipe.fuzz_keyword_variations(pipe.cfg.keywords)
+    pipe.keyword_index = pipe.build_keyword_index(pipe.fuzzed_pairs(pipe.cfg.keywords, pipe.keyword_variations))
+    for domain in ('gogle.com', 'gooogle.net', 'google.org', 'paypl.com', 'admin.example.com'):
+        for match in pipe.match_message({'message_type': 'certificate_update', 'data': {'leaf_cert': {'all_domains': [domain]}}}):
+            pipe.handle_match(*match)
+    labels = dict((labels, value) for _, labels, value in pipe.metrics.matches.samples())
+    assert labels == {
+        '{keyword="admin",fuzzer=""}': 1,
+        # gooogle also holds the omission oogle, which comes first
+        '{keyword="google",fuzzer="Omission"}': 2,
+        '{keyword="google",fuzzer="Original*"}': 1,
+        '{keyword="paypal",fuzzer="Omission"}': 1}
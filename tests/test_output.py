@@ -0,0 +1,109 @@
+# Buffered CSV and NDJSON output files, rotation and compression
+import csv
+import gzip
+import json
+import os
+import threading
+
+import pytest
+
+import config
+from output import CSVWriter, JSONWriter
+
+
+def rotated_files(directory, name):
+    return sorted(f for f in os.listdir(str(directory)) if f.startswith(name + "."))
+
+
+def test_csv_rows_and_quoting(tmp_path):
+    path = str(tmp_path / 'matches.csv')
+    writer = CSVWriter(path, ['timestamp', 'keyword', 'domain'], flush_rows=100, flush_interval=60)
+    writer.write(['t1', 'paypal', 'paypal-login.com'])
+    writer.write(['t2', 'a,b', 'x"y.com'])
+    assert not os.path.exists(path)
+    writer.close()
+    with open(path) as f:
+        assert f.read() == 'timestamp,keyword,domain\nt1,paypal,paypal-login.com\nt2,"a,b","x""y.com"\n'
+
+
+def test_json_lines(tmp_path):
+    path = str(tmp_path / 'matches.ndjson')
+    writer = JSONWriter(path, flush_rows=100, flush_interval=60)
+    records = [{'domain': 'd{}.com'.format(i), 'certificate': {'cert_index': i}} for i in range(3)]
+    for record in records:
+        writer.write(record)
+    writer.close()
+    with open(path) as f:
+        assert [json.loads(line) for line in f] == records
+
+
+# Every value the config files may hold, older configs used True and False for the CSV output
+@pytest.mark.parametrize('compress,extension', [("", None), (False, None), ('gzip', '.gz'), (True, '.gz'), ('zstd', '.zst')])
+def test_rotation_compression(tmp_path, compress, extension):
+    if compress == 'zstd':
+        zstandard = pytest.importorskip('zstandard')
+    path = str(tmp_path / 'matches.ndjson')
+    writer = JSONWriter(path, flush_rows=1, flush_interval=60, rotate_bytes=5, compress=compress)
+    writer.write({'n': 1})
+    writer.flush()
+    writer.write({'n': 2})
+    writer.close()
+
+    rotated = rotated_files(tmp_path, 'matches.ndjson')
+    assert len(rotated) == 1
+    if extension:
+        assert rotated[0].endswith(extension)
+    else:
+        assert not rotated[0].endswith(('.gz', '.zst'))
+    rotated_path = str(tmp_path / rotated[0])
+    if extension == '.gz':
+        with gzip.open(rotated_path, 'rt') as f:
+            assert f.read() == '{"n":1}\n'
+    elif extension == '.zst':
+        with open(rotated_path, 'rb') as f:
+            assert zstandard.ZstdDecompressor().stream_reader(f).read() == b'{"n":1}\n'
+    else:
+        with open(rotated_path) as f:
+            assert f.read() == '{"n":1}\n'
+    with open(path) as f:
+        assert f.read() == '{"n":2}\n'
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        JSONWriter(str(tmp_path / 'matches.ndjson'), compress='bzip2')
+
+
+def test_config_defaults_use_the_same_scheme():
+    assert config.output_csv_compress in ("", 'gzip', 'zstd')
+    assert config.output_json_compress in ("", 'gzip', 'zstd')
+
+
+def test_full_buffer_is_written_by_the_flusher(tmp_path):
+    path = str(tmp_path / 'matches.csv')
+    threads = []
+    written = threading.Event()
+
+    def on_flush(seconds):
+        threads.append(threading.current_thread().name)
+        written.set()
+    writer = CSVWriter(path, ['n', 'thread'], flush_rows=10, flush_interval=60, on_flush=on_flush)
+
+    def write_rows(name):
+        for i in range(200):
+            writer.write([i, name])
+    writers = [threading.Thread(target=write_rows, args=('w{}'.format(t),)) for t in range(4)]
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    assert written.wait(10)
+    # Every batch so far was written by the flusher thread, none by the threads calling write()
+    assert set(threads) == {'flush-matches.csv'}
+    writer.close()
+
+    with open(path) as f:
+        rows = list(csv.reader(f))[1:]
+    assert len(rows) == 800
+    for t in range(4):
+        assert [int(n) for n, name in rows if name == 'w{}'.format(t)] == list(range(200))
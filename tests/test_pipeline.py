@@ -0,0 +1,140 @@
+# Certificate dedup, the match memo and the sharded matcher pipeline
+import json
+import os
+import threading
+
+import certpipe
+from pipeline import ShardedPipeline
+from sources import certificate_key, raw_certificate_key
+
+
+def message(serial, domains, log=0):
+    return {'message_type': 'certificate_update', 'data': {
+        'cert_index': serial, 'seen': 0, 'source': {'url': 'log{}'.format(log)},
+        'leaf_cert': {'all_domains': domains, 'serial_number': 'S{:04d}'.format(serial), 'issuer': {'aggregated': '/CN=CA'}},
+        'chain': [{'serial_number': 'CA01'}]}}
+
+
+def make_pipe(**overrides):
+    settings = dict(keywords=['paypal'], no_fuzz_keywords=[], ignore_keywords=[], keyword_fuzzers=['Omission'],
+                    enable_csv_output=False)
+    settings.update(overrides)
+    pipe = certpipe.CertPipe(certpipe.load_settings(overrides=settings))
+    pipe.keyword_variations = pipe.fuzz_keyword_variations(pipe.cfg.keywords)
+    pipe.keyword_index = pipe.build_keyword_index(pipe.fuzzed_pairs(pipe.cfg.keywords, pipe.keyword_variations))
+    return pipe
+
+
+def test_raw_certificate_key():
+    msg = message(7, ['a.example.com'])
+    text = json.dumps(msg)
+    assert raw_certificate_key(text) == 'S0007'
+    assert raw_certificate_key(text.encode('utf-8')) == 'S0007'
+    assert raw_certificate_key(msg) == certificate_key(msg) == 'S0007//CN=CA'
+    assert raw_certificate_key(json.dumps({'message_type': 'heartbeat'})) is None
+
+
+def test_certificate_dedup_skips_copies():
+    pipe = make_pipe()
+    assert len(pipe.match_message(message(1, ['paypal-login.com'], log=0))) == 1
+    assert pipe.match_message(message(1, ['paypal-login.com'], log=1)) == []
+    assert len(pipe.match_message(message(2, ['paypal-login.com']))) == 1
+    assert pipe.seen_certificates.stats()['hits'] == 1
+
+    pipe = make_pipe(certificate_dedup_max_entries=0)
+    assert pipe.seen_certificates is None
+    assert len(pipe.match_message(message(1, ['paypal-login.com'], log=1))) == 1
+
+
+def test_match_memo_reuses_results_until_a_reload():
+    pipe = make_pipe(certificate_dedup_max_entries=0)
+    calls = []
+    check_match = pipe.check_match
+    pipe.check_match = lambda domain: calls.append(domain) or check_match(domain)
+
+    assert pipe.memo_check_match('paypl.example.com') == (True, 'paypl', 'Omission')
+    assert pipe.memo_check_match('paypl.example.com') == (True, 'paypl', 'Omission')
+    assert calls == ['paypl.example.com']
+    assert pipe.match_memo.stats()['hits'] == 1
+
+    # Results from the previous index are stale
+    pipe.reload_keywords({'keywords': ['microsoft']})
+    assert pipe.memo_check_match('paypl.example.com')[0] is False
+    assert calls == ['paypl.example.com', 'paypl.example.com']
+
+
+def test_match_memo_evicts_the_least_recently_used():
+    pipe = make_pipe(match_memo_max_entries=2)
+    for domain in ('a.com', 'b.com', 'a.com', 'c.com'):
+        pipe.memo_check_match(domain)
+    memo = pipe.match_memo
+    assert memo.get('b.com') is None
+    assert memo.get('a.com') is not None
+    assert memo.stats()['evictions'] == 1
+
+
+# Runs in the worker processes, reports which worker got the message
+def worker_of(message):
+    return [(os.getpid(), raw_certificate_key(message))]
+
+
+def run_pipeline(match_fn, messages, workers=3, **kwargs):
+    handled = []
+    done = threading.Event()
+
+    def handle(*match):
+        handled.append(match)
+        if len(handled) == expected:
+            done.set()
+    expected = kwargs.pop('expected', len(messages))
+    pipeline = ShardedPipeline(match_fn, handle, workers, queue_size=100, **kwargs)
+    pipeline.start()
+    try:
+        for msg in messages:
+            pipeline.put(msg)
+        done.wait(30)
+    finally:
+        pipeline.stop(10)
+    return handled, pipeline
+
+
+def test_copies_of_a_certificate_reach_the_same_worker():
+    messages = [json.dumps(message(serial, ['d{}.example.com'.format(serial)], log)) for log in range(4) for serial in range(30)]
+    handled, pipeline = run_pipeline(worker_of, messages, shard_key=raw_certificate_key)
+    assert len(handled) == len(messages)
+    workers = {}
+    for pid, key in handled:
+        workers.setdefault(key, set()).add(pid)
+    assert all(len(pids) == 1 for pids in workers.values())
+    assert len(set(pid for pid, _ in handled)) == 3
+    assert pipeline.stats()['processed'] == len(messages)
+
+
+def test_unsharded_messages_are_spread_over_the_workers():
+    messages = [json.dumps({'message_type': 'heartbeat', 'n': i}) for i in range(30)]
+    handled, pipeline = run_pipeline(worker_of, messages)
+    assert len(set(pid for pid, _ in handled)) == 3
+
+
+def test_duplicates_are_skipped_with_matcher_workers():
+    pipe = make_pipe()
+    messages = [json.dumps(message(serial, ['paypal-{}.com'.format(serial)], log)) for log in range(4) for serial in range(20)]
+    handled, pipeline = run_pipeline(pipe.match_message, messages, shard_key=raw_certificate_key, expected=20)
+    assert sorted(match[0] for match in handled) == sorted('paypal-{}.com'.format(serial) for serial in range(20))
+    assert pipeline.stats()['processed'] == len(messages)
+
+
+def test_restart_keeps_the_shards():
+    handled = []
+    pipeline = ShardedPipeline(worker_of, lambda *match: handled.append(match), 2, queue_size=100, shard_key=raw_certificate_key)
+    pipeline.start()
+    try:
+        for serial in range(10):
+            pipeline.put(json.dumps(message(serial, ['a.com'], 0)))
+        pipeline.restart_workers()
+        for serial in range(10):
+            pipeline.put(json.dumps(message(serial, ['a.com'], 1)))
+    finally:
+        pipeline.stop(10)
+    assert len(handled) == 20
+    assert pipeline.stats()['processed'] == 20
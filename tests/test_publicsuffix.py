@@ -0,0 +1,70 @@
+# Splitting domains on the Public Suffix List
+import pytest
+
+import certpipe
+from publicsuffix import PublicSuffixList
+
+
+@pytest.fixture(scope='module')
+def psl():
+    return PublicSuffixList()
+
+
+@pytest.mark.parametrize('domain,subdomain,name,suffix', [
+    ('www.example.com', 'www', 'example', 'com'),
+    ('a.b.example.co.uk', 'a.b', 'example', 'co.uk'),
+    ('example.co.uk', '', 'example', 'co.uk'),
+    ('co.uk', '', '', 'co.uk'),
+    ('uk', '', '', 'uk'),
+    # No rule, the last label is the suffix
+    ('example.notatld', '', 'example', 'notatld'),
+    # Wildcard *.ck and exception !www.ck
+    ('foo.bar.ck', '', 'foo', 'bar.ck'),
+    ('www.ck', '', 'www', 'ck'),
+    ('a.www.ck', 'a', 'www', 'ck'),
+    # Wildcard below a rule, *.kawasaki.jp with !city.kawasaki.jp
+    ('x.y.kawasaki.jp', '', 'x', 'y.kawasaki.jp'),
+    ('x.city.kawasaki.jp', 'x', 'city', 'kawasaki.jp'),
+    # Internationalised suffixes match in their xn-- form
+    ('example.xn--p1ai', '', 'example', 'xn--p1ai'),
+    ('shop.example.xn--55qx5d.cn', 'shop', 'example', 'xn--55qx5d.cn'),
+    # Private section
+    ('d1234.cloudfront.net', '', 'd1234', 'cloudfront.net'),
+])
+def test_split(psl, domain, subdomain, name, suffix):
+    split = psl.split(domain)
+    assert (split.subdomain, split.name, split.suffix) == (subdomain, name, suffix)
+    assert split.registered_domain == (name + '.' + suffix if name else '')
+    # The same again from the cache
+    assert psl.split(domain) == split
+
+
+def test_private_section_can_be_left_out():
+    assert PublicSuffixList(private=False).split('d1234.cloudfront.net').suffix == 'net'
+
+
+@pytest.mark.parametrize('domain', ['x..co.uk', 'city...co', '.co.uk', 'example.com.', 'a..ck'])
+def test_empty_labels_are_rejected(psl, domain):
+    with pytest.raises(ValueError):
+        psl.suffix_length(domain)
+    with pytest.raises(ValueError):
+        psl.split(domain)
+
+
+def test_malformed_name_does_not_hide_the_others():
+    for parts in ('no-suffix', 'registered-name'):
+        pipe = certpipe.CertPipe(certpipe.load_settings(overrides=dict(
+            keywords=['google'], no_fuzz_keywords=[], ignore_keywords=[], fuzz_workers=1, enable_fuzz_cache=False,
+            keyword_fuzzers=['Omission'],
+            match_domain_parts=parts, enable_json_output=False)))
+        variations = pipe.fuzz_keyword_variations(pipe.cfg.keywords)
+        pipe.keyword_index = pipe.build_keyword_index(pipe.fuzzed_pairs(pipe.cfg.keywords, variations))
+        message = {'message_type': 'certificate_update',
+                   'data': {'leaf_cert': {'all_domains': ['x..co.uk', 'city...co', '', 'google-login.com']}}}
+        assert [match[:2] for match in pipe.match_message(message)] == [('google-login.com', 'google')]
+
+
+def test_default_searches_the_whole_domain():
+    pipe = certpipe.CertPipe(certpipe.load_settings())
+    assert pipe.public_suffixes is None
+    assert pipe.prepare_domain('*.shop.example.co.uk') == ('shop.example.co.uk', 'shop.example.co.uk')
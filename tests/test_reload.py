@@ -0,0 +1,85 @@
+# Live keyword reload
+import pytest
+
+import certpipe
+from configwatch import ConfigWatcher
+
+
+def make_pipe(**overrides):
+    settings = dict(keywords=['paypal'], no_fuzz_keywords=['admin'], ignore_keywords=[], fuzz_workers=1,
+                    enable_fuzz_cache=False, keyword_fuzzers=['Omission'], match_domain_parts='all')
+    settings.update(overrides)
+    pipe = certpipe.CertPipe(certpipe.load_settings(overrides=settings))
+    pipe.keyword_variations = pipe.fuzz_keyword_variations(pipe.cfg.keywords)
+    pipe.fuzzed_keywords = pipe.fuzzed_pairs(pipe.cfg.keywords, pipe.keyword_variations)
+    pipe.keyword_index = pipe.build_keyword_index(pipe.fuzzed_keywords)
+    return pipe
+
+
+def test_reload_applies_new_keywords():
+    pipe = make_pipe()
+    assert pipe.check_match('paypl-login.com') == (True, 'paypl', 'Omission')
+    assert pipe.check_match('microsoft-login.com')[0] is False
+
+    pipe.reload_keywords({'keywords': ['paypal', 'microsoft'], 'ignore_keywords': ['test']})
+    assert pipe.cfg.keywords == ['paypal', 'microsoft']
+    assert pipe.cfg.ignore_keywords == ['test']
+    assert pipe.check_match('microsoft-login.com') == (True, 'microsoft', 'Original*')
+    assert pipe.check_match('microsoft-test.com')[0] is False
+
+
+def test_failed_build_leaves_the_config_unchanged(monkeypatch):
+    pipe = make_pipe()
+    index = pipe.keyword_index
+
+    def broken(lists):
+        raise RuntimeError("build failed")
+    monkeypatch.setattr(pipe, 'build_lookalike_index', broken)
+    with pytest.raises(RuntimeError):
+        pipe.reload_keywords({'keywords': ['paypal', 'microsoft'], 'no_fuzz_keywords': []})
+    assert pipe.cfg.keywords == ['paypal']
+    assert pipe.cfg.no_fuzz_keywords == ['admin']
+    assert pipe.keyword_index is index
+
+    # The same settings again are still a change, and apply once the build works
+    monkeypatch.undo()
+    pipe.reload_keywords({'keywords': ['paypal', 'microsoft'], 'no_fuzz_keywords': []})
+    assert pipe.cfg.keywords == ['paypal', 'microsoft']
+    assert pipe.cfg.no_fuzz_keywords == []
+    assert pipe.keyword_index is not index
+    assert pipe.check_match('admin.example.com')[0] is False
+
+
+def test_watcher_reloads_the_file(tmp_path):
+    path = tmp_path / 'settings.py'
+    path.write_text("keywords = ['paypal']\n")
+    changes = []
+    watcher = ConfigWatcher(str(path), changes.append, interval=0)
+    path.write_text("keywords = ['paypal', 'microsoft']\n")
+    watcher.reload()
+    assert changes == [{'keywords': ['paypal', 'microsoft']}]
+
+    # A file with errors is reported and skipped
+    path.write_text("keywords = [\n")
+    watcher.reload()
+    assert len(changes) == 1
+    assert (watcher.reloads, watcher.failures) == (1, 1)
+
+
+def test_restart_warning_compares_with_the_file(caplog):
+    # Started with dedup_mode overridden on the command line, the file still says "lru"
+    pipe = make_pipe(dedup_mode="bloom")
+    pipe.file_settings = {'keywords': ['paypal'], 'dedup_mode': "lru", 'fuzz_workers': 1}
+
+    pipe.reload_keywords({'keywords': ['paypal', 'microsoft'], 'dedup_mode': "lru", 'fuzz_workers': 1})
+    assert "Restart CertPipe" not in caplog.text
+    assert pipe.cfg.keywords == ['paypal', 'microsoft']
+
+    pipe.reload_keywords({'keywords': ['paypal', 'microsoft'], 'dedup_mode': "lru", 'fuzz_workers': 4})
+    assert "Restart CertPipe to apply changes to: fuzz_workers" in caplog.text
+
+    # Reported once, not again on every reload after it
+    caplog.clear()
+    pipe.reload_keywords({'keywords': ['paypal'], 'dedup_mode': "lru", 'fuzz_workers': 4})
+    assert "Restart CertPipe" not in caplog.text
+    assert pipe.cfg.keywords == ['paypal']
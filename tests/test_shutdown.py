@@ -0,0 +1,62 @@
+# certpipe.py run from the command line, as docker runs and stops it
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+CERTPIPE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'certpipe.py')
+
+
+def write_recording(path, domains):
+    with open(path, 'w') as f:
+        for i, domain in enumerate(domains):
+            f.write(json.dumps({'message_type': 'certificate_update', 'data': {
+                'cert_index': i, 'seen': 0, 'leaf_cert': {'all_domains': [domain], 'serial_number': str(i)}}}) + '\n')
+
+
+def test_sigterm_flushes_outputs(tmp_path):
+    recording = tmp_path / 'recording.ndjson'
+    write_recording(recording, ['paypal-login.com', 'www.example.org', 'secure-paypal.net'])
+
+    csv_file = tmp_path / 'matches.csv'
+    history_file = tmp_path / 'history.db'
+    log_file = tmp_path / 'certpipe.log'
+    log = open(log_file, 'w')
+    # Looping at full speed keeps it running, the long flush interval keeps the rows buffered until exit
+    process = subprocess.Popen([sys.executable, CERTPIPE, '--replay', str(recording), '-k', 'paypal',
+                                '--set', 'replay_speed=0', '--set', 'replay_loop=True', '--set', 'fuzz_workers=1',
+                                '--set', 'enable_fuzz_cache=False', '--set', 'enable_config_reload=False',
+                                '--set', 'output_csv_file=' + str(csv_file), '--set', 'output_csv_flush_interval=3600',
+                                '--set', 'history_file=' + str(history_file)],
+                               cwd=str(tmp_path), stdout=subprocess.DEVNULL, stderr=log)
+    try:
+        time.sleep(3)
+        assert process.poll() is None
+        # Nothing written yet
+        assert not csv_file.exists() or len(csv_file.read_text().splitlines()) <= 1
+
+        process.send_signal(signal.SIGTERM)
+        process.wait(30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        log.close()
+
+    assert process.returncode == 128 + signal.SIGTERM, log_file.read_text()
+    rows = csv_file.read_text().splitlines()
+    assert sorted(row.split(',')[2] for row in rows[1:]) == ['paypal-login.com', 'secure-paypal.net']
+
+
+def test_disabled_logging_silences_every_module(tmp_path):
+    recording = tmp_path / 'recording.ndjson'
+    write_recording(recording, ['paypal-login.com'])
+    # Without replay_loop it exits at the end of the recording
+    result = subprocess.run([sys.executable, CERTPIPE, '--replay', str(recording), '-k', 'paypal', '--no-output',
+                             '--set', 'fuzz_workers=1', '--set', 'enable_fuzz_cache=False',
+                             '--set', 'enable_config_reload=False', '--set', 'enable_logging=False'],
+                            cwd=str(tmp_path), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=60)
+    assert result.returncode == 0
+    # The replay source logs from its own module when it starts
+    assert result.stderr.decode() == ""
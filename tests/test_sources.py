@@ -0,0 +1,124 @@
+# Record and replay of CertStream messages
+import json
+import threading
+import time
+
+import pytest
+
+from sources import MessageRecorder, ReplayServer, ReplaySource, certificate_key
+
+
+def certificate_update(i, seen):
+    return {'message_type': 'certificate_update', 'data': {
+        'cert_index': i, 'seen': seen,
+        'leaf_cert': {'all_domains': ['d{}.example.com'.format(i)], 'serial_number': '{:X}'.format(i),
+                      'issuer': {'aggregated': '/CN=Test CA'}}}}
+
+
+def heartbeat(timestamp):
+    return {'message_type': 'heartbeat', 'timestamp': timestamp}
+
+
+def record(path, messages):
+    recorder = MessageRecorder(str(path))
+    for i, message in enumerate(messages):
+        # Raw JSON text as with matcher workers, decoded messages otherwise
+        recorder.record(json.dumps(message) if i % 2 else message)
+    recorder.close()
+
+
+def replay(path, **kwargs):
+    received = []
+    ReplaySource(str(path), **kwargs).run(lambda message, context: received.append(message))
+    return received
+
+
+@pytest.mark.parametrize('name', ['recording.ndjson', 'recording.ndjson.gz'])
+def test_round_trip(tmp_path, name):
+    messages = [certificate_update(i, 1000.0 + i) for i in range(200)]
+    record(tmp_path / name, messages)
+    assert replay(tmp_path / name) == messages
+
+
+def test_heartbeats_skipped(tmp_path):
+    messages = [certificate_update(0, 1000.0), heartbeat(1000.5), certificate_update(1, 1001.0)]
+    record(tmp_path / 'recording.ndjson', messages)
+    assert replay(tmp_path / 'recording.ndjson') == [messages[0], messages[2]]
+    assert replay(tmp_path / 'recording.ndjson', skip_heartbeats=False) == messages
+
+
+def test_invalid_lines_skipped(tmp_path):
+    path = tmp_path / 'recording.ndjson'
+    record(path, [certificate_update(0, 1000.0)])
+    with open(path, 'a') as f:
+        f.write('{"truncated\n\n')
+    record(path, [certificate_update(1, 1001.0)])
+    assert [m['data']['cert_index'] for m in replay(path)] == [0, 1]
+
+
+def test_recording_appends(tmp_path):
+    path = tmp_path / 'recording.ndjson'
+    record(path, [certificate_update(0, 1000.0)])
+    record(path, [certificate_update(1, 1001.0)])
+    assert [m['data']['cert_index'] for m in replay(path)] == [0, 1]
+
+
+def test_replay_speed(tmp_path):
+    path = tmp_path / 'recording.ndjson'
+    # Two seconds of recording
+    record(path, [certificate_update(i, 1000.0 + i * 0.5) for i in range(5)])
+
+    start = time.time()
+    assert len(replay(path, speed=4)) == 5
+    assert 0.4 <= time.time() - start < 1.5
+
+    start = time.time()
+    assert len(replay(path, speed=0)) == 5
+    assert time.time() - start < 0.3
+
+
+def test_loop_and_stop(tmp_path):
+    path = tmp_path / 'recording.ndjson'
+    record(path, [certificate_update(i, 1000.0 + i) for i in range(3)])
+    source = ReplaySource(str(path), speed=0, loop=True)
+    received = []
+
+    def on_message(message, context):
+        received.append(message['data']['cert_index'])
+        if len(received) == 7:
+            source.stop()
+
+    source.run(on_message)
+    assert received == [0, 1, 2, 0, 1, 2, 0]
+
+
+def test_certificate_key():
+    assert certificate_key(certificate_update(10, 0)) == 'A//CN=Test CA'
+    assert certificate_key({'data': {'leaf_cert': {'fingerprint': 'AB:CD'}}}) == 'AB:CD'
+    assert certificate_key(heartbeat(0)) is None
+
+
+def test_replay_server(tmp_path):
+    websocket = pytest.importorskip('websocket')
+
+    path = tmp_path / 'recording.ndjson'
+    messages = [certificate_update(i, 1000.0 + i) for i in range(50)]
+    record(path, messages)
+
+    server = ReplayServer(str(path), port=0, speed=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        connection = websocket.create_connection(server.url, timeout=10)
+        received = []
+        while True:
+            opcode, data = connection.recv_data(control_frame=True)
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                break
+            received.append(json.loads(data))
+        connection.close()
+        assert received == messages
+    finally:
+        server.shutdown()
+        server.server_close()
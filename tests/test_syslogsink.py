@@ -0,0 +1,221 @@
+# Syslog output against the SyslogListener stand-in and a raw socket collector
+import re
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from syslogsink import SD_ID, SyslogListener, SyslogSender, format_message
+
+# <PRI>1 TIMESTAMP HOSTNAME APP-NAME PROCID MSGID [SD] BOM MSG
+RFC5424 = re.compile(br'^<(\d+)>1 (\S+) (\S+) (\S+) (\S+) (\S+) (\[.*\]) \xef\xbb\xbf(.*)$', re.S)
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def match_params(i):
+    return [('keyword', 'paypal'), ('fuzzer', 'Original*'), ('domain', 'd{}.example.com'.format(i)), ('scan_results_url', None)]
+
+
+def test_format_message():
+    timestamp = datetime(2019, 11, 26, 12, 30, 0, 123456, tzinfo=timezone.utc)
+    message = format_message([('keyword', 'pay"pal]'), ('domain', 'a\\b.com'), ('scan_results_url', None)], "Matched ü",
+                             facility=16, severity=4, hostname="my host", timestamp=timestamp)
+    fields = RFC5424.match(message).groups()
+    assert fields[0] == b'132'
+    assert fields[1] == b'2019-11-26T12:30:00.123456Z'
+    assert fields[2] == b'myhost'
+    assert fields[3] == b'certpipe'
+    assert fields[5] == b'match'
+    assert fields[6] == ('[' + SD_ID + ' keyword="pay\\"pal\\]" domain="a\\\\b.com"]').encode('utf-8')
+    assert fields[7].decode('utf-8') == "Matched ü"
+
+
+def test_udp():
+    received = []
+    listener = SyslogListener(port=0, protocol='udp', on_message=received.append)
+    listener.start()
+    sender = SyslogSender('127.0.0.1', listener.port, 'udp')
+    sender.start()
+    try:
+        sender.put(match_params(0), "Matched keyword paypal: d0.example.com")
+        sender.put(match_params(1), "x" * 5000)
+        assert wait_for(lambda: len(received) == 2)
+        assert b'domain="d0.example.com"' in received[0]
+        # Truncated rather than fragmented
+        assert len(received[1]) == 2048
+    finally:
+        sender.stop(5)
+        listener.stop()
+
+
+# Reads everything sent to it, for checking the bytes on the wire
+class RawCollector():
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.data = b""
+        self.connections = 0
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                self.data += chunk
+            connection.close()
+
+    def close(self):
+        self.sock.close()
+
+
+# Splits RFC 6587 octet-counted frames, failing on anything else
+def octet_frames(data):
+    frames = []
+    while data:
+        length, space, rest = data.partition(b" ")
+        assert space and length.isdigit(), data[:40]
+        frames.append(rest[:int(length)])
+        assert len(frames[-1]) == int(length)
+        data = rest[int(length):]
+    return frames
+
+
+def test_tcp_octet_counting():
+    collector = RawCollector()
+    sender = SyslogSender('127.0.0.1', collector.port, 'tcp', batch_size=10)
+    sender.start()
+    msgs = ["Matched keyword paypal: d{}.example.com\nsecond line".format(i) for i in range(25)]
+    for i, msg in enumerate(msgs):
+        sender.put(match_params(i), msg)
+    sender.stop(5)
+    assert wait_for(lambda: collector.data.count(b'second line') == 25)
+    collector.close()
+
+    frames = octet_frames(collector.data)
+    assert [RFC5424.match(frame).group(8).decode('utf-8') for frame in frames] == msgs
+    assert collector.connections == 1
+    assert sender.stats()['sent'] == 25
+
+
+def test_tcp_listener():
+    received = []
+    listener = SyslogListener(port=0, protocol='tcp', on_message=received.append)
+    listener.start()
+    sender = SyslogSender('127.0.0.1', listener.port, 'tcp')
+    sender.start()
+    try:
+        for i in range(100):
+            sender.put(match_params(i), "Matched {}".format(i))
+        assert wait_for(lambda: len(received) == 100)
+        assert [RFC5424.match(message).group(8) for message in received] == ["Matched {}".format(i).encode() for i in range(100)]
+    finally:
+        sender.stop(5)
+        listener.stop()
+
+
+def test_reconnects_when_the_collector_comes_up():
+    port = free_port()
+    sender = SyslogSender('127.0.0.1', port, 'tcp')
+    sender.start()
+    received = []
+    listener = None
+    try:
+        sender.put(match_params(0), "before")
+        # The first attempt is refused, the sender waits a second and retries
+        assert wait_for(lambda: sender.stats()['errors'] >= 1)
+        assert sender.stats()['queued'] == 1
+        listener = SyslogListener(port=port, protocol='tcp', on_message=received.append)
+        listener.start()
+        sender.put(match_params(1), "after")
+        assert wait_for(lambda: len(received) == 2)
+        assert [RFC5424.match(message).group(8) for message in received] == [b"before", b"after"]
+        assert sender.stats()['connects'] == 1
+    finally:
+        sender.stop(5)
+        if listener:
+            listener.stop()
+
+
+def test_full_queue_drops_the_oldest():
+    sender = SyslogSender('127.0.0.1', free_port(), 'tcp', queue_size=3)
+    for i in range(5):
+        sender.put(match_params(i), "m{}".format(i))
+    assert [msg for _, msg, _ in sender.queue] == ["m2", "m3", "m4"]
+    assert sender.stats()['dropped'] == 2
+
+
+@pytest.fixture
+def certificate(tmp_path):
+    if not shutil.which('openssl'):
+        pytest.skip("openssl is not installed")
+    certfile = str(tmp_path / 'cert.pem')
+    keyfile = str(tmp_path / 'key.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                           '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1', '-keyout', keyfile, '-out', certfile],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def test_tls(certificate):
+    certfile, keyfile = certificate
+    received = []
+    listener = SyslogListener(port=0, protocol='tls', on_message=received.append, certfile=certfile, keyfile=keyfile)
+    listener.start()
+    sender = SyslogSender('localhost', listener.port, 'tls', ca_file=certfile)
+    sender.start()
+    try:
+        for i in range(20):
+            sender.put(match_params(i), "Matched {}".format(i))
+        assert wait_for(lambda: len(received) == 20)
+        assert RFC5424.match(received[-1]).group(8) == b"Matched 19"
+        assert sender.stats()['errors'] == 0
+    finally:
+        sender.stop(5)
+        listener.stop()
+
+
+def test_tls_rejects_an_untrusted_collector(certificate):
+    certfile, keyfile = certificate
+    listener = SyslogListener(port=0, protocol='tls', on_message=lambda message: None, certfile=certfile, keyfile=keyfile)
+    listener.start()
+    # Verified against the system CAs, which do not include the self-signed certificate
+    sender = SyslogSender('localhost', listener.port, 'tls')
+    sender.start()
+    try:
+        sender.put(match_params(0), "Matched")
+        assert wait_for(lambda: sender.stats()['errors'] >= 1)
+        assert sender.stats()['sent'] == 0
+    finally:
+        sender.stop(5)
+        listener.stop()
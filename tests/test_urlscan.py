@@ -0,0 +1,189 @@
+# URLScanSubmitter against a local HTTP stand-in for the URLScan.io submission API
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from urlscan import URLScanSubmitter
+
+
+# Answers each submission with the next (status, headers) in responses, then with 200 once they run out
+class FakeURLScan():
+    def __init__(self, responses=(), delay=0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with fake.lock:
+                    fake.requests.append((time.time(), body['url'], self.headers.get('API-Key')))
+                    status, headers = fake.responses.pop(0) if fake.responses else (200, {})
+                time.sleep(fake.delay)
+                payload = {'result': "https://urlscan.io/result/{}/".format(body['url'])} if status == 200 else {}
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/api/v1/scan/".format(self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def results():
+    done = []
+
+    def on_complete(domain, scan_results_url):
+        done.append((domain, scan_results_url))
+    on_complete.done = done
+    return on_complete
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_submits_with_api_key(results):
+    fake = FakeURLScan()
+    submitter = URLScanSubmitter("secret", api_url=fake.url, workers=2, rate_limit=0, burst=5)
+    submitter.start()
+    try:
+        assert submitter.submit("example.com", results)
+        assert wait_for(lambda: results.done)
+        assert results.done == [("example.com", "https://urlscan.io/result/example.com/")]
+        assert fake.requests[0][1:] == ("example.com", "secret")
+        assert submitter.stats()['submitted'] == 1
+    finally:
+        submitter.stop(5)
+        fake.close()
+
+
+def test_rate_limit(results):
+    fake = FakeURLScan()
+    # One straight away, then one every 0.1s
+    submitter = URLScanSubmitter("key", api_url=fake.url, workers=3, rate_limit=10, burst=1)
+    submitter.start()
+    try:
+        for i in range(6):
+            assert submitter.submit("d{}.com".format(i), results)
+        assert wait_for(lambda: len(results.done) == 6)
+        times = sorted(t for t, _, _ in fake.requests)
+        assert times[-1] - times[0] >= 0.4
+    finally:
+        submitter.stop(5)
+        fake.close()
+
+
+def test_429_backs_off_and_retries(results):
+    fake = FakeURLScan([(429, {'Retry-After': '0.5'})])
+    submitter = URLScanSubmitter("key", api_url=fake.url, workers=1, rate_limit=0, burst=5, max_retries=2)
+    submitter.start()
+    try:
+        assert submitter.submit("example.com", results)
+        assert wait_for(lambda: results.done)
+        assert results.done == [("example.com", "https://urlscan.io/result/example.com/")]
+        assert len(fake.requests) == 2
+        assert fake.requests[1][0] - fake.requests[0][0] >= 0.4
+        assert submitter.stats()['rate_limited'] == 1
+    finally:
+        submitter.stop(5)
+        fake.close()
+
+
+def test_gives_up_after_retries(results):
+    fake = FakeURLScan([(500, {})] * 10)
+    submitter = URLScanSubmitter("key", api_url=fake.url, workers=1, rate_limit=0, burst=5, max_retries=1)
+    submitter.start()
+    try:
+        assert submitter.submit("example.com", results)
+        assert wait_for(lambda: results.done)
+        assert results.done == [("example.com", "")]
+        assert len(fake.requests) == 2
+        assert submitter.stats()['failed'] == 1
+    finally:
+        submitter.stop(5)
+        fake.close()
+
+
+def test_full_queue_is_refused(results):
+    fake = FakeURLScan()
+    submitter = URLScanSubmitter("key", api_url=fake.url, workers=1, queue_size=2)
+    try:
+        assert submitter.submit("a.com", results)
+        assert submitter.submit("b.com", results)
+        assert not submitter.submit("c.com", results)
+        assert submitter.stats()['dropped'] == 1
+    finally:
+        submitter.stop(1)
+        fake.close()
+
+
+def test_stop_reports_every_pending_domain(results):
+    # Slow responses and a slow rate, so domains are both in flight and queued when stopping
+    fake = FakeURLScan(delay=3)
+    submitter = URLScanSubmitter("key", api_url=fake.url, workers=2, queue_size=5, rate_limit=0.1, burst=2)
+    submitter.start()
+    domains = ["d{}.com".format(i) for i in range(5)]
+    for domain in domains:
+        assert submitter.submit(domain, results)
+    assert wait_for(lambda: len(fake.requests) == 2)
+
+    start = time.time()
+    submitter.stop(0.5)
+    assert time.time() - start < 2
+    assert sorted(domain for domain, _ in results.done) == domains
+    assert all(url == "" for _, url in results.done)
+    assert not submitter.submit("late.com", results)
+
+    # The submissions that were in flight finish later without reporting a second time
+    time.sleep(3)
+    assert len(results.done) == 5
+    fake.close()
+
+
+def test_submit_racing_stop_is_reported(results):
+    submitter = URLScanSubmitter("key", workers=1)
+    put_nowait = submitter.queue.put_nowait
+    stopping = threading.Event()
+
+    # Holds the submission between its stopping check and the put while stop() runs
+    def slow_put(item):
+        stopping.wait(1)
+        time.sleep(0.2)
+        put_nowait(item)
+    submitter.queue.put_nowait = slow_put
+
+    accepted = []
+    submitting = threading.Thread(target=lambda: accepted.append(submitter.submit("racing.com", results)))
+    submitting.start()
+    time.sleep(0.1)
+    stopping.set()
+    submitter.stop(1)
+    submitting.join()
+    assert accepted == [True]
+    assert results.done == [("racing.com", "")]
@@ -0,0 +1,158 @@
+# Live results page: the match buffer, the event stream and the JSON endpoint
+import http.client
+import json
+import time
+
+import pytest
+
+from webui import MatchFeed, serve_web_ui
+
+
+def publish(feed, count, keyword='paypal', fuzzer='Original*'):
+    for i in range(count):
+        feed.publish(keyword, fuzzer, '{}{}.example.com'.format(keyword, feed.published + 1))
+
+
+def test_ring_buffer_keeps_the_latest():
+    feed = MatchFeed(size=3)
+    publish(feed, 5)
+    assert [record_id for record_id, _ in feed.since()] == [3, 4, 5]
+    assert feed.since(4)[0][1]['domain'] == 'paypal5.example.com'
+    assert feed.since(5) == []
+    assert feed.stats() == {'published': 5, 'buffered': 3}
+
+
+def test_since_filters():
+    feed = MatchFeed()
+    feed.publish('paypal', 'Original*', 'paypal.example.com')
+    feed.publish('paypal', u'Homoglyph (а for a)', 'xn--pypl-53dc.com')
+    feed.publish('google', 'Omission', 'gogle.com')
+    feed.publish('google', 'Homoglyph', 'g00gle.com')
+    assert [r['domain'] for _, r in feed.since(keyword='google')] == ['gogle.com', 'g00gle.com']
+    # The fuzzer name without the details, in any case
+    assert [r['domain'] for _, r in feed.since(fuzzer='homoglyph')] == ['xn--pypl-53dc.com', 'g00gle.com']
+    assert [r['domain'] for _, r in feed.since(keyword='paypal', fuzzer='Homoglyph')] == ['xn--pypl-53dc.com']
+    assert [r['domain'] for _, r in feed.since(2, keyword='paypal')] == []
+
+
+def test_event_ids():
+    feed = MatchFeed()
+    publish(feed, 3)
+    assert feed.event_id('{}-2'.format(feed.run_id)) == 2
+    assert feed.event_id('{}-9'.format(feed.run_id)) == 3
+    assert feed.event_id(None) == 0
+    assert feed.event_id('2') == 0
+    assert feed.event_id('0-2') == 0
+    assert feed.event_id('{}-x'.format(feed.run_id)) == 0
+
+
+@pytest.fixture
+def web_ui():
+    feed = MatchFeed(size=100, notify_interval=0.01)
+    feed.start()
+    server = serve_web_ui(feed, port=0)
+    server.feed_port = server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', server.feed_port, timeout=5)
+    connection.request('GET', path, headers=headers or {})
+    return connection, connection.getresponse()
+
+
+# Reads count events from an open stream, as (id, data) pairs
+def read_events(response, count):
+    events = []
+    event = {}
+    while len(events) < count:
+        line = response.fp.readline().decode('utf-8')
+        assert line, "The event stream ended"
+        line = line.rstrip('\n')
+        if not line:
+            if 'data' in event:
+                events.append((event.get('id'), json.loads(event['data'])))
+            event = {}
+        elif not line.startswith(':'):
+            name, _, value = line.partition(': ')
+            event[name] = value
+    return events
+
+
+def test_matches_json(web_ui):
+    publish(web_ui.feed, 2)
+    publish(web_ui.feed, 1, keyword='google')
+    connection, response = get(web_ui, '/matches.json?keyword=paypal')
+    assert response.status == 200
+    assert [r['domain'] for r in json.loads(response.read())] == ['paypal1.example.com', 'paypal2.example.com']
+    connection.close()
+
+
+def test_event_stream_and_resume(web_ui):
+    feed = web_ui.feed
+    publish(feed, 3)
+    connection, response = get(web_ui, '/events')
+    assert response.status == 200
+    assert response.getheader('Content-Type') == 'text/event-stream'
+    events = read_events(response, 3)
+    assert [data['domain'] for _, data in events] == ['paypal1.example.com', 'paypal2.example.com', 'paypal3.example.com']
+
+    # Live matches follow
+    publish(feed, 1)
+    last_id, data = read_events(response, 1)[0]
+    assert data['domain'] == 'paypal4.example.com'
+    response.close()
+
+    # A reconnecting browser only gets what it missed
+    publish(feed, 1)
+    connection, response = get(web_ui, '/events', {'Last-Event-ID': last_id})
+    assert [data['domain'] for _, data in read_events(response, 1)] == ['paypal5.example.com']
+    response.close()
+
+
+def test_resume_with_an_id_from_before_a_restart(web_ui):
+    publish(web_ui.feed, 2)
+    # Ids of another run, even ones this run has also reached, start the stream over
+    for last_id in ('0-1', '1', '{:x}-1'.format(int(web_ui.feed.run_id, 16) - 1)):
+        connection, response = get(web_ui, '/events', {'Last-Event-ID': last_id})
+        assert [data['domain'] for _, data in read_events(response, 2)] == ['paypal1.example.com', 'paypal2.example.com']
+        response.close()
+
+
+def test_too_many_viewers(web_ui):
+    web_ui.max_viewers = 2
+    publish(web_ui.feed, 1)
+    streams = []
+    for _ in range(2):
+        connection, response = get(web_ui, '/events')
+        read_events(response, 1)
+        streams.append(response)
+    connection, response = get(web_ui, '/events')
+    assert response.status == 503
+    connection.close()
+
+    # A viewer leaving makes room for another, noticed when the next match fails to reach it
+    streams.pop().close()
+    for _ in range(100):
+        publish(web_ui.feed, 1)
+        time.sleep(0.05)
+        connection, response = get(web_ui, '/events')
+        if response.status == 200:
+            break
+        connection.close()
+    assert response.status == 200
+    response.close()
+    for stream in streams:
+        stream.close()
+
+
+def test_page_and_not_found(web_ui):
+    connection, response = get(web_ui, '/')
+    assert response.status == 200
+    assert b'EventSource' in response.read()
+    connection.close()
+    connection, response = get(web_ui, '/nothing')
+    assert response.status == 404
+    connection.close()
@@ -0,0 +1,255 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Background URLScan.io submission. Domains are queued by the CertStream thread
+and submitted by a small pool of worker threads, each holding a keep-alive
+session, behind a shared token bucket that follows URLScan's rate limit headers.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+
+logger = logging.getLogger("certpipe.urlscan")
+
+URLSCANIO_API_URL = "https://urlscan.io/api/v1/scan/"
+
+
+# Token bucket shared by all workers. pause() stops every worker until the given time, used for Retry-After.
+class TokenBucket():
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self.tokens = 0
+
+    # Blocks until a token is available. Returns False if stop_event was set while waiting.
+    def acquire(self, stop_event):
+        while not stop_event.is_set():
+            with self.lock:
+                now = time.time()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    if self.rate > 0:
+                        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    else:
+                        self.tokens = self.burst
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+            stop_event.wait(min(wait, 1.0))
+        return False
+
+
+class URLScanSubmitter():
+    def __init__(self, api_key, api_url=URLSCANIO_API_URL, workers=2, queue_size=1000,
+                 rate_limit=1.0, burst=5, max_retries=3, timeout=30):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.num_workers = workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.stopping = False
+        # Held while checking stopping and queueing, so nothing is queued after stop() has drained the queue
+        self.submit_lock = threading.Lock()
+        self.workers = []
+        # Domains taken by a worker and not yet reported, id -> (domain, on_complete)
+        self.in_flight = {}
+        self.next_id = 0
+        self.submitted = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self.stats_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._run, name="urlscan-{}".format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    # Queue a domain without blocking. on_complete(domain, scan_results_url) is called from a worker thread
+    # once the submission finishes, with an empty URL on failure. Returns False if the queue is full or the
+    # submitter is stopping.
+    def submit(self, domain, on_complete):
+        with self.submit_lock:
+            if self.stopping:
+                return False
+            try:
+                self.queue.put_nowait((domain, on_complete))
+                return True
+            except queue.Full:
+                pass
+        self._count('dropped')
+        return False
+
+    # Stop accepting work. Queued domains are reported straight away without a scan, submissions already running
+    # get up to timeout seconds to finish and are reported without a scan after that. Every queued domain is
+    # reported exactly once.
+    def stop(self, timeout=None):
+        with self.submit_lock:
+            self.stopping = True
+        # Wakes workers waiting on the rate limit, their domain is reported without a scan
+        self.stop_event.set()
+
+        while True:
+            try:
+                domain, on_complete = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._count('failed')
+            _complete(domain, on_complete, "")
+
+        deadline = time.time() + timeout if timeout is not None else None
+        for worker in self.workers:
+            worker.join(None if deadline is None else max(0, deadline - time.time()))
+
+        with self.stats_lock:
+            abandoned = list(self.in_flight.values())
+            self.in_flight.clear()
+        if abandoned:
+            logger.warning("URLScan.io shutdown: reporting {} unfinished submissions without a scan".format(len(abandoned)))
+        for domain, on_complete in abandoned:
+            self._count('failed')
+            _complete(domain, on_complete, "")
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'queued': self.queue.qsize(),
+                'submitted': self.submitted,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'rate_limited': self.rate_limited
+            }
+
+    def _count(self, name):
+        with self.stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _run(self):
+        session = requests.Session()
+        session.headers.update({'Content-Type': 'application/json', 'API-Key': self.api_key})
+
+        while not self.stop_event.is_set():
+            try:
+                domain, on_complete = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            with self.stats_lock:
+                submission = self.next_id
+                self.next_id += 1
+                self.in_flight[submission] = (domain, on_complete)
+
+            scan_results_url = ""
+            try:
+                scan_results_url = self._submit(session, domain)
+            except Exception as e:
+                logger.error("URLScan.io submission error for {}: {}".format(domain, e))
+
+            # stop() reports it instead once it gave up waiting
+            with self.stats_lock:
+                if self.in_flight.pop(submission, None) is None:
+                    continue
+                if scan_results_url:
+                    self.submitted += 1
+                else:
+                    self.failed += 1
+
+            _complete(domain, on_complete, scan_results_url)
+
+        session.close()
+
+    def _submit(self, session, domain):
+        payload = {'url': domain, 'public': 'on'}
+
+        for attempt in range(self.max_retries + 1):
+            if not self.bucket.acquire(self.stop_event):
+                return ""
+
+            resp = session.post(self.api_url, json=payload, timeout=self.timeout, verify=True)
+            self._follow_rate_limit_headers(resp)
+
+            if resp.ok:
+                logger.info("Domain submitted to URLScan.io: {}".format(domain))
+                logger.info("Scan results URL: " + str(resp.json()['result']))
+                return resp.json()['result']
+
+            if resp.status_code == 429:
+                self._count('rate_limited')
+                logger.warning("URLScan.io rate limit reached, retrying {} ({}/{})".format(domain, attempt + 1, self.max_retries))
+                continue
+
+            if resp.status_code >= 500:
+                self.bucket.pause(2 ** attempt)
+                continue
+
+            break
+
+        logger.info("Domain unable to be scanned by URLScan.io: {}".format(domain))
+        return ""
+
+    # URLScan sends Retry-After on 429 responses and X-Rate-Limit-* headers on every response
+    def _follow_rate_limit_headers(self, resp):
+        wait = _header_seconds(resp.headers.get('Retry-After'))
+
+        if wait is None and resp.headers.get('X-Rate-Limit-Remaining') == '0':
+            wait = _header_seconds(resp.headers.get('X-Rate-Limit-Reset-After'))
+
+        if wait is None and resp.status_code == 429:
+            wait = 60
+
+        if wait:
+            self.bucket.pause(wait)
+
+
+def _complete(domain, on_complete, scan_results_url):
+    try:
+        on_complete(domain, scan_results_url)
+    except Exception:
+        logger.exception("URLScan.io result callback failed for {}".format(domain))
+
+
+def _header_seconds(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,295 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+###########################################################################
+#
+# Copyright 2019 Devin Calado
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################################################################
+
+"""
+Live results web page. The last matches are kept in a ring buffer in memory
+and streamed to browsers with Server-Sent Events.
+
+    /                   the live results page
+    /events             Server-Sent Events stream of matches
+    /matches.json       the matches in the buffer as JSON
+
+/events and /matches.json take keyword= and fuzzer= to only return those
+matches (fuzzer compares the fuzzer name, e.g. fuzzer=Homoglyph). /events
+starts with the buffered matches, or those after the Last-Event-ID a
+reconnecting browser sends. Event ids carry an id of the run, so an id from
+before a restart starts the stream over instead of skipping matches.
+
+publish() only appends to the buffer, whatever the number of viewers. A
+notifier thread wakes the viewers, and each viewer is served on its own
+thread, so a slow browser only delays itself.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+logger = logging.getLogger("certpipe.webui")
+
+# Seconds between keep-alive comments on an idle event stream, so proxies and browsers keep it open
+KEEPALIVE_INTERVAL = 15
+
+
+class MatchFeed():
+    # size is the number of matches kept, notify_interval how often at most, in seconds, viewers are woken
+    def __init__(self, size=1000, notify_interval=0.25):
+        self.size = size
+        self.notify_interval = notify_interval
+        self.published = 0
+        # Prefix of the event ids, different for every run
+        self.run_id = format(int(time.time() * 1000), 'x')
+        self._buffer = deque(maxlen=size)
+        self._lock = threading.Lock()
+        # Viewers wait on their own condition, so waking them never holds up publish()
+        self._changed = threading.Condition()
+        self._notified = 0
+        self.thread = threading.Thread(target=self._run, name="web-ui-notifier")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    # Adds a match to the buffer. Safe to call from any thread, never waits on the viewers.
+    def publish(self, keyword, fuzzer, domain, scan_results_url=""):
+        record = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'keyword': keyword,
+            'fuzzer': fuzzer,
+            'domain': domain,
+            'scan_results_url': scan_results_url
+        }
+        with self._lock:
+            self.published += 1
+            self._buffer.append((self.published, record))
+
+    # The buffered (id, record) pairs after after_id, oldest first, only those for the keyword and fuzzer when given
+    def since(self, after_id=0, keyword=None, fuzzer=None):
+        with self._lock:
+            if not self._buffer or self._buffer[-1][0] <= after_id:
+                return []
+            records = list(self._buffer)
+        return [(record_id, record) for record_id, record in records
+                if record_id > after_id and _wanted(record, keyword, fuzzer)]
+
+    # The match id in an event id of this run, or 0 for an event id of another run or none at all
+    def event_id(self, value):
+        run_id, _, record_id = (value or "").rpartition('-')
+        if run_id != self.run_id or not record_id.isdigit():
+            return 0
+        return min(int(record_id), self.published)
+
+    # Waits until matches after after_id were published, or timeout seconds
+    def wait(self, after_id, timeout):
+        with self._changed:
+            if self._notified <= after_id:
+                self._changed.wait(timeout)
+
+    def _run(self):
+        while True:
+            time.sleep(self.notify_interval)
+            published = self.published
+            if published != self._notified:
+                with self._changed:
+                    self._notified = published
+                    self._changed.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'published': self.published,
+                'buffered': len(self._buffer)
+            }
+
+
+def _wanted(record, keyword, fuzzer):
+    if keyword and record['keyword'] != keyword:
+        return False
+    if fuzzer and (record['fuzzer'] or "").split(" (")[0].lower() != fuzzer.lower():
+        return False
+    return True
+
+
+class _WebUIHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = dict((name, values[0]) for name, values in parse_qs(url.query).items())
+        if url.path == '/':
+            self._send(200, 'text/html; charset=utf-8', PAGE.encode('utf-8'))
+        elif url.path == '/matches.json':
+            records = [record for _, record in self.server.feed.since(0, query.get('keyword'), query.get('fuzzer'))]
+            self._send(200, 'application/json', json.dumps(records).encode('utf-8'))
+        elif url.path == '/events':
+            self._events(query)
+        else:
+            self.send_error(404)
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _events(self, query):
+        server = self.server
+        with server.viewers_lock:
+            if server.viewers >= server.max_viewers:
+                self.send_error(503, "Too many viewers")
+                return
+            server.viewers += 1
+
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(b"retry: 3000\n\n")
+
+            last_id = server.feed.event_id(self.headers.get('Last-Event-ID'))
+            keyword = query.get('keyword')
+            fuzzer = query.get('fuzzer')
+            last_write = time.time()
+
+            while True:
+                # Read first, anything published after it is either in records or after last_id for the next round
+                published = server.feed.published
+                records = server.feed.since(last_id, keyword, fuzzer)
+                if records:
+                    run_id = server.feed.run_id
+                    self.wfile.write("".join("id: {}-{}\ndata: {}\n\n".format(run_id, record_id, json.dumps(record))
+                                             for record_id, record in records).encode('utf-8'))
+                    self.wfile.flush()
+                    last_write = time.time()
+                elif time.time() - last_write >= KEEPALIVE_INTERVAL:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    last_write = time.time()
+                # Matches filtered out still move the stream along
+                last_id = max([last_id, published] + [record_id for record_id, _ in records[-1:]])
+                server.feed.wait(last_id, KEEPALIVE_INTERVAL)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with server.viewers_lock:
+                server.viewers -= 1
+
+    def log_message(self, format, *args):
+        logger.debug("Web UI request: " + format % args)
+
+
+# Serves the live results page for feed on a daemon thread. Returns the server so it can be shut down.
+def serve_web_ui(feed, host="127.0.0.1", port=8080, max_viewers=50):
+    server = ThreadingHTTPServer((host, port), _WebUIHandler)
+    server.daemon_threads = True
+    server.feed = feed
+    server.max_viewers = max_viewers
+    server.viewers = 0
+    server.viewers_lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, name="web-ui-http")
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>CertPipe live results</title>
+<style>
+body { font-family: sans-serif; margin: 1em 2em; }
+table { border-collapse: collapse; width: 100%; }
+th, td { text-align: left; padding: 0.2em 0.6em; border-bottom: 1px solid #ddd; font-size: 0.9em; }
+td.domain { font-family: monospace; }
+#status { color: #888; margin-left: 1em; }
+</style>
+</head>
+<body>
+<h2>CertPipe live results</h2>
+<form id="filters">
+Keyword <input name="keyword" size="15">
+Fuzzer <input name="fuzzer" size="15">
+<button>Filter</button>
+<span id="status">connecting</span>
+</form>
+<table>
+<thead><tr><th>Time</th><th>Keyword</th><th>Fuzzer</th><th>Domain</th><th>Scan results</th></tr></thead>
+<tbody id="matches"></tbody>
+</table>
+<script>
+var MAX_ROWS = 1000;
+var source = null;
+
+function cell(row, text, className) {
+    var td = row.insertCell();
+    td.textContent = text || "";
+    if (className) td.className = className;
+    return td;
+}
+
+function addMatch(match) {
+    var rows = document.getElementById("matches");
+    var row = rows.insertRow(0);
+    cell(row, match.timestamp.replace("T", " "));
+    cell(row, match.keyword);
+    cell(row, match.fuzzer);
+    cell(row, match.domain, "domain");
+    var scan = cell(row, "");
+    if (match.scan_results_url) {
+        var link = document.createElement("a");
+        link.href = match.scan_results_url;
+        link.textContent = "urlscan.io";
+        link.rel = "noopener noreferrer";
+        scan.appendChild(link);
+    }
+    while (rows.rows.length > MAX_ROWS) rows.deleteRow(-1);
+}
+
+function connect() {
+    if (source) source.close();
+    document.getElementById("matches").innerHTML = "";
+    var form = document.getElementById("filters");
+    var query = new URLSearchParams();
+    ["keyword", "fuzzer"].forEach(function (name) {
+        if (form[name].value) query.set(name, form[name].value);
+    });
+    source = new EventSource("events?" + query.toString());
+    var status = document.getElementById("status");
+    source.onopen = function () { status.textContent = "live"; };
+    source.onerror = function () { status.textContent = "reconnecting"; };
+    source.onmessage = function (event) { addMatch(JSON.parse(event.data)); };
+}
+
+document.getElementById("filters").onsubmit = function (event) {
+    event.preventDefault();
+    connect();
+};
+connect();
+</script>
+</body>
+</html>
+"""